@@ -0,0 +1,339 @@
+﻿import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+# Columns written by download_data.py, stored one typed array per column
+OHLCV_COLUMNS = {
+    'timestamp': np.int64,
+    'open': np.float64,
+    'high': np.float64,
+    'low': np.float64,
+    'close': np.float64,
+    'volume': np.float64
+}
+METADATA_FILE = 'metadata.json'
+
+TimeBound = Union[int, str, pd.Timestamp, np.datetime64, None]
+
+def dataset_path(csv_path: str) -> str:
+    '''Directory holding the columnar copy of a CSV, next to it'''
+    return os.path.splitext(csv_path)[0] + '.columns'
+
+def convert_csv(csv_path: str, out_dir: Optional[str] = None) -> str:
+    '''
+    Convert a downloaded candle CSV into one .npy file per column
+    
+    Rows are stored sorted by timestamp so date ranges can be found with a
+    binary search. The copy is rewritten by load_ohlcv once the CSV changes.
+    '''
+    out_dir = out_dir or dataset_path(csv_path)
+    
+    df = pd.read_csv(csv_path, dtype={name: dtype for name, dtype in OHLCV_COLUMNS.items() if name != 'timestamp'})
+    if 'timestamp' in df:
+        timestamps = df['timestamp'].to_numpy(dtype=np.int64)
+    else:
+        timestamps = pd.to_datetime(df['datetime']).to_numpy(dtype='datetime64[ms]').view(np.int64)
+    
+    order = None
+    if len(timestamps) > 1 and np.any(np.diff(timestamps) < 0):
+        order = np.argsort(timestamps, kind='stable')
+    
+    columns = {}
+    for name, dtype in OHLCV_COLUMNS.items():
+        if name == 'timestamp':
+            values = timestamps
+        elif name in df:
+            values = df[name].to_numpy(dtype=dtype)
+        else:
+            continue
+        columns[name] = values if order is None else values[order]
+    
+    write_columns(out_dir, columns, csv_path)
+    return out_dir
+
+def write_columns(out_dir: str, columns: Dict[str, np.ndarray], source_path: str, **extra_metadata):
+    '''
+    Write arrays as one .npy file per column, readable by load_ohlcv
+    
+    columns must include a sorted 'timestamp' column. metadata.json is
+    written last and records the size and mtime of source_path, which
+    is_current compares against.
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    metadata_path = os.path.join(out_dir, METADATA_FILE)
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)  # Readers treat a dataset without metadata as missing
+    
+    for name, values in columns.items():
+        np.save(os.path.join(out_dir, name + '.npy'), np.ascontiguousarray(values))
+    
+    timestamps = columns['timestamp']
+    stat = os.stat(source_path)
+    metadata = {
+        'rows': len(timestamps),
+        'columns': list(columns),
+        'source': os.path.basename(source_path),
+        'source_size': stat.st_size,
+        'source_mtime_ns': stat.st_mtime_ns,
+        'start': int(timestamps[0]) if len(timestamps) else None,
+        'end': int(timestamps[-1]) if len(timestamps) else None,
+        **extra_metadata
+    }
+    with open(metadata_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+def is_current(path: str, source_path: str) -> bool:
+    '''Whether the dataset at path was written from source_path as it is now'''
+    return not _is_stale(source_path, _read_metadata(path))
+
+def _read_metadata(path: str) -> Optional[Dict]:
+    metadata_path = os.path.join(path, METADATA_FILE)
+    if not os.path.exists(metadata_path):
+        return None
+    with open(metadata_path) as f:
+        return json.load(f)
+
+def _is_stale(csv_path: str, metadata: Optional[Dict]) -> bool:
+    if metadata is None:
+        return True
+    stat = os.stat(csv_path)
+    return metadata['source_size'] != stat.st_size or metadata['source_mtime_ns'] != stat.st_mtime_ns
+
+def _to_epoch_ms(value: TimeBound) -> Optional[int]:
+    '''Epoch milliseconds for ints, or for anything pd.Timestamp accepts (naive means UTC)'''
+    if value is None:
+        return None
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    return int(pd.Timestamp(value).value // 1_000_000)
+
+def load_ohlcv(source: str, columns: Optional[Iterable[str]] = None,
+               start: TimeBound = None, end: TimeBound = None,
+               as_frame: bool = True) -> Union[pd.DataFrame, Dict[str, np.ndarray]]:
+    '''
+    Load candles from a CSV or a directory written by convert_csv
+    
+    A CSV path is converted on first use, and again whenever the CSV changes.
+    Only the requested columns are opened - memory-mapped - and start/end
+    (start inclusive, end exclusive) are resolved with a binary search on the
+    timestamp column, so rows outside the range are never read. 'datetime'
+    is derived from the timestamps when requested.
+    
+    With as_frame=False the stored columns are returned as read-only memmap
+    slices instead of being copied into a DataFrame.
+    '''
+    if os.path.isdir(source):
+        path = source
+        metadata = _read_metadata(path)
+        if metadata is None:
+            raise FileNotFoundError(f'No columnar dataset at {path}')
+    else:
+        path = dataset_path(source)
+        metadata = _read_metadata(path)
+        if _is_stale(source, metadata):
+            convert_csv(source, path)
+            metadata = _read_metadata(path)
+    
+    if columns is None:
+        columns = ['datetime'] + metadata['columns']
+    columns = list(columns)
+    unknown = set(columns) - set(metadata['columns']) - {'datetime'}
+    if unknown:
+        raise KeyError(f'Unknown columns {sorted(unknown)}, dataset has {metadata["columns"]}')
+    
+    timestamps = np.load(os.path.join(path, 'timestamp.npy'), mmap_mode='r')
+    lo, hi = 0, len(timestamps)
+    start_ms, end_ms = _to_epoch_ms(start), _to_epoch_ms(end)
+    if start_ms is not None:
+        lo = int(np.searchsorted(timestamps, start_ms, side='left'))
+    if end_ms is not None:
+        hi = max(lo, int(np.searchsorted(timestamps, end_ms, side='left')))
+    
+    arrays = {}
+    for name in columns:
+        if name == 'datetime':
+            arrays[name] = timestamps[lo:hi].astype('datetime64[ms]')
+        else:
+            arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')[lo:hi]
+    
+    if not as_frame:
+        return arrays
+    
+    return pd.DataFrame({name: np.asarray(values) for name, values in arrays.items()})
+
+TIMEFRAME_UNITS_MS = {'m': 60_000, 'h': 3_600_000, 'd': 86_400_000, 'w': 604_800_000}
+
+def timeframe_to_ms(timeframe: str) -> int:
+    '''Bar length of a ccxt timeframe string such as '15m' or '1h' in milliseconds'''
+    return int(timeframe[:-1]) * TIMEFRAME_UNITS_MS[timeframe[-1]]
+
+class RateLimiter:
+    '''Spaces calls from any number of threads at least 1 / rate seconds apart'''
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+    
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_time)
+            self._next_time = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class DownloadError(Exception):
+    '''A chunk kept failing - partial holds the candles fetched before the first failed chunk'''
+    
+    def __init__(self, message: str, partial: np.ndarray):
+        super().__init__(message)
+        self.partial = partial
+
+class OHLCVDownloader:
+    '''
+    Chunked, concurrent and incremental candle downloader
+    
+    The requested range is split into chunks of chunk_bars candles that a
+    thread pool fetches in parallel, each request passing through a shared
+    rate limiter and retried with exponential backoff. Results are sorted,
+    deduplicated on timestamp and checked for gaps. exchange is anything with
+    a ccxt-style fetch_ohlcv(symbol, timeframe, since, limit) returning
+    [timestamp, open, high, low, close, volume] rows.
+    '''
+    COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+    
+    def __init__(self, exchange, symbol: str = 'BTC/USD', timeframe: str = '15m',
+                 batch_limit: int = 300, chunk_bars: int = 3000, max_workers: int = 4,
+                 requests_per_second: float = 5.0, max_retries: int = 3, retry_delay: float = 1.0):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.timeframe_ms = timeframe_to_ms(timeframe)
+        self.batch_limit = batch_limit
+        self.chunk_bars = chunk_bars
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+    
+    def _fetch_batch(self, since: int, limit: int) -> list:
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.wait()
+            try:
+                return self.exchange.fetch_ohlcv(self.symbol, self.timeframe, since=since, limit=limit)
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.retry_delay * 2 ** attempt)
+    
+    def _fetch_chunk(self, start_ms: int, end_ms: int) -> np.ndarray:
+        '''Candles with start_ms <= timestamp < end_ms, paging through batch_limit at a time'''
+        rows = []
+        since = start_ms
+        while since < end_ms:
+            # Always a full page - a limit cut to the bars left would lose the last one
+            # on exchanges that start a page one candle before since
+            batch = self._fetch_batch(since, self.batch_limit)
+            if not batch:
+                break  # Nothing more in this chunk - gap_check reports the hole
+            rows.extend(batch)
+            # Resume after the last candle, moving at least one bar so an exchange
+            # that only returns older candles can't stall the loop
+            since = max(int(batch[-1][0]), since) + self.timeframe_ms
+        
+        candles = np.array(rows, dtype=np.float64).reshape(-1, len(self.COLUMNS))
+        in_range = (candles[:, 0] >= start_ms) & (candles[:, 0] < end_ms)
+        return candles[in_range]
+    
+    def fetch_range(self, start_ms: int, end_ms: int) -> np.ndarray:
+        '''
+        Candles with start_ms <= timestamp < end_ms as a sorted, deduplicated (n, 6) array
+        
+        If a chunk still fails after the retries, DownloadError carries every
+        candle before that chunk so the caller can keep a gap-free prefix.
+        '''
+        chunk_ms = self.chunk_bars * self.timeframe_ms
+        bounds = [(lo, min(lo + chunk_ms, end_ms)) for lo in range(start_ms, end_ms, chunk_ms)]
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self._fetch_chunk, lo, hi) for lo, hi in bounds]
+            chunks = []
+            for (lo, hi), future in zip(bounds, futures):
+                try:
+                    chunks.append(future.result())
+                except Exception as e:
+                    for pending in futures:
+                        pending.cancel()
+                    partial = self.deduplicate(np.concatenate(chunks)) if chunks else self._empty()
+                    raise DownloadError(f'Chunk starting at {lo} failed: {e}', partial) from e
+        
+        return self.deduplicate(np.concatenate(chunks)) if chunks else self._empty()
+    
+    def _empty(self) -> np.ndarray:
+        return np.empty((0, len(self.COLUMNS)))
+    
+    @staticmethod
+    def deduplicate(candles: np.ndarray) -> np.ndarray:
+        '''Sort by timestamp, keeping the last row received for each timestamp'''
+        order = np.argsort(candles[:, 0], kind='stable')
+        candles = candles[order]
+        keep = np.ones(len(candles), dtype=bool)
+        keep[:-1] = candles[1:, 0] != candles[:-1, 0]
+        return candles[keep]
+    
+    def gap_check(self, timestamps: np.ndarray) -> List[Tuple[int, int]]:
+        '''(last timestamp before, first timestamp after) for each hole in a sorted series'''
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        holes = np.flatnonzero(np.diff(timestamps) > self.timeframe_ms)
+        return [(int(timestamps[i]), int(timestamps[i + 1])) for i in holes]
+    
+    def to_frame(self, candles: np.ndarray) -> pd.DataFrame:
+        '''Same layout download_data.py has always written'''
+        df = pd.DataFrame(candles, columns=self.COLUMNS)
+        df['timestamp'] = df['timestamp'].astype(np.int64)
+        df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
+        return df[['datetime'] + self.COLUMNS]
+    
+    def download(self, csv_path: str, start_ms: int, end_ms: Optional[int] = None,
+                 incremental: bool = True) -> pd.DataFrame:
+        '''
+        Download [start_ms, end_ms) into csv_path and refresh its columnar copy
+        
+        In incremental mode an existing file is kept and only candles after its
+        last timestamp are fetched and appended. When a chunk fails for good,
+        the candles before it are still saved, so the next incremental run
+        resumes from there, and DownloadError is raised.
+        '''
+        end_ms = end_ms if end_ms is not None else int(time.time() * 1000)
+        # Only whole bars - the one still forming would be stored half-built
+        end_ms -= end_ms % self.timeframe_ms
+        
+        existing = None
+        if incremental and os.path.exists(csv_path):
+            existing = load_ohlcv(csv_path, columns=self.COLUMNS, as_frame=False)
+            if len(existing['timestamp']):
+                start_ms = max(start_ms, int(existing['timestamp'][-1]) + 1)
+        
+        error = None
+        try:
+            candles = self.fetch_range(start_ms, end_ms) if start_ms < end_ms else self._empty()
+        except DownloadError as e:
+            candles, error = e.partial, e
+        
+        new_rows = self.to_frame(candles)
+        os.makedirs(os.path.dirname(csv_path) or '.', exist_ok=True)
+        if existing is not None:
+            new_rows.to_csv(csv_path, mode='a', header=False, index=False)
+        else:
+            new_rows.to_csv(csv_path, index=False)
+        convert_csv(csv_path)
+        
+        if error is not None:
+            raise error
+        return new_rows
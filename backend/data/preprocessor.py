@@ -0,0 +1,351 @@
+﻿import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Mapping, Optional, Sequence
+
+from data.fetcher import OHLCV_COLUMNS, is_current, load_ohlcv, timeframe_to_ms, write_columns
+from rl.features import FeatureEngineering
+from rl.market_data import MarketArrays, hour_of_day, timestamps_ms
+
+TIMEFRAMES = ('15m', '1h', '4h', '1d')
+
+def resample_ohlcv(candles: Mapping[str, np.ndarray], timeframe: str) -> Dict[str, np.ndarray]:
+    '''
+    Aggregate sorted candles into bars of a longer timeframe
+    
+    Bars are aligned to the epoch (so 1d bars start at midnight UTC) and
+    built with one reduceat per column. Any subset of the OHLCV columns
+    works as long as 'timestamp' is present; 'bars' counts the source
+    candles in each bar so partial bars at the edges or around gaps show.
+    '''
+    bar_ms = timeframe_to_ms(timeframe)
+    timestamps = np.asarray(candles['timestamp'], dtype=np.int64)
+    if len(timestamps) == 0:
+        return {name: np.asarray(values)[:0] for name, values in candles.items()} | {'bars': np.zeros(0, np.int64)}
+    
+    bucket = timestamps - timestamps % bar_ms
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(bucket)]
+    
+    bars = {'timestamp': bucket[starts]}
+    if 'open' in candles:
+        bars['open'] = np.asarray(candles['open'])[starts]
+    if 'high' in candles:
+        bars['high'] = np.maximum.reduceat(np.asarray(candles['high']), starts)
+    if 'low' in candles:
+        bars['low'] = np.minimum.reduceat(np.asarray(candles['low']), starts)
+    if 'close' in candles:
+        bars['close'] = np.asarray(candles['close'])[ends - 1]
+    if 'volume' in candles:
+        bars['volume'] = np.add.reduceat(np.asarray(candles['volume']), starts)
+    bars['bars'] = np.add.reduceat(np.asarray(candles.get('bars', np.ones(len(bucket), np.int64))), starts)
+    return bars
+
+def resample_all(candles: Mapping[str, np.ndarray], timeframes: Iterable[str]) -> Dict[str, Dict[str, np.ndarray]]:
+    '''
+    Bars for several timeframes, each built from the finest one that divides it
+    
+    Going 15m -> 1h -> 4h -> 1d keeps every step small instead of
+    re-aggregating the full-resolution series for each timeframe.
+    '''
+    results = {}
+    for timeframe in sorted(timeframes, key=timeframe_to_ms):
+        bar_ms = timeframe_to_ms(timeframe)
+        source = candles
+        for finer, bars in results.items():
+            if bar_ms % timeframe_to_ms(finer) == 0:
+                source = bars
+        results[timeframe] = resample_ohlcv(source, timeframe)
+    return results
+
+def timeframe_path(csv_path: str, timeframe: str) -> str:
+    '''Directory caching the timeframe bars built from a candle CSV'''
+    return f'{os.path.splitext(csv_path)[0]}.{timeframe}.columns'
+
+def load_bars(csv_path: str, timeframe: str, columns: Optional[Iterable[str]] = None,
+              start=None, end=None, timeframes: Sequence[str] = TIMEFRAMES):
+    '''
+    Load bars of one timeframe built from a finer candle CSV
+    
+    On a miss, or once the CSV has changed, every timeframe in timeframes
+    is rebuilt in one pass and cached as columnar datasets next to the CSV.
+    Arguments after timeframe are passed on to load_ohlcv.
+    '''
+    path = timeframe_path(csv_path, timeframe)
+    if not is_current(path, csv_path):
+        candles = load_ohlcv(csv_path, columns=list(OHLCV_COLUMNS), as_frame=False)
+        for name, bars in resample_all(candles, set(timeframes) | {timeframe}).items():
+            write_columns(timeframe_path(csv_path, name), bars, csv_path, timeframe=name)
+    return load_ohlcv(path, columns=columns, start=start, end=end)
+
+def build_timeframe_features(price_data: pd.DataFrame, feature_engineer: FeatureEngineering) -> Optional[np.ndarray]:
+    '''Aligned features of feature_engineer.higher_timeframes for every row of price_data'''
+    if not feature_engineer.higher_timeframes:
+        return None
+    
+    candles = {
+        'timestamp': timestamps_ms(price_data),
+        'close': np.ascontiguousarray(price_data['close'].values, dtype=np.float64)
+    }
+    resampled = resample_all(candles, feature_engineer.higher_timeframes)
+    bars = [
+        (resampled[name]['timestamp'], resampled[name]['close'], timeframe_to_ms(name))
+        for name in feature_engineer.higher_timeframes
+    ]
+    return feature_engineer.compute_timeframe_features(candles['timestamp'], bars)
+
+class DataQualityReport:
+    '''Counts of the problems validate_ohlcv/repair_ohlcv found, plus the gaps themselves'''
+    
+    def __init__(self, rows: int, interval_ms: int):
+        self.rows = rows
+        self.interval_ms = interval_ms
+        self.out_of_order = 0
+        self.duplicates = 0
+        self.gaps = []  # (last timestamp before, first timestamp after)
+        self.missing_bars = 0
+        self.zero_volume = 0
+        self.bad_prices = 0
+        self.spikes = 0
+        self.filled_bars = 0
+        self.invalid = 0
+    
+    @property
+    def ok(self) -> bool:
+        return not (self.out_of_order or self.duplicates or self.gaps or self.zero_volume
+                    or self.bad_prices or self.spikes)
+    
+    def summary(self) -> str:
+        lines = [
+            f'Rows: {self.rows:,} ({self.interval_ms / 60000:g}-minute bars)',
+            f'Out of order: {self.out_of_order:,}',
+            f'Duplicate timestamps: {self.duplicates:,}',
+            f'Gaps: {len(self.gaps):,} ({self.missing_bars:,} missing bars)',
+            f'Zero volume bars: {self.zero_volume:,}',
+            f'Inconsistent OHLC bars: {self.bad_prices:,}',
+            f'Price spikes: {self.spikes:,}'
+        ]
+        if self.filled_bars:
+            lines.append(f'Forward-filled bars: {self.filled_bars:,}')
+        if self.invalid:
+            lines.append(f'Bars masked invalid: {self.invalid:,}')
+        return '\n'.join(lines)
+
+def _columns(price_data) -> Dict[str, np.ndarray]:
+    if isinstance(price_data, pd.DataFrame):
+        candles = {name: price_data[name].to_numpy() for name in OHLCV_COLUMNS if name in price_data}
+        candles['timestamp'] = timestamps_ms(price_data)
+        return candles
+    return {name: np.asarray(values) for name, values in price_data.items()}
+
+def _bad_bars(candles: Mapping[str, np.ndarray], spike_threshold: float):
+    '''Masks of zero-volume bars, bars with inconsistent OHLC, and one-bar price spikes'''
+    close = np.asarray(candles['close'], dtype=np.float64)
+    n = len(close)
+    zero_volume = np.asarray(candles['volume']) <= 0 if 'volume' in candles else np.zeros(n, dtype=bool)
+    
+    bad_prices = ~(close > 0)  # Also catches NaN
+    if 'high' in candles and 'low' in candles:
+        high, low = np.asarray(candles['high']), np.asarray(candles['low'])
+        bad_prices |= (high < low) | (close > high) | (close < low)
+        if 'open' in candles:
+            open_ = np.asarray(candles['open'])
+            bad_prices |= (open_ > high) | (open_ < low)
+    
+    # A spike jumps away and straight back: both log returns around the bar are
+    # extreme, in opposite directions, measured against the series' median deviation
+    spikes = np.zeros(n, dtype=bool)
+    if n > 2:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_returns = np.diff(np.log(np.where(bad_prices, np.nan, close)))
+        finite = np.isfinite(log_returns)
+        if finite.any():
+            deviation = np.abs(log_returns - np.median(log_returns[finite]))
+            scale = 1.4826 * np.median(deviation[finite]) or 1e-12
+            extreme = np.where(finite, deviation > spike_threshold * scale, False)
+            reverts = np.sign(log_returns[:-1]) != np.sign(log_returns[1:])
+            spikes[1:-1] = extreme[:-1] & extreme[1:] & reverts
+    
+    return zero_volume, bad_prices, spikes
+
+def validate_ohlcv(price_data, interval_ms: Optional[int] = None,
+                   spike_threshold: float = 20.0) -> DataQualityReport:
+    '''
+    Check candles for ordering, duplicate, gap, volume and price problems
+    
+    price_data is a DataFrame or a mapping of column arrays. interval_ms
+    defaults to the most common timestamp step. Every check is a handful of
+    whole-array operations, so tens of millions of rows take seconds.
+    '''
+    return _inspect(_columns(price_data), interval_ms, spike_threshold)[0]
+
+def _inspect(candles: Mapping[str, np.ndarray], interval_ms: Optional[int], spike_threshold: float):
+    '''validate_ohlcv on column arrays, also returning the masks of _bad_bars'''
+    timestamps = np.asarray(candles['timestamp'], dtype=np.int64)
+    steps = np.diff(timestamps)
+    if interval_ms is None:
+        interval_ms = int(np.median(steps[steps > 0])) if np.any(steps > 0) else 0
+    
+    report = DataQualityReport(len(timestamps), interval_ms)
+    report.out_of_order = int(np.count_nonzero(steps < 0))
+    
+    ordered = np.sort(timestamps) if report.out_of_order else timestamps
+    ordered_steps = np.diff(ordered)
+    report.duplicates = int(np.count_nonzero(ordered_steps == 0))
+    if interval_ms:
+        holes = np.flatnonzero(ordered_steps > interval_ms)
+        report.gaps = [(int(ordered[i]), int(ordered[i + 1])) for i in holes]
+        report.missing_bars = int(np.sum(ordered_steps[holes] // interval_ms - 1))
+    
+    masks = _bad_bars(candles, spike_threshold)
+    zero_volume, bad_prices, spikes = masks
+    report.zero_volume = int(np.count_nonzero(zero_volume))
+    report.bad_prices = int(np.count_nonzero(bad_prices))
+    report.spikes = int(np.count_nonzero(spikes))
+    return report, masks
+
+def repair_ohlcv(price_data: pd.DataFrame, interval_ms: Optional[int] = None, policy: str = 'ffill',
+                 spike_threshold: float = 20.0, mask_zero_volume: bool = True):
+    '''
+    Return (repaired DataFrame, DataQualityReport) for a candle DataFrame
+    
+    Rows are sorted and duplicate timestamps keep their last row. The
+    result has a boolean 'valid' column that MarketArrays.from_dataframe
+    picks up, so episode windows never span an invalid bar. policy decides
+    what happens to the rest:
+    
+    - 'ffill': missing bars are inserted onto a regular grid and they,
+      spikes and inconsistent bars take the previous good close as flat
+      bars with zero volume; all of those are marked invalid.
+    - 'mask': nothing is inserted or changed, bad bars are only marked
+      invalid and gaps are left for EpisodeWindows to break on.
+    '''
+    if policy not in ('ffill', 'mask'):
+        raise ValueError(f"Unknown policy {policy!r}, expected 'ffill' or 'mask'")
+    
+    candles = _columns(price_data)
+    report, masks = _inspect(candles, interval_ms, spike_threshold)
+    interval_ms = report.interval_ms
+    
+    if report.out_of_order or report.duplicates:
+        timestamps = np.asarray(candles['timestamp'], dtype=np.int64)
+        order = np.argsort(timestamps, kind='stable')
+        sorted_timestamps = timestamps[order]
+        keep = np.ones(len(order), dtype=bool)
+        keep[:-1] = sorted_timestamps[1:] != sorted_timestamps[:-1]
+        rows = order[keep]
+        candles = {name: values[rows] for name, values in candles.items()}
+        masks = _bad_bars(candles, spike_threshold)
+    timestamps = candles['timestamp']
+    
+    zero_volume, bad_prices, spikes = masks
+    bad = bad_prices | spikes
+    valid = ~(bad | zero_volume) if mask_zero_volume else ~bad
+    
+    if policy == 'ffill' and interval_ms and (report.gaps or bad.any()):
+        # Place bars on a regular grid, then carry the last good close into holes and bad bars
+        slot = (timestamps - timestamps[0]) // interval_ms
+        grid = np.zeros(int(slot[-1]) + 1, dtype=bool)
+        grid[slot] = True
+        
+        filled = {}
+        for name, values in candles.items():
+            column = np.zeros(len(grid), dtype=values.dtype)
+            column[slot] = values
+            filled[name] = column
+        filled['timestamp'] = timestamps[0] + np.arange(len(grid), dtype=np.int64) * interval_ms
+        
+        good = np.zeros(len(grid), dtype=bool)
+        good[slot] = ~bad
+        source = np.maximum.accumulate(np.where(good, np.arange(len(grid)), 0))
+        close = filled['close'][source]
+        for name in ('open', 'high', 'low', 'close'):
+            if name in filled:
+                filled[name] = np.where(good, filled[name], close)
+        if 'volume' in filled:
+            filled['volume'] = np.where(good, filled['volume'], 0)
+        
+        grid_valid = np.zeros(len(grid), dtype=bool)
+        grid_valid[slot] = valid
+        report.filled_bars = int(np.count_nonzero(~good))
+        candles, valid = filled, grid_valid
+    
+    report.invalid = int(np.count_nonzero(~valid))
+    
+    repaired = pd.DataFrame(candles)
+    repaired.insert(0, 'datetime', pd.to_datetime(candles['timestamp'], unit='ms'))
+    repaired['valid'] = valid
+    return repaired, report
+
+class FeatureStore:
+    '''
+    On-disk cache of MarketArrays bundles
+    
+    Each entry is keyed by a hash of the price series the environments read
+    (close, bar timestamps, hours) together with the FeatureEngineering
+    parameters, so editing the data or changing e.g. lookback_window lands on
+    a new entry instead of a stale one. Hits load memory-mapped, skipping the
+    feature computation entirely.
+    '''
+    # Bump when the way features are computed changes, so existing entries stop matching
+    FORMAT_VERSION = 1
+    
+    def __init__(self, root: str, feature_engineer: Optional[FeatureEngineering] = None):
+        self.root = root
+        self.feature_engineer = feature_engineer or FeatureEngineering(lookback_window=24)
+    
+    def key(self, price_data: pd.DataFrame) -> str:
+        '''Content hash of the data and feature parameters'''
+        digest = hashlib.sha256()
+        params = {
+            'format_version': self.FORMAT_VERSION,
+            'feature_engineer': type(self.feature_engineer).__name__,
+            'params': vars(self.feature_engineer),
+            'fields': list(MarketArrays.FIELDS)
+        }
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        
+        close = np.ascontiguousarray(price_data['close'].values, dtype=np.float64)
+        arrays = [close, timestamps_ms(price_data), hour_of_day(price_data)]
+        if 'valid' in price_data:
+            arrays.append(price_data['valid'].to_numpy(dtype=bool))
+        for array in arrays:
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()[:32]
+    
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+    
+    def __contains__(self, price_data: pd.DataFrame) -> bool:
+        return os.path.exists(os.path.join(self.path(self.key(price_data)), MarketArrays.METADATA_FILE))
+    
+    def get(self, price_data: pd.DataFrame, mmap_mode: Optional[str] = 'r') -> MarketArrays:
+        '''Load the entry for price_data, computing and storing it on a miss'''
+        path = self.path(self.key(price_data))
+        if not os.path.exists(os.path.join(path, MarketArrays.METADATA_FILE)):
+            self._write(path, MarketArrays.from_dataframe(
+                price_data, self.feature_engineer,
+                timeframe_features=build_timeframe_features(price_data, self.feature_engineer)
+            ))
+        return MarketArrays.load(path, mmap_mode=mmap_mode)
+    
+    def _write(self, path: str, market_data: MarketArrays):
+        # Build in a temporary directory and rename it into place, so a concurrent
+        # reader or an interrupted run never sees a half-written entry
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        try:
+            market_data.save(staging)
+            os.rename(staging, path)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            if not os.path.exists(os.path.join(path, MarketArrays.METADATA_FILE)):
+                raise  # Anything but losing the race to another writer
+    
+    def clear(self):
+        '''Delete every entry'''
+        shutil.rmtree(self.root, ignore_errors=True)
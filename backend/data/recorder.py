@@ -0,0 +1,363 @@
+﻿import os
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from data.fetcher import RateLimiter, TimeBound, _to_epoch_ms
+
+# One row per market per snapshot. Prices are in dollars (the API quotes cents),
+# strikes are NaN where the market has none on that side.
+QUOTE_COLUMNS = {
+    'timestamp': np.int64,  # Snapshot time, epoch ms
+    'ticker': np.str_,
+    'strike_type': np.int8,  # Index into STRIKE_TYPES
+    'floor_strike': np.float64,
+    'cap_strike': np.float64,
+    'close_time': np.int64,
+    'yes_bid': np.float64,
+    'yes_ask': np.float64,
+    'last_price': np.float64,
+    'volume': np.float64,
+    'open_interest': np.float64
+}
+# Order book levels, best first, (rows, depth) and zero-padded where the book is thinner
+BOOK_COLUMNS = ('bid_price', 'bid_size', 'ask_price', 'ask_size')
+STRIKE_TYPES = ('greater', 'less', 'between', 'other')
+
+def _cents(market: Dict, name: str) -> float:
+    '''A price field in dollars, from the cents field or its newer *_dollars string'''
+    if market.get(name) is not None:
+        return market[name] / 100
+    if market.get(name + '_dollars') is not None:
+        return float(market[name + '_dollars'])
+    return 0.0
+
+def _strike(market: Dict, name: str) -> float:
+    value = market.get(name)
+    return np.nan if value is None else float(value)
+
+def _time_ms(value: Optional[str]) -> int:
+    return 0 if not value else int(pd.Timestamp(value).timestamp() * 1000)
+
+def market_row(market: Dict) -> Dict:
+    '''Recorded fields of one market from KalshiClient.get_markets'''
+    strike_type = market.get('strike_type')
+    return {
+        'ticker': market.get('ticker', ''),
+        'strike_type': STRIKE_TYPES.index(strike_type) if strike_type in STRIKE_TYPES else len(STRIKE_TYPES) - 1,
+        'floor_strike': _strike(market, 'floor_strike'),
+        'cap_strike': _strike(market, 'cap_strike'),
+        'close_time': _time_ms(market.get('close_time')),
+        'yes_bid': _cents(market, 'yes_bid'),
+        'yes_ask': _cents(market, 'yes_ask'),
+        'last_price': _cents(market, 'last_price'),
+        'volume': float(market.get('volume') or 0),
+        'open_interest': float(market.get('open_interest') or 0)
+    }
+
+def book_levels(orderbook: Dict, depth: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    YES bid and ask levels of a KalshiClient.get_orderbook response
+    
+    Kalshi lists resting bids for YES and for NO, in cents and ascending.
+    A NO bid at p is a YES offer at 100 - p, so the YES asks are the NO bids
+    mirrored. Returns (bid_price, bid_size, ask_price, ask_size) in dollars,
+    best level first and zero-padded to depth.
+    '''
+    levels = []
+    for side in ('yes', 'no'):
+        book = np.array(orderbook.get(side) or [], dtype=np.float64).reshape(-1, 2)[::-1][:depth]
+        prices = np.zeros(depth)
+        sizes = np.zeros(depth)
+        prices[:len(book)] = book[:, 0] / 100 if side == 'yes' else 1 - book[:, 0] / 100
+        sizes[:len(book)] = book[:, 1]
+        levels.extend([prices, sizes])
+    return tuple(levels)
+
+def _partition_name(timestamp_ms: int) -> str:
+    return pd.Timestamp(timestamp_ms, unit='ms').strftime('%Y-%m-%d')
+
+def _write_part(path: str, columns: Dict[str, np.ndarray]):
+    # Written under a temporary name so readers never see a half-written part
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **columns)
+    os.replace(tmp_path, path)
+
+def write_quotes(root: str, columns: Dict[str, np.ndarray]) -> List[str]:
+    '''
+    Append snapshot rows to the store at root, one part file per UTC day touched
+    
+    The store is a directory per day (root/YYYY-MM-DD) of compressed .npz
+    parts holding one array per column, named after the first and last
+    snapshot time they cover so readers can skip them without opening them.
+    '''
+    timestamps = columns['timestamp']
+    days = np.array([_partition_name(ts) for ts in timestamps[[0, -1]]])
+    paths = []
+    if days[0] == days[-1]:
+        splits = [(days[0], slice(None))]
+    else:
+        day_of_row = pd.to_datetime(timestamps, unit='ms').strftime('%Y-%m-%d').to_numpy()
+        splits = [(day, day_of_row == day) for day in np.unique(day_of_row)]
+    
+    for day, rows in splits:
+        part = {name: values[rows] for name, values in columns.items()}
+        part_dir = os.path.join(root, day)
+        os.makedirs(part_dir, exist_ok=True)
+        path = os.path.join(part_dir, f'part-{part["timestamp"][0]}-{part["timestamp"][-1]}.npz')
+        _write_part(path, part)
+        paths.append(path)
+    return paths
+
+def _parts(root: str, start_ms: Optional[int], end_ms: Optional[int]) -> List[str]:
+    '''Part files that may hold snapshots in [start_ms, end_ms), pruned by their names'''
+    paths = []
+    if not os.path.isdir(root):
+        return paths
+    for day in sorted(os.listdir(root)):
+        day_dir = os.path.join(root, day)
+        if not os.path.isdir(day_dir):
+            continue
+        for name in sorted(os.listdir(day_dir)):
+            if not (name.startswith('part-') and name.endswith('.npz')):
+                continue
+            first, last = (int(value) for value in name[len('part-'):-len('.npz')].split('-'))
+            if (start_ms is not None and last < start_ms) or (end_ms is not None and first >= end_ms):
+                continue
+            paths.append(os.path.join(day_dir, name))
+    return paths
+
+def load_quotes(root: str, start: TimeBound = None, end: TimeBound = None,
+                columns: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+    '''
+    Recorded rows with start <= timestamp < end, sorted by timestamp then ticker
+    
+    Only parts whose time range overlaps the request are opened, and only the
+    requested columns are decompressed.
+    '''
+    start_ms, end_ms = _to_epoch_ms(start), _to_epoch_ms(end)
+    columns = None if columns is None else ['timestamp'] + [name for name in columns if name != 'timestamp']
+    
+    chunks = []
+    for path in _parts(root, start_ms, end_ms):
+        with np.load(path) as part:
+            chunks.append({name: part[name] for name in (columns or part.files)})
+    if not chunks:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in QUOTE_COLUMNS.items() if columns is None or name in columns}
+    
+    arrays = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+    timestamps = arrays['timestamp']
+    keep = np.ones(len(timestamps), dtype=bool)
+    if start_ms is not None:
+        keep &= timestamps >= start_ms
+    if end_ms is not None:
+        keep &= timestamps < end_ms
+    order = np.lexsort((arrays['ticker'], timestamps)) if 'ticker' in arrays else np.argsort(timestamps, kind='stable')
+    order = order[keep[order]]
+    return {name: values[order] for name, values in arrays.items()}
+
+def compact_day(root: str, day: str) -> Optional[str]:
+    '''Merge one day's parts into a single part, e.g. once the day is over'''
+    day_dir = os.path.join(root, day)
+    paths = _parts(root, None, None)
+    paths = [path for path in paths if os.path.dirname(path) == day_dir]
+    if len(paths) < 2:
+        return paths[0] if paths else None
+    
+    chunks = []
+    for path in paths:
+        with np.load(path) as part:
+            chunks.append({name: part[name] for name in part.files})
+    merged = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+    order = np.lexsort((merged['ticker'], merged['timestamp']))
+    merged = {name: values[order] for name, values in merged.items()}
+    
+    written = write_quotes(root, merged)[0]
+    for path in paths:
+        if path != written:
+            os.remove(path)
+    return written
+
+class MarketRecorder:
+    '''
+    Poll Kalshi markets on an interval and append snapshots to a quote store
+    
+    Each poll lists the open markets of every series and, with
+    orderbook_depth > 0, fetches their order books on a small thread pool
+    behind a shared rate limiter. Snapshots are buffered and written every
+    flush_every polls (and on exit) with write_quotes. client is anything
+    with KalshiClient's get_markets and get_orderbook.
+    '''
+    
+    def __init__(self, client, root: str, series: Sequence[str] = ('KXBTC', 'KXBTCD'),
+                 interval: float = 60.0, orderbook_depth: int = 5, flush_every: int = 15,
+                 max_workers: int = 4, requests_per_second: float = 8.0, market_limit: int = 200):
+        self.client = client
+        self.root = root
+        self.series = tuple(series)
+        self.interval = interval
+        self.orderbook_depth = orderbook_depth
+        self.flush_every = flush_every
+        self.max_workers = max_workers
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.market_limit = market_limit
+        self._buffer = []
+    
+    def _get_orderbook(self, ticker: str) -> Dict:
+        self.rate_limiter.wait()
+        return self.client.get_orderbook(ticker, depth=self.orderbook_depth)
+    
+    def snapshot(self) -> Optional[Dict[str, np.ndarray]]:
+        '''One poll of every series as column arrays, None if no markets came back'''
+        timestamp = int(time.time() * 1000)
+        markets = []
+        for series in self.series:
+            self.rate_limiter.wait()
+            markets.extend(self.client.get_markets(series_ticker=series, limit=self.market_limit, status='open'))
+        if not markets:
+            return None
+        
+        rows = [market_row(market) for market in markets]
+        columns = {
+            name: np.array([row[name] for row in rows], dtype=dtype)
+            for name, dtype in QUOTE_COLUMNS.items() if name != 'timestamp'
+        }
+        columns['timestamp'] = np.full(len(rows), timestamp, dtype=np.int64)
+        
+        if self.orderbook_depth > 0:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                books = list(executor.map(self._get_orderbook, columns['ticker']))
+            levels = [book_levels(book, self.orderbook_depth) for book in books]
+            for i, name in enumerate(BOOK_COLUMNS):
+                columns[name] = np.stack([level[i] for level in levels])
+        return columns
+    
+    def flush(self) -> List[str]:
+        '''Write buffered snapshots, returning the part files written'''
+        if not self._buffer:
+            return []
+        columns = {name: np.concatenate([snap[name] for snap in self._buffer]) for name in self._buffer[0]}
+        self._buffer = []
+        return write_quotes(self.root, columns)
+    
+    def record(self, duration: Optional[float] = None, max_snapshots: Optional[int] = None):
+        '''Poll every interval seconds until duration or max_snapshots is reached (or Ctrl-C)'''
+        started = time.monotonic()
+        next_poll = started
+        taken = 0
+        try:
+            while (duration is None or time.monotonic() - started < duration) and \
+                    (max_snapshots is None or taken < max_snapshots):
+                columns = self.snapshot()
+                taken += 1
+                if columns is not None:
+                    self._buffer.append(columns)
+                    print(f'📸 {len(columns["ticker"])} markets at {pd.Timestamp(columns["timestamp"][0], unit="ms")}')
+                if len(self._buffer) >= self.flush_every:
+                    self.flush()
+                
+                next_poll += self.interval
+                time.sleep(max(next_poll - time.monotonic(), 0.0))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.flush()
+
+class QuoteReplay:
+    '''
+    Recorded quotes looked up by time and strike, in place of the model prices
+    
+    Rows are kept sorted by (snapshot, strike), so a lookup is two binary
+    searches: the latest snapshot at or before the trade time, then the
+    nearest strike within it. Only 'greater' (above-strike) markets with both
+    a bid and an ask are used, since the environments settle YES on
+    price >= strike. Bars are stamped with their open time and trades happen
+    at the close, so lookups are shifted by bar_ms; snapshots older than
+    max_age_ms count as missing and the caller falls back to its model.
+    
+    The recorded contract's own expiry is kept in its price - only the
+    strike and the quotes are replayed.
+    '''
+    # Snapshot index and strike packed into one sortable float key
+    KEY_STRIDE = float(2 ** 24)
+    
+    def __init__(self, quotes: Dict[str, np.ndarray], bar_ms: int = 15 * 60_000, max_age_ms: int = 15 * 60_000):
+        usable = (
+            (quotes['strike_type'] == STRIKE_TYPES.index('greater')) &
+            np.isfinite(quotes['floor_strike']) &
+            (quotes['yes_bid'] > 0) & (quotes['yes_ask'] > 0) & (quotes['yes_ask'] < 1)
+        )
+        timestamp = quotes['timestamp'][usable]
+        strike = quotes['floor_strike'][usable]
+        order = np.lexsort((strike, timestamp))
+        
+        self.bar_ms = bar_ms
+        self.max_age_ms = max_age_ms
+        self.strike = strike[order]
+        self.bid = quotes['yes_bid'][usable][order]
+        self.ask = quotes['yes_ask'][usable][order]
+        
+        self.times, self.starts = np.unique(timestamp[order], return_index=True)
+        self.stops = np.append(self.starts[1:], len(order))
+        snapshot = np.repeat(np.arange(len(self.times)), self.stops - self.starts)
+        self._keys = snapshot * self.KEY_STRIDE + self.strike
+    
+    @classmethod
+    def load(cls, root: str, start: TimeBound = None, end: TimeBound = None, **kwargs) -> 'QuoteReplay':
+        columns = ('strike_type', 'floor_strike', 'yes_bid', 'yes_ask')
+        return cls(load_quotes(root, start, end, columns=columns), **kwargs)
+    
+    def __len__(self) -> int:
+        return len(self.times)
+    
+    def _snapshots(self, timestamp: np.ndarray) -> np.ndarray:
+        '''Index of the snapshot each bar trades on, -1 where none is fresh enough'''
+        trade_time = np.asarray(timestamp, dtype=np.int64) + self.bar_ms
+        snapshot = np.searchsorted(self.times, trade_time, side='right') - 1
+        fresh = (snapshot >= 0) & (trade_time - self.times[np.maximum(snapshot, 0)] <= self.max_age_ms)
+        return np.where(fresh, snapshot, -1)
+    
+    def coverage(self, timestamp: np.ndarray) -> float:
+        '''Fraction of bars with a fresh snapshot to trade on'''
+        if len(timestamp) == 0 or len(self.times) == 0:
+            return 0.0
+        return float(np.mean(self._snapshots(timestamp) >= 0))
+    
+    def quotes(self, timestamp: np.ndarray, threshold: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        (found, strike, bid, ask) of the recorded market nearest each threshold
+        
+        Arrays broadcast like the arguments; where found is False the other
+        outputs are meaningless and the model price should be used.
+        '''
+        timestamp, threshold = np.broadcast_arrays(np.asarray(timestamp), np.asarray(threshold, dtype=np.float64))
+        if len(self.times) == 0:
+            empty = np.zeros(timestamp.shape)
+            return np.zeros(timestamp.shape, dtype=bool), empty, empty, empty
+        snapshot = self._snapshots(timestamp)
+        found = snapshot >= 0
+        snapshot = np.maximum(snapshot, 0)
+        
+        start, stop = self.starts[snapshot], self.stops[snapshot]
+        above = np.searchsorted(self._keys, snapshot * self.KEY_STRIDE + threshold)
+        above = np.clip(above, start, stop - 1)
+        below = np.maximum(above - 1, start)
+        nearest = np.where(np.abs(self.strike[below] - threshold) <= np.abs(self.strike[above] - threshold), below, above)
+        return found, self.strike[nearest], self.bid[nearest], self.ask[nearest]
+    
+    def quote(self, timestamp: int, threshold: float) -> Optional[Tuple[float, float, float]]:
+        '''Scalar quotes: (strike, bid, ask) of the nearest recorded market, or None'''
+        trade_time = int(timestamp) + self.bar_ms
+        snapshot = int(np.searchsorted(self.times, trade_time, side='right')) - 1
+        if snapshot < 0 or trade_time - self.times[snapshot] > self.max_age_ms:
+            return None
+        
+        start, stop = self.starts[snapshot], self.stops[snapshot]
+        above = int(np.searchsorted(self._keys, snapshot * self.KEY_STRIDE + threshold))
+        above = min(max(above, start), stop - 1)
+        below = max(above - 1, start)
+        nearest = below if abs(self.strike[below] - threshold) <= abs(self.strike[above] - threshold) else above
+        return float(self.strike[nearest]), float(self.bid[nearest]), float(self.ask[nearest])
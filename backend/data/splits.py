@@ -0,0 +1,95 @@
+﻿import pandas as pd
+from typing import List, Optional, Tuple
+
+from rl.market_data import MarketArrays
+
+class Split:
+    '''
+    Rows [start, stop) of one dataset
+    
+    Splits are just index ranges: build features once for the whole series
+    and hand each env view(market_data), which slices the shared arrays
+    instead of copying a DataFrame and recomputing features per split.
+    '''
+    
+    def __init__(self, name: str, start: int, stop: int):
+        if not 0 <= start <= stop:
+            raise ValueError(f'Invalid split range [{start}, {stop})')
+        self.name = name
+        self.start = start
+        self.stop = stop
+    
+    def __len__(self) -> int:
+        return self.stop - self.start
+    
+    def __repr__(self) -> str:
+        return f'Split({self.name!r}, {self.start}, {self.stop})'
+    
+    @property
+    def rows(self) -> slice:
+        return slice(self.start, self.stop)
+    
+    def view(self, market_data: MarketArrays, warmup: Optional[int] = None) -> MarketArrays:
+        '''
+        Zero-copy MarketArrays for this split
+        
+        warmup rows before start are included (lookback_window by default),
+        since the environments skip their first lookback_window steps - that
+        way they begin trading on the split's first row.
+        '''
+        if warmup is None:
+            warmup = market_data.lookback_window
+        return market_data.view(max(self.start - warmup, 0), self.stop)
+    
+    def frame(self, price_data: pd.DataFrame) -> pd.DataFrame:
+        '''The split's rows of a DataFrame, keeping the original index'''
+        return price_data.iloc[self.start:self.stop]
+
+class Fold:
+    '''One walk-forward step: fit on train, score on test'''
+    
+    def __init__(self, index: int, train: Split, test: Split):
+        self.index = index
+        self.train = train
+        self.test = test
+    
+    def __repr__(self) -> str:
+        return f'Fold({self.index}, train={self.train.start}:{self.train.stop}, test={self.test.start}:{self.test.stop})'
+
+def train_val_test(length: int, train: float = 0.8, val: float = 0.1) -> Tuple[Split, Split, Split]:
+    '''Chronological train/validation/test splits, the test split taking the remainder'''
+    train_size = int(length * train)
+    val_size = int(length * val)
+    return (
+        Split('train', 0, train_size),
+        Split('val', train_size, train_size + val_size),
+        Split('test', train_size + val_size, length)
+    )
+
+def walk_forward(length: int, train_size: int, test_size: int, step: Optional[int] = None,
+                 expanding: bool = False, gap: int = 0) -> List[Fold]:
+    '''
+    Rolling (or expanding) train/test folds over length rows
+    
+    Each test window follows its train window after gap rows, and windows
+    advance by step rows (test_size by default, so test windows tile the
+    data without overlapping). With expanding=True every train window starts
+    at row 0. Folds that would run past the end are dropped.
+    '''
+    if train_size <= 0 or test_size <= 0:
+        raise ValueError('train_size and test_size must be positive')
+    step = step or test_size
+    
+    folds = []
+    for index, train_start in enumerate(range(0, length, step)):
+        train_stop = train_start + train_size
+        test_start = train_stop + gap
+        test_stop = test_start + test_size
+        if test_stop > length:
+            break
+        folds.append(Fold(
+            index,
+            Split(f'train_{index}', 0 if expanding else train_start, train_stop),
+            Split(f'test_{index}', test_start, test_stop)
+        ))
+    return folds
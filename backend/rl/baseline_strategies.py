@@ -1,6 +1,12 @@
-﻿import numpy as np
+﻿import os
+import sys
+import numpy as np
 import pandas as pd
-from environment import KalshiTradingEnv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rl.environment import KalshiTradingEnv
+from rl.experiment import feature_store, load_dataset, load_settings, make_env_kwargs
 from typing import Tuple
 
 class BaselineStrategy:
@@ -103,7 +109,7 @@ def evaluate_baseline(strategy: BaselineStrategy, env: KalshiTradingEnv, episode
             'episode': ep,
             'final_value': info['portfolio_value'],
             'pnl': info['pnl'],
-            'return_pct': (info['pnl'] / 10000) * 100,
+            'return_pct': (info['pnl'] / env.initial_balance) * 100,
             'num_trades': info['num_trades'],
             'win_rate': info['win_rate'],
             'portfolio_history': portfolio_history
@@ -115,18 +121,22 @@ if __name__ == '__main__':
     print('Testing Baseline Strategies')
     print('=' * 60)
     
+    # Same data and features as the RL agent the baselines are compared with, defaults if it isn't trained yet
+    settings = load_settings('../../models/ppo_aggressive_final')
+    
     # Load test data
     data_path = '../../data/raw/btc_15m_6months.csv'
-    df = pd.read_csv(data_path)
-    df['datetime'] = pd.to_datetime(df['datetime'])
+    # Repaired and split like train.py, so this is the test split it held out
+    df, (_, _, test_split) = load_dataset(data_path, settings['data_repair'])
     
-    # Use test set (last 10%)
-    test_size = int(len(df) * 0.1)
-    test_df = df[-test_size:].reset_index(drop=True)
-    
-    print(f'Test data: {len(test_df)} rows')
+    print(f'Test data: {len(test_split)} rows')
     print()
     
+    # Computed once and shared by every strategy's env
+    features = feature_store(os.path.join('..', '..', 'data', 'features'), settings)
+    test_data = test_split.view(features.get(df))
+    env_kwargs = make_env_kwargs(settings)
+    
     # Test each baseline
     strategies = [
         HoldOnlyStrategy(),
@@ -140,7 +150,7 @@ if __name__ == '__main__':
     
     for strategy in strategies:
         print(f'Testing {strategy.name}...')
-        env = KalshiTradingEnv(test_df, initial_balance=10000)
+        env = KalshiTradingEnv(test_data, **env_kwargs)
         results = evaluate_baseline(strategy, env, episodes=1)
         all_results.extend(results)
         
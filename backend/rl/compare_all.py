@@ -1,22 +1,27 @@
-﻿import pandas as pd
+﻿import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
 import numpy as np
 from stable_baselines3 import PPO
-from environment import KalshiTradingEnv
+from rl.environment import KalshiTradingEnv
+from rl.experiment import feature_store, load_dataset, load_settings, make_env_kwargs
 
 print('RL Agent vs Baselines Comparison')
 print('=' * 60)
 
-# Load test data
-df = pd.read_csv('../../data/raw/btc_15m_6months.csv')
-df['datetime'] = pd.to_datetime(df['datetime'])
-test_size = int(len(df) * 0.1)
-test_df = df[-test_size:].reset_index(drop=True)
+# Load RL agent and the settings it was trained with
+model_path = '../../models/ppo_aggressive_final'
+model = PPO.load(model_path)
+settings = load_settings(model_path)
 
-# Load RL agent
-model = PPO.load('../../models/ppo_aggressive_final')
+# Load test data
+df, (_, _, test_split) = load_dataset('../../data/raw/btc_15m_6months.csv', settings['data_repair'])
 
 # Evaluate
-env = KalshiTradingEnv(test_df, initial_balance=10000)
+features = feature_store(os.path.join('..', '..', 'data', 'features'), settings)
+# Same balance, strike ladder, order book, quotes, expiry and pricer as the training env
+env = KalshiTradingEnv(test_split.view(features.get(df)), **make_env_kwargs(settings))
 obs, info = env.reset()
 episode_reward = 0
 done = False
@@ -30,7 +35,7 @@ while not done:
 print('RL AGENT RESULTS:')
 print(f'  Final Value: ')
 print(f'  P&L: ')
-print(f'  Return: {(info["pnl"]/10000)*100:.2f}%')
+print(f'  Return: {(info["pnl"]/env.initial_balance)*100:.2f}%')
 print(f'  Trades: {info["num_trades"]}')
 print(f'  Win Rate: {info["win_rate"]*100:.1f}%')
 print()
@@ -41,7 +46,7 @@ print('=' * 60)
 print('Strategy         | Return %  | Trades | Win Rate')
 print('-' * 60)
 print(f'Random           |   +0.90%  | 1,135  | 50.7%')
-print(f'RL Agent (PPO)   | {(info["pnl"]/10000)*100:+7.2f}% | {info["num_trades"]:5}  | {info["win_rate"]*100:.1f}%')
+print(f'RL Agent (PPO)   | {(info["pnl"]/env.initial_balance)*100:+7.2f}% | {info["num_trades"]:5}  | {info["win_rate"]*100:.1f}%')
 print(f'Hold Only        |   +0.00%  |     0  | 50.0%')
 print(f'Buy and Hold     |   -0.26%  |     1  |  0.0%')
 print(f'Momentum         |   -6.91%  |   954  | 49.2%')
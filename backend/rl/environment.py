@@ -2,21 +2,32 @@
 from gymnasium import spaces
 import numpy as np
 import pandas as pd
-from typing import Dict, Tuple, Any
+from typing import Dict, Tuple, Any, Optional, Union
 
 try:
+    from .episodes import EpisodeWindows
     from .features import FeatureEngineering
-    from .market_simulator import KalshiMarketSimulator
+    from .market_data import MarketArrays, bar_hours
+    from .market_simulator import KalshiMarketSimulator, MonteCarloPricer, OrderBook, StrikeLadder
+    from .positions import PositionBook, POSITION_TYPES
 except ImportError:
+    from episodes import EpisodeWindows
     from features import FeatureEngineering
-    from market_simulator import KalshiMarketSimulator
+    from market_data import MarketArrays, bar_hours
+    from market_simulator import KalshiMarketSimulator, MonteCarloPricer, OrderBook, StrikeLadder
+    from positions import PositionBook, POSITION_TYPES
 
 class KalshiTradingEnv(gym.Env):
     '''Kalshi Trading Environment V3 - AGGRESSIVE trading incentives'''
     metadata = {'render_modes': ['human']}
+    RECENT_TRADE_WINDOW = 100
     
-    def __init__(self, price_data: pd.DataFrame, initial_balance: float = 10000,
-                 max_position_size: int = 100, trading_hours: Tuple[int, int] = (9, 24)):
+    def __init__(self, price_data: Union[pd.DataFrame, MarketArrays], initial_balance: float = 10000,
+                 max_position_size: int = 100, trading_hours: Tuple[int, int] = (9, 24),
+                 episode_length: Optional[Union[int, Tuple[int, int]]] = None,
+                 strike_ladder: Union[bool, Dict[str, Any]] = False,
+                 order_book: Union[bool, Dict[str, Any]] = False, quote_source: Optional[Any] = None,
+                 expiry_steps: int = 1, monte_carlo: Union[bool, Dict[str, Any]] = False):
         super().__init__()
         
         self.price_data = price_data
@@ -28,31 +39,161 @@ class KalshiTradingEnv(gym.Env):
         self.feature_engineer = FeatureEngineering(lookback_window=24)
         self.market_sim = KalshiMarketSimulator()
         
+        # Columns used every step as plain arrays - a DataFrame row lookup builds a Series.
+        # Price features only depend on the price series, so every step is computed up front,
+        # unless the caller passes prebuilt MarketArrays (e.g. memory-mapped or shared memory).
+        self._owns_market_data = isinstance(price_data, pd.DataFrame)
+        if self._owns_market_data:
+            self.market_data = MarketArrays.from_dataframe(price_data, self.feature_engineer)
+        else:
+            self.market_data = price_data
+            if self.market_data.lookback_window != self.feature_engineer.lookback_window:
+                raise ValueError(
+                    f'MarketArrays built with lookback_window={self.market_data.lookback_window}, '
+                    f'env expects {self.feature_engineer.lookback_window}'
+                )
+        
+        self.close_prices = self.market_data.close
+        self.hours = self.market_data.hour
+        self.timestamps = self.market_data.timestamp
+        self.price_features = self.market_data.price_features
+        self.return_volatility = self.market_data.return_volatility
+        self.timeframe_features = self.market_data.timeframe_features
+        self.n_steps = len(self.close_prices)
+        
+        # Observations are written into two preallocated buffers in turn, so the array
+        # returned by step stays valid until the step after next. Callers that keep
+        # observations longer must copy them - vec env wrappers already do.
+        self.price_state = self.feature_engineer.scale_price_features(
+            self.price_features, self.timeframe_features
+        )
+        self._price_slots = self.price_state.shape[1]
+        self._observations = np.zeros((2, 50), dtype=np.float32)
+        self._observation_index = 0
+        for observation in self._observations:
+            self.feature_engineer.write_state(
+                observation, self.price_features[0], 12, 0, 0.0, 0.0, initial_balance, 0.5
+            )
+        
+        # Contracts expire expiry_steps bars after entry (4 for hourly, 96 for daily ones on
+        # 15m bars). The normal model prices them with expiry_steps times the data's bar length
+        # to expiry, the same horizon monte_carlo (True or MonteCarloPricer keyword arguments)
+        # simulates paths over.
+        if expiry_steps < 1:
+            raise ValueError(f'expiry_steps must be at least 1, got {expiry_steps}')
+        self.expiry_steps = expiry_steps
+        self.time_to_expiry_hours = expiry_steps * bar_hours(self.timestamps)
+        self.pricer = None
+        if monte_carlo:
+            self.pricer = MonteCarloPricer(
+                self.close_prices, self.return_volatility,
+                **(monte_carlo if isinstance(monte_carlo, dict) else {})
+            )
+        
+        # With strike_ladder (True or StrikeLadder keyword arguments) trades take the best
+        # strike of a precomputed ladder and observations show the ladder in slots 41-48.
+        # Without it every trade draws a random strike, as before.
+        self.strike_ladder = None
+        if strike_ladder:
+            ladder_kwargs = {'time_to_expiry_hours': self.time_to_expiry_hours, 'pricer': self.pricer,
+                             'horizon': expiry_steps}
+            ladder_kwargs.update(strike_ladder if isinstance(strike_ladder, dict) else {})
+            self.strike_ladder = StrikeLadder(self.market_sim, self.close_prices, self.return_volatility, **ladder_kwargs)
+        
+        # With order_book (True or OrderBook keyword arguments) orders walk a depth-limited
+        # book from the quoted price and may fill partially; info then reports the fill.
+        # Without it every order fills in full at the bid or ask.
+        self.order_book = None
+        if order_book:
+            self.order_book = OrderBook(**(order_book if isinstance(order_book, dict) else {}))
+        self.fill_size = 0
+        self.slippage = 0.0
+        
+        # quote_source (e.g. data.recorder.QuoteReplay) swaps the traded strike and its model
+        # bid/ask for the nearest recorded Kalshi market, where one was recorded at the time
+        self.quote_source = quote_source
+        
+        # Without episode_length an episode runs from the end of the warm-up to the end
+        # of the data. With it, reset samples a (start, length) window from this index.
+        self.episode_length = episode_length
+        self.episode_windows = None
+        if episode_length is not None:
+            self.episode_windows = EpisodeWindows(
+                self.market_data.timestamp, episode_length,
+                warmup=self.feature_engineer.lookback_window, valid_mask=self.market_data.valid
+            )
+        
         # Action space: [decision, position_size]
         self.action_space = spaces.MultiDiscrete([5, 5])
         self.observation_space = spaces.Box(low=-np.inf, high=np.inf, shape=(50,), dtype=np.float32)
         
         self.current_step = 0
+        self.end_step = self.n_steps - 1
         self.balance = initial_balance
-        self.positions = []
+        self.positions = PositionBook()
         self.trade_history = []
         self.portfolio_values = [initial_balance]
         self.max_portfolio_value = initial_balance
         self.steps_without_trade = 0
         
+        # Running trade statistics so reward and info don't rescan trade_history.
+        # Trades resolved at step s are stamped s and the reward at s + 1 counts the
+        # ones stamped after s + 1 - RECENT_TRADE_WINDOW, so the ring covers WINDOW - 1 steps.
+        self.num_trades = 0
+        self.num_wins = 0
+        self.recent_trade_counts = np.zeros(self.RECENT_TRADE_WINDOW - 1, dtype=np.int64)
+        self.recent_trades = 0
+        
+    @classmethod
+    def from_shared_memory(cls, spec: Dict[str, Any], **kwargs) -> 'KalshiTradingEnv':
+        '''Build an env on a block created by MarketArrays.to_shared_memory'''
+        env = cls(MarketArrays.from_shared_memory(spec), **kwargs)
+        env._owns_market_data = True
+        return env
+    
+    @classmethod
+    def from_npy_bundle(cls, path: str, **kwargs) -> 'KalshiTradingEnv':
+        '''Build an env on a read-only memory-mapped bundle written by MarketArrays.save'''
+        env = cls(MarketArrays.load(path, mmap_mode='r'), **kwargs)
+        env._owns_market_data = True
+        return env
+    
     def reset(self, seed=None, options=None) -> Tuple[np.ndarray, Dict]:
         super().reset(seed=seed)
         
-        self.current_step = 24
+        # options={'start_step': s, 'episode_length': n} pins the window, e.g. for evaluation
+        if options and 'start_step' in options:
+            self.current_step = int(options['start_step'])
+            self.end_step = self.n_steps - 1
+            if options.get('episode_length') is not None:
+                self.end_step = min(self.current_step + int(options['episode_length']), self.end_step)
+        elif self.episode_windows is not None:
+            start, length = self.episode_windows.sample(self.np_random)
+            self.current_step = int(start)
+            self.end_step = int(start + length)
+        else:
+            self.current_step = 24
+            self.end_step = self.n_steps - 1
+        
         self.balance = self.initial_balance
-        self.positions = []
+        self.positions.clear()
         self.trade_history = []
         self.portfolio_values = [self.initial_balance]
         self.max_portfolio_value = self.initial_balance
         self.steps_without_trade = 0
-        
-        observation = self._get_observation()
-        info = self._get_info()
+        self.num_trades = 0
+        self.num_wins = 0
+        self.recent_trade_counts[:] = 0
+        self.recent_trades = 0
+        self.fill_size = 0
+        self.slippage = 0.0
+        if self.order_book is not None:
+            self.order_book.reset()
+        
+        unrealized_pnl = self._calculate_unrealized_pnl()
+        portfolio_value = self.balance + unrealized_pnl
+        observation = self._get_observation(unrealized_pnl, portfolio_value)
+        info = self._get_info(portfolio_value)
         
         return observation, info
     
@@ -77,7 +218,8 @@ class KalshiTradingEnv(gym.Env):
         
         # Calculate portfolio value
         prev_value = self.portfolio_values[-1]
-        portfolio_value = self._calculate_portfolio_value()
+        unrealized_pnl = self._calculate_unrealized_pnl()
+        portfolio_value = self.balance + unrealized_pnl
         self.portfolio_values.append(portfolio_value)
         self.max_portfolio_value = max(self.max_portfolio_value, portfolio_value)
         
@@ -86,13 +228,13 @@ class KalshiTradingEnv(gym.Env):
         
         # Check if done
         terminated = (
-            self.current_step >= len(self.price_data) - 1 or
+            self.current_step >= self.n_steps - 1 or
             portfolio_value <= 0.2 * self.initial_balance  # Allow more drawdown
         )
-        truncated = False
+        truncated = not terminated and self.current_step >= self.end_step
         
-        observation = self._get_observation()
-        info = self._get_info()
+        observation = self._get_observation(unrealized_pnl, portfolio_value)
+        info = self._get_info(portfolio_value)
         
         return observation, reward, terminated, truncated, info
     
@@ -127,9 +269,8 @@ class KalshiTradingEnv(gym.Env):
             reward += 0.5
         
         # Bonus for trading activity
-        if len(self.trade_history) > 0:
-            recent_trades = len([t for t in self.trade_history if t['step'] > self.current_step - 100])
-            reward += 0.1 * recent_trades
+        if self.num_trades > 0:
+            reward += 0.1 * self.recent_trades
         
         # Only penalize severe drawdowns
         drawdown = (self.max_portfolio_value - current_value) / self.max_portfolio_value
@@ -138,47 +279,57 @@ class KalshiTradingEnv(gym.Env):
         
         return reward
     
-    def _get_observation(self) -> np.ndarray:
-        prices = self.price_data['close'].values
-        price_features = self.feature_engineer.extract_features(prices, self.current_step)
-        
-        current_time = self.price_data.iloc[self.current_step]['datetime']
-        hour = current_time.hour if hasattr(current_time, 'hour') else 12
-        
-        time_features = {
-            'hour_of_day': hour, 'time_to_expiry': 1.0, 'is_near_expiry': 0,
-            'implied_probability': 0.5, 'bid_ask_spread': 0.02
-        }
-        
-        position_features = {
-            'num_positions': len(self.positions),
-            'total_exposure': sum(p['size'] * p['entry_price'] for p in self.positions),
-            'unrealized_pnl': self._calculate_unrealized_pnl(),
-            'portfolio_value': self._calculate_portfolio_value(),
-            'win_rate': self._calculate_win_rate()
-        }
-        
-        state = self.feature_engineer.create_state_vector(
-            price_features, time_features, position_features
-        )
+    def _get_observation(self, unrealized_pnl: float, portfolio_value: float) -> np.ndarray:
+        '''Fill the next observation buffer in place, same layout as write_state
+        
+        Slots that never change (time to expiry, implied probability, spread)
+        were written when the buffers were created.
+        '''
+        self._observation_index ^= 1
+        state = self._observations[self._observation_index]
+        step = self.current_step
+        
+        state[0:self._price_slots] = self.price_state[step]
+        state[20] = len(self.positions) / 10
+        state[21] = self.positions.exposure / 1000
+        state[22] = unrealized_pnl / 1000
+        state[23] = portfolio_value / 10000
+        state[24] = self._calculate_win_rate()
+        state[35] = self.hours[step] / 24
+        state[40] = state[0]
+        if self.strike_ladder is not None:
+            state[41:49] = self.strike_ladder.state[step]
         
         return state
     
     def _execute_trade(self, decision: int, position_size: int) -> float:
+        self.fill_size = 0
+        self.slippage = 0.0
         if decision == 0 or position_size == 0:
             return 0.0
         
-        current_price = self.price_data.iloc[self.current_step]['close']
-        threshold = self.market_sim.generate_threshold(current_price)
-        
-        volatility = self.feature_engineer.calculate_volatility(
-            self.price_data['close'].values[:self.current_step]
-        )
+        step = self.current_step
+        if self.strike_ladder is not None:
+            ladder = self.strike_ladder
+            threshold, bid, ask = ladder.trade_strike[step], ladder.trade_bid[step], ladder.trade_ask[step]
+        else:
+            current_price = self.close_prices[step]
+            threshold = self.market_sim.generate_threshold(current_price, self.np_random)
+            
+            if self.pricer is not None:
+                bid, ask, mid = self.market_sim.quote_probability(
+                    self.pricer.probability_above_one(step, self.expiry_steps, current_price, threshold)
+                )
+            else:
+                bid, ask, mid = self.market_sim.get_contract_prices(
+                    current_price, threshold, time_to_expiry_hours=self.time_to_expiry_hours,
+                    historical_volatility=self.return_volatility[step]
+                )
         
-        bid, ask, mid = self.market_sim.get_contract_prices(
-            current_price, threshold, time_to_expiry_hours=1.0,
-            historical_volatility=volatility
-        )
+        if self.quote_source is not None:
+            quote = self.quote_source.quote(self.timestamps[step], threshold)
+            if quote is not None:
+                threshold, bid, ask = quote
         
         if decision == 1:
             position_type = 'YES'
@@ -195,48 +346,65 @@ class KalshiTradingEnv(gym.Env):
         else:
             return 0.0
         
+        if self.order_book is not None:
+            side = OrderBook.ASK if decision <= 2 else OrderBook.BID
+            quoted_price = entry_price
+            position_size, entry_price = self.order_book.match_one(
+                0, side, position_size, quoted_price, step, self.balance
+            )
+            if position_size == 0:
+                return 0.0  # Book empty or fill unaffordable
+            self.fill_size = position_size
+            # Per contract, positive when the fill is worse than the quote
+            self.slippage = (entry_price - quoted_price) if side == OrderBook.ASK else (quoted_price - entry_price)
+        
         cost = entry_price * position_size
         if cost > self.balance:
             return 0.0  # Just skip if can't afford
         
         self.balance -= cost
         
-        position = {
-            'type': position_type, 'size': position_size, 'entry_price': entry_price,
-            'entry_step': self.current_step, 'threshold': threshold,
-            'expiry_step': self.current_step + 1
-        }
-        
-        self.positions.append(position)
+        self.positions.open(
+            position_type, position_size, entry_price,
+            entry_step=self.current_step, threshold=threshold,
+            expiry_step=self.current_step + self.expiry_steps
+        )
         return 0.0
     
     def _update_positions(self):
-        current_price = self.price_data.iloc[self.current_step]['close']
-        positions_to_remove = []
+        current_price = self.close_prices[self.current_step]
+        book = self.positions
         total_pnl = 0.0
+        resolved = 0
         
-        for i, pos in enumerate(self.positions):
-            if self.current_step >= pos['expiry_step']:
-                contract_resolved = self.market_sim.resolve_contract(
-                    current_price, pos['threshold']
-                )
-                
-                pnl = self.market_sim.calculate_pnl(
-                    pos['type'], pos['size'], pos['entry_price'], contract_resolved
-                )
-                
-                self.balance += (pos['entry_price'] * pos['size'] + pnl)
-                total_pnl += pnl
-                
-                self.trade_history.append({
-                    'step': self.current_step, 'type': pos['type'],
-                    'size': pos['size'], 'pnl': pnl
-                })
-                
-                positions_to_remove.append(i)
-        
-        for i in reversed(positions_to_remove):
-            self.positions.pop(i)
+        for slot in book.pop_due(self.current_step):
+            position_type = POSITION_TYPES[book.position_type[slot]]
+            size = int(book.size[slot])
+            entry_price = book.entry_price[slot]
+            
+            contract_resolved = self.market_sim.resolve_contract(
+                current_price, book.threshold[slot]
+            )
+            
+            pnl = self.market_sim.calculate_pnl(
+                position_type, size, entry_price, contract_resolved
+            )
+            
+            self.balance += (entry_price * size + pnl)
+            total_pnl += pnl
+            resolved += 1
+            if pnl > 0:
+                self.num_wins += 1
+            
+            self.trade_history.append({
+                'step': self.current_step, 'type': position_type,
+                'size': size, 'pnl': pnl
+            })
+        
+        self.num_trades += resolved
+        ring_slot = self.current_step % len(self.recent_trade_counts)
+        self.recent_trades += resolved - self.recent_trade_counts[ring_slot]
+        self.recent_trade_counts[ring_slot] = resolved
         
         return total_pnl
     
@@ -244,30 +412,34 @@ class KalshiTradingEnv(gym.Env):
         return self.balance + self._calculate_unrealized_pnl()
     
     def _calculate_unrealized_pnl(self) -> float:
-        if len(self.positions) == 0:
-            return 0.0
-        
-        unrealized = 0.0
-        for pos in self.positions:
-            time_left = pos['expiry_step'] - self.current_step
-            if time_left > 0:
-                unrealized += pos['size'] * pos['entry_price'] * 0.5
-        
-        return unrealized
+        return self.positions.unrealized_pnl(self.current_step)
     
     def _calculate_win_rate(self) -> float:
-        if len(self.trade_history) == 0:
+        if self.num_trades == 0:
             return 0.5
         
-        wins = sum(1 for trade in self.trade_history if trade['pnl'] > 0)
-        return wins / len(self.trade_history)
+        return self.num_wins / self.num_trades
     
-    def _get_info(self) -> Dict:
-        return {
-            'portfolio_value': self._calculate_portfolio_value(),
+    def _get_info(self, portfolio_value: float) -> Dict:
+        # Portfolio value comes from step/reset rather than another pass over the positions.
+        # Kept a plain dict - gymnasium's env checker and the SB3 wrappers require one.
+        info = {
+            'portfolio_value': portfolio_value,
             'balance': self.balance,
             'num_positions': len(self.positions),
-            'num_trades': len(self.trade_history),
+            'num_trades': self.num_trades,
             'win_rate': self._calculate_win_rate(),
-            'pnl': self._calculate_portfolio_value() - self.initial_balance
+            'pnl': portfolio_value - self.initial_balance
         }
+        if self.order_book is not None:
+            info['fill_size'] = self.fill_size
+            info['slippage'] = self.slippage
+        return info
+    
+    def close(self):
+        if not self._owns_market_data:
+            return
+        # Drop our views first so a shared-memory block we attached can be released
+        self.close_prices = self.hours = self.timestamps = self.price_features = self.return_volatility = None
+        self.timeframe_features = None
+        self.market_data.detach()
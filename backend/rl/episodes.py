@@ -0,0 +1,66 @@
+﻿import numpy as np
+from typing import Optional, Tuple, Union
+
+class EpisodeWindows:
+    '''
+    Precomputed index of valid episode windows over one price series
+    
+    A window (start, length) steps from bar start to bar start + length. It is
+    valid when it leaves room for the feature warm-up before start and no
+    break in the series falls inside the warm-up or the episode. A break is a
+    bar whose timestamp doesn't follow the previous one by the regular bar
+    interval, or a bar flagged invalid in the optional mask.
+    '''
+    
+    def __init__(self, timestamps: np.ndarray, episode_length: Union[int, Tuple[int, int]],
+                 warmup: int = 24, valid_mask: Optional[np.ndarray] = None):
+        if isinstance(episode_length, (tuple, list)):
+            self.min_length, self.max_length = int(episode_length[0]), int(episode_length[1])
+        else:
+            self.min_length = self.max_length = int(episode_length)
+        if not 1 <= self.min_length <= self.max_length:
+            raise ValueError(f'Invalid episode_length {episode_length}')
+        
+        timestamps = np.asarray(timestamps)
+        n = len(timestamps)
+        
+        broken = np.zeros(n, dtype=bool)
+        if n > 1:
+            diffs = np.diff(timestamps)
+            broken[1:] = diffs != np.median(diffs)
+        if valid_mask is not None:
+            # An invalid bar cuts the series on both sides of it
+            invalid = ~np.asarray(valid_mask, dtype=bool)
+            broken |= invalid
+            broken[1:] |= invalid[:-1]
+        
+        index = np.arange(n)
+        
+        # Last break at or before each bar, and first break after it
+        last_break = np.maximum.accumulate(np.where(broken, index, 0))
+        next_break = np.full(n, n)
+        if n > 1:
+            after = np.where(broken[1:], index[1:], n)
+            next_break[:-1] = np.minimum.accumulate(after[::-1])[::-1]
+        
+        # Longest episode from each start that stays clear of the next break
+        longest = next_break - 1 - index
+        ok = (index >= warmup) & (last_break <= index - warmup) & (longest >= self.min_length)
+        
+        self.starts = np.flatnonzero(ok)
+        self.longest = longest[self.starts]
+        
+        if len(self.starts) == 0:
+            raise ValueError(
+                f'No window of {self.min_length}+ steps fits the data after a {warmup}-step warm-up'
+            )
+    
+    def __len__(self) -> int:
+        return len(self.starts)
+    
+    def sample(self, rng: np.random.Generator, size: Optional[int] = None):
+        '''Draw (start, length) uniformly over valid starts, then over lengths that fit'''
+        i = rng.integers(len(self.starts), size=size)
+        high = np.minimum(self.longest[i], self.max_length)
+        lengths = rng.integers(self.min_length, high + 1)
+        return self.starts[i], lengths
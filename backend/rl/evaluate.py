@@ -1,35 +1,38 @@
 ﻿import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from stable_baselines3 import PPO
-from environment import KalshiTradingEnv
+from rl.environment import KalshiTradingEnv
+from rl.experiment import feature_store, load_dataset, load_settings, make_env_kwargs
 
 print('📊 Evaluating AGGRESSIVE Model')
 print('=' * 60)
 
+# Settings the model was trained with, saved next to it by train.py
+model_path = '../../models/ppo_aggressive_final'
+settings = load_settings(model_path)
+
 # Load 15-minute data
 print('Loading data...')
 data_path = os.path.join('..', '..', 'data', 'raw', 'btc_15m_6months.csv')
-df = pd.read_csv(data_path)
-df['datetime'] = pd.to_datetime(df['datetime'])
-
-# Use test set (last 10%)
-test_size = int(len(df) * 0.1)
-test_df = df[-test_size:].reset_index(drop=True)
-print(f'✓ Test data: {len(test_df)} rows')
+# Repaired and split like train.py, so this is the test split it held out
+df, (_, _, test_split) = load_dataset(data_path, settings['data_repair'])
+print(f'✓ Test data: {len(test_split)} rows')
 
 # Load the aggressive model
 print('Loading trained model...')
-model = PPO.load('../../models/ppo_aggressive_final')
+model = PPO.load(model_path)
 print('✓ Model loaded')
 print()
 
 # Create test environment
-env = KalshiTradingEnv(test_df, initial_balance=10000)
+features = feature_store(os.path.join('..', '..', 'data', 'features'), settings)
+# Same balance, strike ladder, order book, quotes, expiry and pricer as the training env
+env = KalshiTradingEnv(test_split.view(features.get(df)), **make_env_kwargs(settings))
 
 # Run evaluation
 print('Running evaluation...')
@@ -69,7 +72,7 @@ print(f'Total Steps: {step}')
 print(f'Total Reward: {episode_reward:.2f}')
 print(f'Final Portfolio Value: {info["portfolio_value"]:.2f}')
 print(f'Total P&L: {info["pnl"]:.2f}')
-print(f'Return: {(info["pnl"] / 10000 * 100):.2f}%')
+print(f'Return: {(info["pnl"] / env.initial_balance * 100):.2f}%')
 print(f'Total Trades: {info["num_trades"]}')
 print(f'Win Rate: {info["win_rate"]*100:.2f}%')
 print()
@@ -80,7 +83,7 @@ if len(portfolio_history) > 1:
     returns = returns[~np.isnan(returns)]
     
     if len(returns) > 0 and np.std(returns) > 0:
-        sharpe_ratio = np.mean(returns) / np.std(returns) * np.sqrt(len(test_df))
+        sharpe_ratio = np.mean(returns) / np.std(returns) * np.sqrt(len(test_split))
     else:
         sharpe_ratio = 0
     
@@ -127,7 +130,7 @@ print('Creating performance chart...')
 fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(12, 8))
 
 ax1.plot(portfolio_history, linewidth=2, color='blue')
-ax1.axhline(y=10000, color='gray', linestyle='--', label='Initial Balance')
+ax1.axhline(y=env.initial_balance, color='gray', linestyle='--', label='Initial Balance')
 ax1.set_title('Portfolio Value Over Time (AGGRESSIVE Model)', fontsize=14, fontweight='bold')
 ax1.set_xlabel('Step')
 ax1.set_ylabel('Portfolio Value ($)')
@@ -0,0 +1,107 @@
+﻿import json
+import os
+import pandas as pd
+from typing import Any, Dict, Optional, Tuple
+
+from data.fetcher import load_ohlcv
+from data.preprocessor import FeatureStore, repair_ohlcv
+from data.recorder import QuoteReplay
+from data.splits import Split, train_val_test
+
+try:
+    from .features import FeatureEngineering
+except ImportError:
+    from features import FeatureEngineering
+
+# Training settings evaluation has to reproduce, saved next to each model
+SETTINGS = (
+    'data_repair', 'higher_timeframes', 'initial_balance', 'strike_ladder', 'order_book', 'quote_store',
+    'expiry_steps', 'monte_carlo'
+)
+DEFAULT_SETTINGS = {
+    'data_repair': 'mask',
+    'higher_timeframes': (),
+    'initial_balance': 10000,
+    'strike_ladder': False,
+    'order_book': False,
+    'quote_store': None,
+    'expiry_steps': 1,
+    'monte_carlo': False
+}
+# State slots the live bots leave at zero, they build states from spot prices alone
+LIVE_UNSUPPORTED = {
+    'higher_timeframes': 'higher-timeframe slots 8-19',
+    'strike_ladder': 'strike ladder slots 41-48'
+}
+
+def load_dataset(data_path: str, data_repair: Optional[str] = 'mask',
+                 verbose: bool = True) -> Tuple[pd.DataFrame, Tuple[Split, Split, Split]]:
+    '''
+    Load candles, repair them and split them 80/10/10 into train/val/test
+    
+    Training and every evaluation script load data through here, so they
+    see the same rows: 'ffill' inserts bars and moves the split boundaries,
+    and 'mask' adds the 'valid' column episode windows break on. data_repair
+    is the repair_ohlcv policy, None skips the check.
+    '''
+    df = load_ohlcv(data_path)
+    if data_repair:
+        df, report = repair_ohlcv(df, policy=data_repair)
+        if verbose:
+            print(report.summary())
+    return df, train_val_test(len(df))
+
+def feature_store(root: str, settings: Dict[str, Any]) -> FeatureStore:
+    '''FeatureStore computing the features a model with these settings was trained on'''
+    return FeatureStore(root, FeatureEngineering(lookback_window=24, higher_timeframes=settings['higher_timeframes']))
+
+def make_env_kwargs(settings: Dict[str, Any]) -> Dict[str, Any]:
+    '''KalshiTradingEnv/KalshiVectorEnv market options for a model's settings'''
+    env_kwargs = {
+        key: settings[key] for key in ('initial_balance', 'strike_ladder', 'order_book', 'expiry_steps', 'monte_carlo')
+    }
+    if settings['quote_store']:
+        env_kwargs['quote_source'] = QuoteReplay.load(settings['quote_store'])
+    return env_kwargs
+
+def check_live_support(settings: Dict[str, Any]):
+    '''Raise ValueError if the model was trained on state slots the live bots can't fill'''
+    unsupported = [slots for key, slots in LIVE_UNSUPPORTED.items() if settings[key]]
+    if unsupported:
+        raise ValueError(
+            f'Model was trained with {" and ".join(unsupported)} filled, which the live bots leave at zero - '
+            f'retrain without {", ".join(key for key in LIVE_UNSUPPORTED if settings[key])}'
+        )
+
+def settings_path(model_path: str) -> str:
+    '''models/ppo_final(.zip) -> models/ppo_final_settings.json'''
+    if model_path.endswith('.zip'):
+        model_path = model_path[:-len('.zip')]
+    return model_path + '_settings.json'
+
+def save_settings(model_path: str, config: Dict[str, Any]) -> str:
+    '''Write the SETTINGS entries of a training config next to the model saved at model_path'''
+    path = settings_path(model_path)
+    with open(path, 'w') as f:
+        json.dump({key: config[key] for key in SETTINGS}, f, indent=2)
+    return path
+
+def load_settings(model_path: str) -> Dict[str, Any]:
+    '''
+    Settings the model at model_path was trained with
+    
+    Models saved before the train scripts wrote settings have none, those
+    get DEFAULT_SETTINGS with a warning. A settings file missing some of
+    SETTINGS raises ValueError.
+    '''
+    path = settings_path(model_path)
+    if not os.path.exists(path):
+        print(f'⚠️ {path} not found, assuming the default settings for {model_path}')
+        return dict(DEFAULT_SETTINGS)
+    with open(path) as f:
+        settings = json.load(f)
+    missing = [key for key in SETTINGS if key not in settings]
+    if missing:
+        raise ValueError(f'{path} is missing {", ".join(missing)}')
+    settings['higher_timeframes'] = tuple(settings['higher_timeframes'])
+    return settings
@@ -1,14 +1,30 @@
-﻿import numpy as np
+﻿import math
+import numpy as np
 import pandas as pd
-from typing import Dict, List
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Column order of the matrix returned by FeatureEngineering.compute_feature_matrix
+PRICE_FEATURE_NAMES = (
+    'current_price', 'returns_1h', 'returns_4h', 'returns_12h',
+    'volatility', 'momentum', 'rsi', 'bollinger_position'
+)
+
+# Features of each higher timeframe bar, fed to state slots 8-19 in groups of four
+TIMEFRAME_FEATURE_NAMES = ('returns_1h', 'volatility', 'rsi', 'bollinger_position')
+TIMEFRAME_FEATURE_COLUMNS = [PRICE_FEATURE_NAMES.index(name) for name in TIMEFRAME_FEATURE_NAMES]
+MAX_HIGHER_TIMEFRAMES = 3
 
 class FeatureEngineering:
     '''
     Extract features from BTC price data for RL state
     '''
     
-    def __init__(self, lookback_window=20):
+    def __init__(self, lookback_window=20, higher_timeframes: Sequence[str] = ()):
+        if len(higher_timeframes) > MAX_HIGHER_TIMEFRAMES:
+            raise ValueError(f'At most {MAX_HIGHER_TIMEFRAMES} higher timeframes fit in the state')
         self.lookback_window = lookback_window
+        self.higher_timeframes = tuple(higher_timeframes)
     
     def calculate_returns(self, prices: np.ndarray) -> np.ndarray:
         '''Calculate percentage returns'''
@@ -96,6 +112,123 @@ class FeatureEngineering:
         
         return features
     
+    def compute_feature_matrix(self, price_history: np.ndarray, chunk_size: int = 16384) -> np.ndarray:
+        '''Extract features for every step at once
+        
+        Row t holds the values of extract_features(price_history, t) in
+        PRICE_FEATURE_NAMES order. Full lookback windows are processed as
+        rolling-window views in chunks so memory stays bounded on long series.
+        '''
+        prices = np.asarray(price_history, dtype=np.float64)
+        n = len(prices)
+        matrix = np.empty((n, len(PRICE_FEATURE_NAMES)), dtype=np.float64)
+        
+        # Partial windows at the start of the series are few - compute them one by one
+        warmup = n if self.lookback_window < 1 else min(n, self.lookback_window)
+        for step in range(warmup):
+            features = self.extract_features(prices, step)
+            matrix[step] = [features[name] for name in PRICE_FEATURE_NAMES]
+        
+        if warmup == n:
+            return matrix
+        
+        width = self.lookback_window + 1
+        windows = sliding_window_view(prices, width)
+        
+        for start in range(0, len(windows), chunk_size):
+            window = windows[start:start + chunk_size]
+            out = matrix[warmup + start:warmup + start + len(window)]
+            
+            # Returns within each window, first entry is 0 like calculate_returns
+            returns = np.zeros_like(window)
+            returns[:, 1:] = np.diff(window, axis=1) / window[:, :-1]
+            
+            out[:, 0] = window[:, -1]
+            out[:, 1] = returns[:, -1]
+            out[:, 2] = returns[:, -4:].mean(axis=1) if width >= 4 else 0
+            out[:, 3] = returns[:, -12:].mean(axis=1) if width >= 12 else 0
+            out[:, 4] = returns[:, -20:].std(axis=1) if width >= 20 else 0
+            out[:, 5] = self._rolling_momentum(window)
+            out[:, 6] = self._rolling_rsi(window)
+            out[:, 7] = self._rolling_bollinger_position(window)
+        
+        return matrix
+    
+    def compute_rolling_volatility(self, price_history: np.ndarray, window: int = 20) -> np.ndarray:
+        '''Return volatility known at each step
+        
+        Entry t equals calculate_volatility(calculate_returns(price_history[:t + 1]), window),
+        so it only uses prices up to and including step t.
+        '''
+        returns = self.calculate_returns(np.asarray(price_history, dtype=np.float64))
+        volatility = np.zeros(len(returns))
+        if len(returns) >= window:
+            volatility[window - 1:] = sliding_window_view(returns, window).std(axis=1)
+        return volatility
+    
+    def compute_timeframe_features(self, timestamps: np.ndarray,
+                                   bars: Sequence[Tuple[np.ndarray, np.ndarray, int]]) -> np.ndarray:
+        '''Higher timeframe features aligned to each base step
+        
+        bars holds (bar open timestamps, bar closes, bar length in ms) per
+        timeframe, e.g. from data.preprocessor.resample_ohlcv. Row t gets the
+        TIMEFRAME_FEATURE_NAMES of the last bar of each timeframe that had
+        closed by the end of base step t, so nothing from a bar still in
+        progress leaks in. Steps before the first closed bar get neutral values.
+        '''
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        base_ms = int(np.median(np.diff(timestamps))) if len(timestamps) > 1 else 0
+        width = len(TIMEFRAME_FEATURE_NAMES)
+        neutral = [0.0, 0.0, 50.0, 0.5]
+        
+        features = np.empty((len(timestamps), width * len(bars)))
+        for i, (bar_timestamps, bar_close, bar_ms) in enumerate(bars):
+            bar_features = self.compute_feature_matrix(bar_close)[:, TIMEFRAME_FEATURE_COLUMNS]
+            closed = np.searchsorted(np.asarray(bar_timestamps) + bar_ms, timestamps + base_ms, side='right') - 1
+            
+            block = features[:, i * width:(i + 1) * width]
+            if len(bar_features):
+                block[:] = bar_features[np.maximum(closed, 0)]
+            block[closed < 0] = neutral
+        
+        return features
+    
+    def _rolling_momentum(self, windows: np.ndarray, window: int = 10) -> np.ndarray:
+        '''Vectorized calculate_momentum over rows of price windows'''
+        if windows.shape[1] < window:
+            return np.zeros(len(windows))
+        return (windows[:, -1] - windows[:, -window]) / windows[:, -window]
+    
+    def _rolling_rsi(self, windows: np.ndarray, period: int = 14) -> np.ndarray:
+        '''Vectorized calculate_rsi over rows of price windows'''
+        if windows.shape[1] < period + 1:
+            return np.full(len(windows), 50.0)
+        
+        deltas = np.diff(windows[:, -period-1:], axis=1)
+        avg_gain = np.where(deltas > 0, deltas, 0).mean(axis=1)
+        avg_loss = np.where(deltas < 0, -deltas, 0).mean(axis=1)
+        
+        has_loss = avg_loss != 0
+        rs = avg_gain / np.where(has_loss, avg_loss, 1.0)
+        return np.where(has_loss, 100 - (100 / (1 + rs)), 100.0)
+    
+    def _rolling_bollinger_position(self, windows: np.ndarray, window: int = 20) -> np.ndarray:
+        '''Vectorized calculate_bollinger_position over rows of price windows'''
+        if windows.shape[1] < window:
+            return np.full(len(windows), 0.5)
+        
+        recent_prices = windows[:, -window:]
+        mean = recent_prices.mean(axis=1)
+        std = recent_prices.std(axis=1)
+        
+        upper_band = mean + 2 * std
+        lower_band = mean - 2 * std
+        band_width = upper_band - lower_band
+        
+        valid = (std != 0) & (band_width != 0)
+        position = (windows[:, -1] - lower_band) / np.where(valid, band_width, 1.0)
+        return np.where(valid, np.clip(position, 0, 1), 0.5)
+    
     def create_state_vector(self, 
                            price_features: Dict[str, float],
                            time_features: Dict[str, float],
@@ -131,3 +264,251 @@ class FeatureEngineering:
         state[42] = time_features.get('bid_ask_spread', 0.02)
         
         return state
+    
+    def scale_price_features(self, price_features: np.ndarray,
+                             timeframe_features: Optional[np.ndarray] = None) -> np.ndarray:
+        '''State slots 0-7 for rows of compute_feature_matrix, scaled as in create_state_vector
+        
+        With rows of compute_timeframe_features the result continues into
+        slots 8-19, four per timeframe, scaled like the matching price features.
+        '''
+        extra = 0 if timeframe_features is None else timeframe_features.shape[-1]
+        scaled = np.empty(price_features.shape[:-1] + (8 + extra,), dtype=np.float32)
+        scaled[..., 0] = price_features[..., 0] / 100000
+        scaled[..., 1] = price_features[..., 1] * 100
+        scaled[..., 2] = price_features[..., 2] * 100
+        scaled[..., 3] = price_features[..., 3] * 100
+        scaled[..., 4] = price_features[..., 4] * 100
+        scaled[..., 5] = price_features[..., 5] * 10
+        scaled[..., 6] = price_features[..., 6] / 100
+        scaled[..., 7] = price_features[..., 7]
+        
+        # Price features (8-19) from higher timeframes
+        if extra:
+            scaled[..., 8::4] = timeframe_features[..., 0::4] * 100
+            scaled[..., 9::4] = timeframe_features[..., 1::4] * 100
+            scaled[..., 10::4] = timeframe_features[..., 2::4] / 100
+            scaled[..., 11::4] = timeframe_features[..., 3::4]
+        return scaled
+    
+    def write_state(self,
+                    out: np.ndarray,
+                    price_features: np.ndarray,
+                    hour_of_day,
+                    num_positions,
+                    total_exposure,
+                    unrealized_pnl,
+                    portfolio_value,
+                    win_rate,
+                    time_to_expiry=1.0,
+                    is_near_expiry=0,
+                    implied_probability=0.5,
+                    bid_ask_spread=0.02,
+                    timeframe_features: Optional[np.ndarray] = None) -> np.ndarray:
+        '''Write state vector(s) into out, same layout as create_state_vector
+        
+        price_features are rows of compute_feature_matrix, timeframe_features
+        optional rows of compute_timeframe_features. Works on a single
+        (50,) state or a (n, 50) batch - the other arguments broadcast against
+        the leading axis. Slots not listed here are left untouched.
+        '''
+        # Price features (0-19)
+        scaled = self.scale_price_features(price_features, timeframe_features)
+        out[..., 0:scaled.shape[-1]] = scaled
+        
+        # Position features (20-34)
+        out[..., 20] = np.divide(num_positions, 10)
+        out[..., 21] = np.divide(total_exposure, 1000)
+        out[..., 22] = np.divide(unrealized_pnl, 1000)
+        out[..., 23] = np.divide(portfolio_value, 10000)
+        out[..., 24] = win_rate
+        
+        # Time features (35-39)
+        out[..., 35] = np.divide(hour_of_day, 24)
+        out[..., 36] = np.divide(time_to_expiry, 24)
+        out[..., 37] = is_near_expiry
+        
+        # Market features (40-49)
+        out[..., 40] = out[..., 0]
+        out[..., 41] = implied_probability
+        out[..., 42] = bid_ask_spread
+        
+        return out
+
+class StreamingFeatureEngineering(FeatureEngineering):
+    '''
+    Incremental version of extract_features for live price feeds
+    
+    Keeps the last few prices in a fixed-size ring buffer plus running sums
+    of returns, squared returns, price gains/losses and prices, so each new
+    price updates every feature in O(1) instead of rescanning the history.
+    Values agree with extract_features on the full history to floating-point
+    rounding. The sums are recomputed from the ring every refresh_interval
+    updates so rounding error can't accumulate.
+    '''
+    RETURN_WINDOWS = (4, 12, 20)
+    VOLATILITY_WINDOW = 20
+    MOMENTUM_WINDOW = 10
+    RSI_PERIOD = 14
+    BOLLINGER_WINDOW = 20
+    
+    def __init__(self, lookback_window=24, refresh_interval: int = 250,
+                 initial_prices: Iterable[float] = ()):
+        # Below 20 the batch window cuts into the 20-step volatility and Bollinger windows
+        if lookback_window < self.BOLLINGER_WINDOW:
+            raise ValueError(f'lookback_window must be at least {self.BOLLINGER_WINDOW}')
+        super().__init__(lookback_window)
+        self.refresh_interval = refresh_interval
+        
+        # Enough history for the longest window plus the price before it
+        self._capacity = self.VOLATILITY_WINDOW + 2
+        self._prices = [0.0] * self._capacity
+        self.count = 0
+        self._since_refresh = 0
+        
+        for price in initial_prices:
+            self.update(price)
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    @property
+    def last_price(self) -> float:
+        if self.count == 0:
+            raise IndexError('no prices seen yet')
+        return self._price(0)
+    
+    def _price(self, lag: int) -> float:
+        '''Price lag updates ago, 0 being the latest'''
+        return self._prices[(self.count - 1 - lag) % self._capacity]
+    
+    def _return(self, lag: int) -> float:
+        '''Return lag updates ago - the first price of the series has return 0 like calculate_returns'''
+        if lag >= self.count - 1:
+            return 0.0
+        previous = self._price(lag + 1)
+        return (self._price(lag) - previous) / previous
+    
+    def _delta(self, lag: int) -> float:
+        return self._price(lag) - self._price(lag + 1)
+    
+    def update(self, price: float) -> Dict[str, float]:
+        '''Add the next price and return the features extract_features gives for it'''
+        self._prices[self.count % self._capacity] = float(price)
+        self.count += 1
+        
+        if self.count == 1 or self._since_refresh >= self.refresh_interval:
+            self._refresh()
+        else:
+            self._slide()
+        
+        return self.features()
+    
+    def _slide(self):
+        n = self.count
+        
+        r = self._return(0)
+        for window in self.RETURN_WINDOWS:
+            self._return_sums[window] += r
+            if n > window:
+                self._return_sums[window] -= self._return(window)
+        self._return_sq_sum += r * r
+        if n > self.VOLATILITY_WINDOW:
+            old = self._return(self.VOLATILITY_WINDOW)
+            self._return_sq_sum -= old * old
+        
+        self._add_delta(self._delta(0), 1)
+        if n > self.RSI_PERIOD + 1:
+            self._add_delta(self._delta(self.RSI_PERIOD), -1)
+        
+        if self._delta(0) != 0:
+            self._price_moves += 1
+        if n > self.BOLLINGER_WINDOW and self._delta(self.BOLLINGER_WINDOW - 1) != 0:
+            self._price_moves -= 1
+        
+        p = self._price(0) - self._price_shift
+        self._price_sum += p
+        self._price_sq_sum += p * p
+        if n > self.BOLLINGER_WINDOW:
+            old = self._price(self.BOLLINGER_WINDOW) - self._price_shift
+            self._price_sum -= old
+            self._price_sq_sum -= old * old
+        
+        self._since_refresh += 1
+    
+    def _add_delta(self, delta: float, sign: int):
+        if delta > 0:
+            self._gain_sum += sign * delta
+            self._gain_count += sign
+        elif delta < 0:
+            self._loss_sum -= sign * delta
+            self._loss_count += sign
+    
+    def _refresh(self):
+        '''Recompute every running sum from the ring buffer'''
+        n = self.count
+        
+        returns = np.array([self._return(lag) for lag in range(min(n, self.VOLATILITY_WINDOW))])
+        self._return_sums = {window: float(np.sum(returns[:window])) for window in self.RETURN_WINDOWS}
+        self._return_sq_sum = float(np.sum(returns * returns))
+        
+        deltas = np.array([self._delta(lag) for lag in range(min(n - 1, self.RSI_PERIOD))])
+        self._gain_sum = float(np.sum(deltas[deltas > 0]))
+        self._gain_count = int(np.count_nonzero(deltas > 0))
+        self._loss_sum = float(-np.sum(deltas[deltas < 0]))
+        self._loss_count = int(np.count_nonzero(deltas < 0))
+        
+        moves = [self._delta(lag) for lag in range(min(n - 1, self.BOLLINGER_WINDOW - 1))]
+        self._price_moves = int(np.count_nonzero(moves))
+        
+        # Sums of prices are taken relative to a recent price so the variance doesn't cancel out
+        self._price_shift = self._price(0)
+        prices = np.array([self._price(lag) for lag in range(min(n, self.BOLLINGER_WINDOW))]) - self._price_shift
+        self._price_sum = float(np.sum(prices))
+        self._price_sq_sum = float(np.sum(prices * prices))
+        
+        self._since_refresh = 0
+    
+    def features(self) -> Dict[str, float]:
+        '''Features of the latest price, same keys and semantics as extract_features'''
+        n = self.count
+        current = self._price(0)
+        
+        features = {
+            'current_price': current,
+            'returns_1h': self._return(0) if n >= 2 else 0,
+            'returns_4h': self._return_sums[4] / 4 if n >= 4 else 0,
+            'returns_12h': self._return_sums[12] / 12 if n >= 12 else 0,
+            'volatility': 0.0, 'momentum': 0.0, 'rsi': 50.0, 'bollinger_position': 0.5
+        }
+        
+        if n >= self.VOLATILITY_WINDOW:
+            mean = self._return_sums[self.VOLATILITY_WINDOW] / self.VOLATILITY_WINDOW
+            variance = self._return_sq_sum / self.VOLATILITY_WINDOW - mean * mean
+            features['volatility'] = math.sqrt(max(variance, 0.0))
+        
+        if n >= self.MOMENTUM_WINDOW:
+            past = self._price(self.MOMENTUM_WINDOW - 1)
+            features['momentum'] = (current - past) / past
+        
+        if n >= self.RSI_PERIOD + 1:
+            if self._loss_count == 0:
+                features['rsi'] = 100.0
+            else:
+                avg_gain = self._gain_sum / self.RSI_PERIOD if self._gain_count else 0.0
+                rs = avg_gain / (self._loss_sum / self.RSI_PERIOD)
+                features['rsi'] = 100 - (100 / (1 + rs))
+        
+        if n >= self.BOLLINGER_WINDOW and self._price_moves > 0:
+            mean = self._price_sum / self.BOLLINGER_WINDOW
+            variance = self._price_sq_sum / self.BOLLINGER_WINDOW - mean * mean
+            std = math.sqrt(max(variance, 0.0))
+            mean += self._price_shift
+            
+            upper_band = mean + 2 * std
+            lower_band = mean - 2 * std
+            if upper_band != lower_band:
+                position = (current - lower_band) / (upper_band - lower_band)
+                features['bollinger_position'] = min(max(position, 0.0), 1.0)
+        
+        return features
@@ -0,0 +1,222 @@
+﻿import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from typing import Any, Dict, Optional
+
+try:
+    from .features import FeatureEngineering
+except ImportError:
+    from features import FeatureEngineering
+
+def hour_of_day(price_data: pd.DataFrame) -> np.ndarray:
+    '''Hour of each row as an int array, 12 when there is no usable datetime column'''
+    if 'datetime' in price_data and pd.api.types.is_datetime64_any_dtype(price_data['datetime']):
+        return price_data['datetime'].dt.hour.to_numpy(dtype=np.int64)
+    return np.full(len(price_data), 12, dtype=np.int64)
+
+def timestamps_ms(price_data: pd.DataFrame) -> np.ndarray:
+    '''Bar open times in epoch milliseconds, falling back to the row index'''
+    if 'datetime' in price_data and pd.api.types.is_datetime64_any_dtype(price_data['datetime']):
+        return price_data['datetime'].to_numpy(dtype='datetime64[ms]').view(np.int64)
+    if 'timestamp' in price_data:
+        return price_data['timestamp'].to_numpy(dtype=np.int64)
+    return np.arange(len(price_data), dtype=np.int64)
+
+def bar_hours(timestamp: np.ndarray, default: float = 1.0) -> float:
+    '''
+    Median bar length in hours
+    
+    default when there are fewer than two distinct bars or the steps are
+    under a minute, i.e. timestamps_ms fell back to the row index.
+    '''
+    steps = np.diff(np.asarray(timestamp, dtype=np.int64))
+    steps = steps[steps > 0]
+    if len(steps) == 0:
+        return default
+    step_ms = float(np.median(steps))
+    return step_ms / 3_600_000 if step_ms >= 60_000 else default
+
+class MarketArrays:
+    '''
+    Per-step arrays the trading environments read while stepping
+    
+    Built once from a price DataFrame, then either saved as a bundle of .npy
+    files that load memory-mapped, or copied into one named shared-memory
+    block. Worker processes attach to the bundle or block instead of
+    unpickling a DataFrame and recomputing features, so N workers share a
+    single read-only copy of the data.
+    '''
+    FIELDS = ('close', 'hour', 'timestamp', 'price_features', 'return_volatility', 'timeframe_features', 'valid')
+    METADATA_FILE = 'metadata.json'
+    
+    def __init__(self, close: np.ndarray, hour: np.ndarray, timestamp: np.ndarray,
+                 price_features: np.ndarray, return_volatility: np.ndarray, lookback_window: int,
+                 timeframe_features: Optional[np.ndarray] = None, valid: Optional[np.ndarray] = None):
+        self.close = close
+        self.hour = hour
+        self.timestamp = timestamp
+        self.price_features = price_features
+        self.return_volatility = return_volatility
+        # Higher timeframe features for state slots 8-19, no columns when not used
+        if timeframe_features is None:
+            timeframe_features = np.zeros((len(close), 0))
+        self.timeframe_features = timeframe_features
+        # Bars flagged by data.preprocessor.repair_ohlcv, kept out of sampled episode windows
+        if valid is None:
+            valid = np.ones(len(close), dtype=bool)
+        self.valid = valid
+        self.lookback_window = lookback_window
+        self._shared_memory = None
+        self._owns_shared_memory = False
+        self._spec = None
+        self._base = None  # Instance a view() was taken from, kept alive with it
+    
+    @classmethod
+    def from_dataframe(cls, price_data: pd.DataFrame, feature_engineer: Optional[FeatureEngineering] = None,
+                       timeframe_features: Optional[np.ndarray] = None) -> 'MarketArrays':
+        '''Extract columns and compute per-step features from a price DataFrame
+        
+        timeframe_features are rows of FeatureEngineering.compute_timeframe_features,
+        which needs resampled bars - see data.preprocessor.
+        '''
+        feature_engineer = feature_engineer or FeatureEngineering(lookback_window=24)
+        close = np.ascontiguousarray(price_data['close'].values, dtype=np.float64)
+        return cls(
+            close=close,
+            hour=hour_of_day(price_data),
+            timestamp=timestamps_ms(price_data),
+            price_features=feature_engineer.compute_feature_matrix(close),
+            return_volatility=feature_engineer.compute_rolling_volatility(close),
+            lookback_window=feature_engineer.lookback_window,
+            timeframe_features=timeframe_features,
+            valid=price_data['valid'].to_numpy(dtype=bool) if 'valid' in price_data else None
+        )
+    
+    def __len__(self) -> int:
+        return len(self.close)
+    
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in self.FIELDS}
+    
+    def view(self, start: int, stop: int) -> 'MarketArrays':
+        '''
+        Rows [start, stop) without copying
+        
+        Every field is a basic slice, so a view of a memory-mapped bundle or
+        shared-memory block reads the same pages. Features keep the history
+        before start instead of warming up again. A view of a shared instance
+        has a shared_memory_spec that attaches workers to just those rows.
+        '''
+        start, stop, _ = slice(start, stop).indices(len(self))
+        view = type(self)(lookback_window=self.lookback_window,
+                          **{name: array[start:stop] for name, array in self.arrays().items()})
+        view._base = self
+        if self._spec is not None:
+            offset = self._spec.get('rows', (0, 0))[0]
+            view._spec = dict(self._spec, rows=(offset + start, offset + stop))
+        return view
+    
+    def save(self, path: str):
+        '''Write every array to <path>/<field>.npy plus a metadata file'''
+        os.makedirs(path, exist_ok=True)
+        for name, array in self.arrays().items():
+            np.save(os.path.join(path, name + '.npy'), array)
+        
+        metadata = {'lookback_window': self.lookback_window, 'length': len(self), 'fields': list(self.FIELDS)}
+        with open(os.path.join(path, self.METADATA_FILE), 'w') as f:
+            json.dump(metadata, f, indent=2)
+    
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = 'r') -> 'MarketArrays':
+        '''Open a bundle written by save, memory-mapped read-only by default'''
+        with open(os.path.join(path, cls.METADATA_FILE)) as f:
+            metadata = json.load(f)
+        
+        # Bundles saved before a field existed load with its default
+        arrays = {
+            name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+            for name in cls.FIELDS if name in metadata.get('fields', cls.FIELDS)
+        }
+        return cls(lookback_window=metadata['lookback_window'], **arrays)
+    
+    def to_shared_memory(self, name: Optional[str] = None) -> 'MarketArrays':
+        '''
+        Copy the arrays into one new shared-memory block
+        
+        The returned instance owns the block - call unlink() on it once every
+        worker is done. Pass its shared_memory_spec to worker processes.
+        '''
+        layout = []
+        offset = 0
+        for field, array in self.arrays().items():
+            offset = -(-offset // 64) * 64  # Keep each array cache-line aligned
+            layout.append((field, array.dtype.str, array.shape, offset))
+            offset += array.nbytes
+        
+        block = shared_memory.SharedMemory(name=name, create=True, size=max(offset, 1))
+        spec = {'name': block.name, 'lookback_window': self.lookback_window, 'layout': layout}
+        
+        shared = self._from_block(block, spec)
+        for field, array in self.arrays().items():
+            target = getattr(shared, field)
+            target.flags.writeable = True
+            target[...] = array
+            target.flags.writeable = False
+        
+        shared._owns_shared_memory = True
+        return shared
+    
+    @classmethod
+    def from_shared_memory(cls, spec: Dict[str, Any]) -> 'MarketArrays':
+        '''Attach read-only to a block created by to_shared_memory'''
+        # Workers started by multiprocessing share the owner's resource tracker, so the
+        # registration made by attaching is a duplicate and the owner's unlink clears it
+        if sys.version_info >= (3, 13):
+            block = shared_memory.SharedMemory(name=spec['name'], track=False)
+        else:
+            block = shared_memory.SharedMemory(name=spec['name'])
+        return cls._from_block(block, spec)
+    
+    @classmethod
+    def _from_block(cls, block: shared_memory.SharedMemory, spec: Dict[str, Any]) -> 'MarketArrays':
+        arrays = {}
+        for field, dtype, shape, offset in spec['layout']:
+            array = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=block.buf, offset=offset)
+            array.flags.writeable = False
+            arrays[field] = array
+        if 'rows' in spec:
+            start, stop = spec['rows']
+            arrays = {field: array[start:stop] for field, array in arrays.items()}
+        
+        shared = cls(lookback_window=spec['lookback_window'], **arrays)
+        shared._shared_memory = block
+        shared._spec = spec
+        return shared
+    
+    @property
+    def shared_memory_spec(self) -> Optional[Dict[str, Any]]:
+        '''Small picklable description of the block, None if not in shared memory'''
+        root = self
+        while root._base is not None:
+            root = root._base
+        return self._spec if root._shared_memory is not None else None
+    
+    def detach(self):
+        '''Detach from the shared-memory block, if any'''
+        if self._shared_memory is None:
+            return
+        for field in self.FIELDS:
+            setattr(self, field, None)  # Views must go before the buffer can be released
+        self._shared_memory.close()
+        self._shared_memory = None
+    
+    def unlink(self):
+        '''Detach and destroy the block - only valid on the instance that created it'''
+        block = self._shared_memory
+        if block is None or not self._owns_shared_memory:
+            raise ValueError('unlink() must be called on the instance returned by to_shared_memory()')
+        self.detach()
+        block.unlink()
@@ -1,6 +1,8 @@
-﻿import numpy as np
-from scipy.stats import norm
-from typing import Tuple
+﻿import math
+import numpy as np
+from numpy.typing import ArrayLike
+from scipy.special import ndtr
+from typing import Optional, Sequence, Tuple
 
 class KalshiMarketSimulator:
     '''Simulate Kalshi binary option pricing'''
@@ -9,31 +11,82 @@ class KalshiMarketSimulator:
         self.base_spread = base_spread
         self.volatility_factor = volatility_factor
     
-    def generate_threshold(self, current_price: float) -> float:
-        '''Generate a threshold near current price'''
-        offset_pct = np.random.uniform(-0.05, 0.05)
+    def generate_threshold(self, current_price: float, rng: Optional[np.random.Generator] = None) -> float:
+        '''Generate a threshold near current price, drawn from rng (the global NumPy state if None)'''
+        offset_pct = (rng if rng is not None else np.random).uniform(-0.05, 0.05)
         threshold = current_price * (1 + offset_pct)
         threshold = round(threshold / 100) * 100
         return threshold
     
+    def strike_ladder(self, current_price: ArrayLike, spacing: float = 250.0, n_strikes: int = 11) -> np.ndarray:
+        '''n_strikes strikes spacing apart centred on the nearest multiple of spacing, one row per price'''
+        center = np.round(np.asarray(current_price, dtype=np.float64) / spacing) * spacing
+        return center[..., None] + (np.arange(n_strikes) - n_strikes // 2) * spacing
+    
+    def implied_probabilities(self, current_price: ArrayLike, threshold: ArrayLike,
+                              time_to_expiry_hours: ArrayLike, historical_volatility: ArrayLike) -> np.ndarray:
+        '''
+        Implied probabilities that BTC ends above threshold, over arrays
+        
+        Arguments broadcast against each other, so one call prices a batch of
+        envs, a backtest or a ladder of strikes. ndtr is SciPy's erf-based
+        normal CDF ufunc - the same values as norm.cdf without the overhead of
+        the distribution machinery.
+        '''
+        current_price = np.asarray(current_price, dtype=np.float64)
+        threshold = np.asarray(threshold, dtype=np.float64)
+        time_to_expiry_hours = np.asarray(time_to_expiry_hours, dtype=np.float64)
+        
+        distance = (current_price - threshold) / threshold
+        volatility = np.maximum(historical_volatility, 0.01)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            time_factor = np.sqrt(time_to_expiry_hours / 24)
+            z_score = distance / (volatility * time_factor * self.volatility_factor)
+        probability = np.clip(ndtr(z_score), 0.05, 0.95)
+        
+        # Expired contracts are settled, not priced
+        expired = time_to_expiry_hours <= 0
+        if expired.any():
+            probability = np.where(expired, (current_price >= threshold).astype(np.float64), probability)
+        return probability
+    
+    def contract_prices(self, current_price: ArrayLike, threshold: ArrayLike, time_to_expiry_hours: ArrayLike,
+                        historical_volatility: ArrayLike) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''Bid, ask and mid arrays for YES contracts, see implied_probabilities'''
+        mid = self.implied_probabilities(current_price, threshold, time_to_expiry_hours, historical_volatility)
+        return self.quote_probabilities(mid)
+    
+    def quote_probabilities(self, mid: ArrayLike) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''Bid, ask and mid arrays around probabilities from any pricer, wider near 0.5'''
+        mid = np.asarray(mid, dtype=np.float64)
+        uncertainty_factor = 1 - np.abs(mid - 0.5) * 2
+        spread = self.base_spread * (1 + uncertainty_factor)
+        
+        bid = np.clip(mid - spread / 2, 0.01, 0.99)
+        ask = np.clip(mid + spread / 2, 0.01, 0.99)
+        mid = (bid + ask) / 2
+        
+        return bid, ask, mid
+    
     def calculate_implied_probability(self,
                                      current_price: float,
                                      threshold: float,
                                      time_to_expiry_hours: float,
                                      historical_volatility: float) -> float:
         '''Calculate implied probability that BTC will be above threshold'''
+        # Scalar version of implied_probabilities, kept in plain floats since
+        # NumPy's per-call overhead dominates for a single contract
         if time_to_expiry_hours <= 0:
             return 1.0 if current_price >= threshold else 0.0
         
         distance = (current_price - threshold) / threshold
         volatility = max(historical_volatility, 0.01)
-        time_factor = np.sqrt(time_to_expiry_hours / 24)
+        time_factor = math.sqrt(time_to_expiry_hours / 24)
         
         z_score = distance / (volatility * time_factor * self.volatility_factor)
-        probability = norm.cdf(z_score)
-        probability = np.clip(probability, 0.05, 0.95)
-        
-        return probability
+        probability = float(ndtr(z_score))
+        return min(max(probability, 0.05), 0.95)
     
     def get_contract_prices(self,
                            current_price: float,
@@ -44,16 +97,16 @@ class KalshiMarketSimulator:
         mid = self.calculate_implied_probability(
             current_price, threshold, time_to_expiry_hours, historical_volatility
         )
-        
+        return self.quote_probability(mid)
+    
+    def quote_probability(self, mid: float) -> Tuple[float, float, float]:
+        '''Scalar version of quote_probabilities'''
         spread = self.base_spread
         uncertainty_factor = 1 - abs(mid - 0.5) * 2
         spread = spread * (1 + uncertainty_factor)
         
-        bid = mid - spread / 2
-        ask = mid + spread / 2
-        
-        bid = np.clip(bid, 0.01, 0.99)
-        ask = np.clip(ask, 0.01, 0.99)
+        bid = min(max(mid - spread / 2, 0.01), 0.99)
+        ask = min(max(mid + spread / 2, 0.01), 0.99)
         mid = (bid + ask) / 2
         
         return bid, ask, mid
@@ -75,3 +128,273 @@ class KalshiMarketSimulator:
         
         pnl = (payout_per_contract - entry_price) * position_size
         return pnl
+
+class MonteCarloPricer:
+    '''
+    Binary and range contract probabilities from simulated price paths
+    
+    Paths are simulated once, in standardized units: per-bar log-return
+    shocks with unit volatility, n_paths by horizon bars, summed along each
+    path. The terminal return over h bars from step t is then
+    sigma_t * X_h - sigma_t^2 h / 2, where sigma_t is the volatility known at
+    t. So one sorted sample of X_h per horizon prices every step and every
+    strike: P(S_T >= K) is a binary search for the standardized log distance
+    to K. Sorted samples are cached per horizon the first time it is asked
+    for, which is what keeps hourly (4-bar) and daily (96-bar) expiries as
+    cheap as one-bar ones.
+    
+    Shock models:
+    
+    - 'gbm': standard normal shocks (geometric Brownian motion)
+    - 'bootstrap': historical log returns divided by the volatility known
+      before them, demeaned and drawn with replacement (filtered historical
+      simulation). The pool comes from the series the pricer is built on, so build it on
+      training rows to keep test returns out.
+    - 'jump': normal shocks plus Poisson(jump_intensity) jumps per bar of
+      N(jump_mean, jump_std) each, in the same units (Merton jump diffusion)
+    
+    Prices depend on the market, not on an episode, so the pricer has its
+    own seed and every env built on the same data quotes the same prices.
+    '''
+    MODELS = ('gbm', 'bootstrap', 'jump')
+    
+    def __init__(self, close: np.ndarray, return_volatility: np.ndarray, model: str = 'gbm',
+                 n_paths: int = 2000, jump_intensity: float = 0.01, jump_mean: float = 0.0,
+                 jump_std: float = 4.0, min_volatility: float = 1e-4, seed: int = 0):
+        if model not in self.MODELS:
+            raise ValueError(f'model must be one of {self.MODELS}, got {model!r}')
+        self.close = np.asarray(close, dtype=np.float64)
+        self.volatility = np.maximum(np.asarray(return_volatility, dtype=np.float64), min_volatility)
+        self.model = model
+        self.n_paths = n_paths
+        self.jump_intensity = jump_intensity
+        self.jump_mean = jump_mean
+        self.jump_std = jump_std
+        self.rng = np.random.default_rng(seed)
+        
+        if model == 'bootstrap':
+            log_returns = np.diff(np.log(self.close))
+            known = np.asarray(return_volatility[:-1]) > 0  # Skip the warm-up, where volatility is unknown
+            residuals = log_returns[known] / self.volatility[:-1][known]
+            if len(residuals) == 0:
+                raise ValueError('Not enough rows with a known volatility to bootstrap from')
+            # Demeaned so the pool's realised drift doesn't leak into every price
+            self.residuals = residuals - residuals.mean()
+        
+        self._paths = np.zeros((n_paths, 0))
+        self._sorted = {}
+    
+    def _shocks(self, n_bars: int) -> np.ndarray:
+        shape = (self.n_paths, n_bars)
+        if self.model == 'bootstrap':
+            return self.residuals[self.rng.integers(0, len(self.residuals), shape)]
+        shocks = self.rng.standard_normal(shape)
+        if self.model == 'jump':
+            jumps = self.rng.poisson(self.jump_intensity, shape)
+            shocks += jumps * self.jump_mean + np.sqrt(jumps) * self.jump_std * self.rng.standard_normal(shape)
+        return shocks
+    
+    def terminal_sample(self, horizon: int) -> np.ndarray:
+        '''Sorted standardized path sums after horizon bars, simulating further paths on first use'''
+        sample = self._sorted.get(horizon)
+        if sample is not None:
+            return sample
+        if horizon < 1:
+            raise ValueError(f'horizon must be at least one bar, got {horizon}')
+        
+        simulated = self._paths.shape[1]
+        if horizon > simulated:
+            # Extend the existing paths, so shorter horizons stay the prefix of longer ones
+            last = self._paths[:, -1:] if simulated else np.zeros((self.n_paths, 1))
+            extension = last + np.cumsum(self._shocks(horizon - simulated), axis=1)
+            self._paths = np.concatenate([self._paths, extension], axis=1)
+        
+        sample = np.sort(self._paths[:, horizon - 1])
+        self._sorted[horizon] = sample
+        return sample
+    
+    def _standardized_distance(self, step, horizon, price, strike):
+        volatility = self.volatility[step]
+        return (np.log(strike / price) + 0.5 * volatility * volatility * horizon) / volatility
+    
+    def probability_above(self, step: ArrayLike, horizon: int, price: ArrayLike, strike: ArrayLike) -> np.ndarray:
+        '''P(price after horizon bars >= strike), for arrays of steps, prices and strikes'''
+        sample = self.terminal_sample(horizon)
+        distance = self._standardized_distance(np.asarray(step), horizon, np.asarray(price, dtype=np.float64),
+                                               np.asarray(strike, dtype=np.float64))
+        return (self.n_paths - np.searchsorted(sample, distance, side='left')) / self.n_paths
+    
+    def probability_between(self, step: ArrayLike, horizon: int, price: ArrayLike,
+                            floor_strike: ArrayLike, cap_strike: ArrayLike) -> np.ndarray:
+        '''P(floor_strike <= price after horizon bars < cap_strike), the payoff of a range contract'''
+        return (self.probability_above(step, horizon, price, floor_strike) -
+                self.probability_above(step, horizon, price, cap_strike))
+    
+    def probability_above_one(self, step: int, horizon: int, price: float, strike: float) -> float:
+        '''Scalar version of probability_above, without the per-call array overhead'''
+        sample = self._sorted.get(horizon)
+        if sample is None:
+            sample = self.terminal_sample(horizon)
+        distance = self._standardized_distance(step, horizon, price, strike)
+        return (self.n_paths - int(np.searchsorted(sample, distance, side='left'))) / self.n_paths
+
+class StrikeLadder:
+    '''
+    A KXBTC-style ladder of strikes for every step of a price series
+    
+    Real events list strikes at fixed increments around the price, so a
+    ladder is a function of the price alone: all steps are built and priced
+    in one contract_prices call up front, and trading at a step is a lookup.
+    Strikes are ranked by how uncertain they are (mid closest to 0.5) - the
+    contracts a trader actually looks at. The top one is the contract the
+    environments trade, and observation slots 41-48 describe it and the
+    next best ones:
+    
+    - 41, 42: implied probability and bid-ask spread of the traded strike
+    - 43-48: (distance from price in %, implied probability) of the
+      n_best best strikes, in rank order
+    
+    Contracts are priced by market_sim's normal model, or by pricer (a
+    MonteCarloPricer on the same rows) over horizon bars when one is given.
+    Read-only and built from the same arrays as the env, so envs sharing
+    data can share a ladder.
+    '''
+    MAX_BEST = 3
+    
+    def __init__(self, market_sim: KalshiMarketSimulator, close: np.ndarray, return_volatility: np.ndarray,
+                 n_strikes: int = 11, spacing: float = 250.0, time_to_expiry_hours: float = 1.0, n_best: int = 3,
+                 pricer: Optional[MonteCarloPricer] = None, horizon: int = 1):
+        if not 1 <= n_best <= min(n_strikes, self.MAX_BEST):
+            raise ValueError(f'n_best must be between 1 and {min(n_strikes, self.MAX_BEST)}, got {n_best}')
+        close = np.asarray(close, dtype=np.float64)
+        self.spacing = spacing
+        self.strikes = market_sim.strike_ladder(close, spacing, n_strikes)
+        if pricer is None:
+            self.bid, self.ask, self.mid = market_sim.contract_prices(
+                close[:, None], self.strikes, time_to_expiry_hours, np.asarray(return_volatility)[:, None]
+            )
+        else:
+            probability = pricer.probability_above(np.arange(len(close))[:, None], horizon, close[:, None], self.strikes)
+            self.bid, self.ask, self.mid = market_sim.quote_probabilities(probability)
+        self.best = np.argsort(np.abs(self.mid - 0.5), axis=1, kind='stable')[:, :n_best]
+        
+        rows = np.arange(len(close))
+        top = self.best[:, 0]
+        self.trade_strike = self.strikes[rows, top]
+        self.trade_bid = self.bid[rows, top]
+        self.trade_ask = self.ask[rows, top]
+        
+        best_strikes = np.take_along_axis(self.strikes, self.best, axis=1)
+        best_mid = np.take_along_axis(self.mid, self.best, axis=1)
+        self.state = np.zeros((len(close), 2 + 2 * self.MAX_BEST), dtype=np.float32)
+        self.state[:, 0] = self.mid[rows, top]
+        self.state[:, 1] = self.trade_ask - self.trade_bid
+        self.state[:, 2:2 + 2 * n_best:2] = (best_strikes / close[:, None] - 1) * 100
+        self.state[:, 3:3 + 2 * n_best:2] = best_mid
+    
+    def __len__(self) -> int:
+        return len(self.trade_strike)
+
+class OrderBook:
+    '''
+    L2 depth behind the quoted bid and ask, for one or more books
+    
+    Levels sit a tick apart outward from the touch (ask, ask + tick, ... and
+    bid, bid - tick, ...) with their resting size kept per book in a
+    (n_books, 2, levels) array, so matching an order is a cumulative sum over
+    its side: it takes level after level until its size is met, and fills
+    partially when the book runs out. Size our orders take comes back at
+    replenish_rate of the missing amount per step, applied lazily when the
+    book is next matched, so orders in quick succession walk deeper into the
+    book.
+    
+    Prices are offsets from whatever touch the caller quotes, so the depth
+    stands for the liquidity market makers offer around the traded strike
+    rather than one contract's queue.
+    '''
+    BID, ASK = 0, 1
+    
+    def __init__(self, n_books: int = 1, level_depth: Sequence[float] = (100, 150, 200, 300, 500),
+                 tick: float = 0.01, replenish_rate: float = 0.5):
+        if not 0 < replenish_rate <= 1:
+            raise ValueError(f'replenish_rate must be in (0, 1], got {replenish_rate}')
+        self.base_depth = np.asarray(level_depth, dtype=np.float64)
+        self.tick = tick
+        self.replenish_rate = replenish_rate
+        self.offsets = np.arange(len(self.base_depth)) * tick
+        self._offset_list = self.offsets.tolist()
+        self.depth = np.empty((n_books, 2, len(self.base_depth)))
+        self.last_step = np.zeros(n_books, dtype=np.int64)
+        self.reset()
+    
+    def reset(self, books: Optional[ArrayLike] = None):
+        '''Restore full depth, for every book or the given ones'''
+        books = slice(None) if books is None else books
+        self.depth[books] = self.base_depth
+        self.last_step[books] = 0
+    
+    def level_prices(self, side: ArrayLike, touch: ArrayLike) -> np.ndarray:
+        '''Price of every level of side behind touch, one row per order'''
+        direction = np.where(np.asarray(side) == self.ASK, 1.0, -1.0)
+        return np.clip(np.asarray(touch, dtype=np.float64)[..., None] + direction[..., None] * self.offsets, 0.01, 0.99)
+    
+    def match(self, books: np.ndarray, side: np.ndarray, size: np.ndarray, touch: np.ndarray,
+              step: np.ndarray, budget: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Fill one marketable order per book and return (filled size, average price)
+        
+        side is ASK for orders that buy (lifting the asks) and BID for orders
+        that sell. Orders whose fill would cost more than budget are not
+        filled at all and leave the book untouched. Each book may appear once.
+        '''
+        self._replenish(books, step)
+        depth = np.floor(self.depth[books, side])
+        before = np.cumsum(depth, axis=1) - depth
+        level_fill = np.clip(np.asarray(size, dtype=np.float64)[:, None] - before, 0.0, depth)
+        
+        filled = level_fill.sum(axis=1)
+        cost = (level_fill * self.level_prices(side, touch)).sum(axis=1)
+        average_price = np.divide(cost, filled, out=np.array(touch, dtype=np.float64), where=filled > 0)
+        
+        accepted = (filled > 0) & (cost <= budget)
+        self.depth[books[accepted], side[accepted]] -= level_fill[accepted]
+        return np.where(accepted, filled, 0.0), average_price
+    
+    def match_one(self, book: int, side: int, size: int, touch: float, step: int,
+                  budget: float) -> Tuple[int, float]:
+        '''Scalar version of match for a single order, without the per-call array overhead'''
+        elapsed = step - int(self.last_step[book])
+        if elapsed > 0:
+            depth = self.depth[book]
+            depth -= self.base_depth
+            depth *= (1 - self.replenish_rate) ** elapsed
+            depth += self.base_depth
+            self.last_step[book] = step
+        depth = self.depth[book, side]
+        direction = 1.0 if side == self.ASK else -1.0
+        
+        remaining = size
+        cost = 0.0
+        fills = []
+        for resting, offset in zip(depth.tolist(), self._offset_list):
+            take = min(remaining, math.floor(resting))
+            fills.append(take)
+            cost += take * min(max(touch + direction * offset, 0.01), 0.99)
+            remaining -= take
+            if remaining == 0:
+                break
+        
+        filled = size - remaining
+        if filled == 0 or cost > budget:
+            return 0, touch
+        for level, take in enumerate(fills):
+            depth[level] -= take
+        return filled, cost / filled
+    
+    def _replenish(self, books: np.ndarray, step: np.ndarray):
+        elapsed = step - self.last_step[books]
+        due = elapsed > 0
+        books, elapsed = books[due], elapsed[due]
+        recovery = (1 - self.replenish_rate) ** elapsed.astype(np.float64)
+        self.depth[books] = self.base_depth - (self.base_depth - self.depth[books]) * recovery[:, None, None]
+        self.last_step[books] = step[due]
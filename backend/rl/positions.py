@@ -0,0 +1,112 @@
+﻿import heapq
+import numpy as np
+from typing import List
+
+POSITION_TYPES = ('YES', 'NO', 'YES_SHORT', 'NO_SHORT')
+POSITION_TYPE_CODES = {name: code for code, name in enumerate(POSITION_TYPES)}
+
+class PositionBook:
+    '''
+    Open positions stored as preallocated struct-of-arrays
+    
+    Each position occupies a slot in the column arrays. A min-heap keyed on
+    expiry_step indexes the slots, so resolving a step only touches the
+    positions that are due, and exposure is kept as a running total instead
+    of being summed over every position.
+    '''
+    
+    def __init__(self, capacity: int = 64):
+        self.position_type = np.zeros(capacity, dtype=np.int8)
+        self.size = np.zeros(capacity, dtype=np.int64)
+        self.entry_price = np.zeros(capacity, dtype=np.float64)
+        self.entry_step = np.zeros(capacity, dtype=np.int64)
+        self.threshold = np.zeros(capacity, dtype=np.float64)
+        self.expiry_step = np.zeros(capacity, dtype=np.int64)
+        
+        self.exposure = 0.0
+        self._free_slots = list(range(capacity - 1, -1, -1))
+        self._expiry_heap = []
+        self._sequence = 0
+    
+    def __len__(self) -> int:
+        return len(self._expiry_heap)
+    
+    @property
+    def capacity(self) -> int:
+        return len(self.size)
+    
+    def clear(self):
+        '''Drop every open position'''
+        self.exposure = 0.0
+        self._free_slots = list(range(self.capacity - 1, -1, -1))
+        self._expiry_heap = []
+        self._sequence = 0
+    
+    def open(self, position_type: str, size: int, entry_price: float,
+             entry_step: int, threshold: float, expiry_step: int) -> int:
+        '''Add a position and return its slot'''
+        if not self._free_slots:
+            self._grow()
+        
+        slot = self._free_slots.pop()
+        self.position_type[slot] = POSITION_TYPE_CODES[position_type]
+        self.size[slot] = size
+        self.entry_price[slot] = entry_price
+        self.entry_step[slot] = entry_step
+        self.threshold[slot] = threshold
+        self.expiry_step[slot] = expiry_step
+        
+        # The sequence number keeps positions with the same expiry in opening order
+        heapq.heappush(self._expiry_heap, (expiry_step, self._sequence, slot))
+        self._sequence += 1
+        self.exposure += size * entry_price
+        return slot
+    
+    def pop_due(self, step: int) -> List[int]:
+        '''
+        Remove positions with expiry_step <= step and return their slots
+        
+        The column values of the returned slots stay readable until the next
+        call to open.
+        '''
+        due = []
+        while self._expiry_heap and self._expiry_heap[0][0] <= step:
+            _, _, slot = heapq.heappop(self._expiry_heap)
+            self.exposure -= self.size[slot] * self.entry_price[slot]
+            self._free_slots.append(slot)
+            due.append(slot)
+        
+        if not self._expiry_heap:
+            self.exposure = 0.0  # Don't let rounding drift survive an empty book
+        return due
+    
+    def unrealized_pnl(self, step: int) -> float:
+        '''Half the cost of every position that has not reached its expiry yet'''
+        if not self._expiry_heap:
+            return 0.0
+        return (self.exposure - self._due_exposure(step)) * 0.5
+    
+    def _due_exposure(self, step: int) -> float:
+        '''Exposure of positions with expiry_step <= step, visiting only those heap entries'''
+        heap = self._expiry_heap
+        exposure = 0.0
+        stack = [0]
+        while stack:
+            i = stack.pop()
+            if i >= len(heap) or heap[i][0] > step:
+                continue
+            slot = heap[i][2]
+            exposure += self.size[slot] * self.entry_price[slot]
+            stack.append(2 * i + 1)
+            stack.append(2 * i + 2)
+        return exposure
+    
+    def _grow(self):
+        old_capacity = self.capacity
+        new_capacity = old_capacity * 2
+        for name in ('position_type', 'size', 'entry_price', 'entry_step', 'threshold', 'expiry_step'):
+            column = getattr(self, name)
+            grown = np.zeros(new_capacity, dtype=column.dtype)
+            grown[:old_capacity] = column
+            setattr(self, name, grown)
+        self._free_slots.extend(range(new_capacity - 1, old_capacity - 1, -1))
@@ -1,14 +1,16 @@
 ﻿import sys
 import os
 sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
 
-import pandas as pd
 import numpy as np
 from stable_baselines3 import PPO
-from stable_baselines3.common.callbacks import CheckpointCallback, EvalCallback, CallbackList, BaseCallback
+from stable_baselines3.common.callbacks import EvalCallback, CallbackList, BaseCallback
 from stable_baselines3.common.monitor import Monitor
 
-from environment import KalshiTradingEnv
+from rl.environment import KalshiTradingEnv
+from rl.experiment import feature_store, load_dataset, make_env_kwargs, save_settings
+from rl.training import AsyncCheckpointCallback, AsyncEvalCallback, ThroughputCallback, configure_torch_threads, make_vec_env, rollout_steps_per_env
 
 class TradingMetricsCallback(BaseCallback):
     '''Custom callback to log trading-specific metrics'''
@@ -27,13 +29,10 @@ class TradingMetricsCallback(BaseCallback):
                     self.logger.record('episode/length', info['episode']['l'])
         return True
 
-print('🚀 Training PPO Agent - AGGRESSIVE Rewards + GPU')
-print('=' * 60)
-
 # Configuration with higher entropy for exploration
 CONFIG = {
     'learning_rate': 3e-4,
-    'n_steps': 2048,
+    'n_steps': 2048,  # Transitions per rollout across all envs, split evenly between them
     'batch_size': 64,
     'n_epochs': 10,
     'gamma': 0.99,
@@ -43,192 +42,260 @@ CONFIG = {
     'vf_coef': 0.5,
     'max_grad_norm': 0.5,
     'total_timesteps': 1000000,
-    'initial_balance': 10000
+    'initial_balance': 10000,
+    'n_envs': 1,  # > 1 collects rollouts from that many episodes at once
+    'vec_env': 'native',  # With n_envs > 1: 'native' (KalshiVectorEnv), 'subproc' (a process per env) or 'dummy'
+    'torch_threads': None,  # Learner threads, by default the cores not running subproc envs
+    'seed': 0,
+    'async_eval': True,  # Evaluate policy snapshots in a background process instead of pausing training
+    'checkpoint_keep_best': 3,  # Checkpoints with the best recent training reward kept on disk
+    'checkpoint_keep_every': 10,  # Also keep every 10th checkpoint (100k steps), 0 for none
+    'episode_length': None,  # e.g. 2000 or (500, 3000) for random training windows instead of full passes
+    'higher_timeframes': (),  # e.g. ('1h', '4h', '1d') fills state slots 8-19 with resampled bar features
+    'data_repair': 'mask',  # 'ffill' fills gaps onto a regular grid, 'mask' only marks bad bars, None skips the check
+    'strike_ladder': False,  # True (or ladder kwargs) to price a KXBTC-style ladder of strikes each step
+    'order_book': False,  # True (or OrderBook kwargs) for depth-limited fills with slippage instead of unlimited size
+    'quote_store': None,  # e.g. '../../data/quotes' from scripts/record_markets.py to trade on recorded Kalshi quotes where available
+    'expiry_steps': 1,  # Bars until contracts settle, e.g. 4 for hourly or 96 for daily contracts
+    'monte_carlo': False  # True (or MonteCarloPricer kwargs, e.g. {'model': 'bootstrap'}) to price from simulated paths
 }
 
-print('Configuration:')
-for key, value in CONFIG.items():
-    print(f'  {key}: {value}')
-print()
-
-# Check GPU
-import torch
-print('🔥 GPU Check:')
-print(f'  CUDA available: {torch.cuda.is_available()}')
-if torch.cuda.is_available():
-    print(f'  GPU: {torch.cuda.get_device_name(0)}')
-    print(f'  GPU Memory: {torch.cuda.get_device_properties(0).total_memory / 1e9:.2f} GB')
-else:
-    print('  Using CPU (training will be slower)')
-print()
-
-# Load 15-minute data
-print('Loading 15-minute data...')
-data_path = os.path.join('..', '..', 'data', 'raw', 'btc_15m_6months.csv')
-
-try:
-    df = pd.read_csv(data_path)
-    df['datetime'] = pd.to_datetime(df['datetime'])
-    print(f'✓ Loaded {len(df):,} rows (15-min candles)')
-except FileNotFoundError:
-    print(f'❌ Error: File not found at {data_path}')
-    print('Please run download_data.py first to download 15-minute data')
-    sys.exit(1)
-
-# Split data: 80% train, 10% validation, 10% test
-train_size = int(len(df) * 0.8)
-val_size = int(len(df) * 0.1)
-
-train_df = df[:train_size].reset_index(drop=True)
-val_df = df[train_size:train_size+val_size].reset_index(drop=True)
-test_df = df[train_size+val_size:].reset_index(drop=True)
-
-print(f'✓ Train: {len(train_df):,} rows ({len(train_df)//96:.1f} days)')
-print(f'✓ Validation: {len(val_df):,} rows ({len(val_df)//96:.1f} days)')
-print(f'✓ Test: {len(test_df):,} rows ({len(test_df)//96:.1f} days)')
-print()
-
-# Create environments
-print('Creating environments...')
-train_env = Monitor(KalshiTradingEnv(train_df, initial_balance=CONFIG['initial_balance']))
-val_env = Monitor(KalshiTradingEnv(val_df, initial_balance=CONFIG['initial_balance']))
-print('✓ Environments created')
-print()
-
-# Create directories
-os.makedirs('../../models/checkpoints_aggressive', exist_ok=True)
-os.makedirs('../../models/best_aggressive', exist_ok=True)
-os.makedirs('../../logs/tensorboard_aggressive', exist_ok=True)
-os.makedirs('../../logs/eval_aggressive', exist_ok=True)
-
-print('📁 Output directories:')
-print(f'  Checkpoints: models/checkpoints_aggressive/')
-print(f'  Best model: models/best_aggressive/')
-print(f'  TensorBoard: logs/tensorboard_aggressive/')
-print()
-
-# Setup callbacks
-print('Setting up callbacks...')
-
-checkpoint_callback = CheckpointCallback(
-    save_freq=10000,
-    save_path='../../models/checkpoints_aggressive/',
-    name_prefix='ppo_aggressive',
-    verbose=1
-)
-
-eval_callback = EvalCallback(
-    val_env,
-    best_model_save_path='../../models/best_aggressive/',
-    log_path='../../logs/eval_aggressive/',
-    eval_freq=5000,
-    deterministic=True,
-    n_eval_episodes=5,
-    verbose=1
-)
-
-metrics_callback = TradingMetricsCallback()
-
-callbacks = CallbackList([checkpoint_callback, eval_callback, metrics_callback])
-print('✓ Callbacks configured')
-print()
-
-# Create PPO model
-print('Creating PPO model...')
-model = PPO(
-    'MlpPolicy',
-    train_env,
-    learning_rate=CONFIG['learning_rate'],
-    n_steps=CONFIG['n_steps'],
-    batch_size=CONFIG['batch_size'],
-    n_epochs=CONFIG['n_epochs'],
-    gamma=CONFIG['gamma'],
-    gae_lambda=CONFIG['gae_lambda'],
-    clip_range=CONFIG['clip_range'],
-    ent_coef=CONFIG['ent_coef'],
-    vf_coef=CONFIG['vf_coef'],
-    max_grad_norm=CONFIG['max_grad_norm'],
-    verbose=1,
-    tensorboard_log='../../logs/tensorboard_aggressive/',
-    device='auto'  # Automatically uses GPU if available
-)
-
-print('✓ Model created')
-print(f'  Policy: {model.policy.__class__.__name__}')
-print(f'  Device: {model.device}')
-print(f'  Total parameters: {sum(p.numel() for p in model.policy.parameters()):,}')
-print()
-
-# Display training info
-print('🏋️ Starting AGGRESSIVE training...')
-print('=' * 60)
-print(f'Total timesteps: {CONFIG["total_timesteps"]:,}')
-print(f'Expected episodes: ~{CONFIG["total_timesteps"] // len(train_df):,}')
-print(f'Training data: ~{len(train_df)//96:.1f} days of 15-min candles')
-print()
-print('🔥 AGGRESSIVE Reward Improvements:')
-print('  ✓ +50 reward for winning trades (was +5)')
-print('  ✓ -2 reward for holding (was -0.1)')
-print('  ✓ Escalating penalties for consecutive holds')
-print('  ✓ +1 reward for ANY action (encourages trading)')
-print('  ✓ Bonus for active trading')
-print()
-
-if torch.cuda.is_available():
-    print(f'⚡ GPU Training - Expected time: 25-45 minutes')
-else:
-    print(f'⏰ CPU Training - Expected time: 2-3 hours')
-    
-print('Monitor progress at: http://localhost:6006')
-print('=' * 60)
-print()
-
-# Train
-try:
-    model.learn(
-        total_timesteps=CONFIG['total_timesteps'],
-        callback=callbacks,
-        progress_bar=True,
-        tb_log_name='ppo_aggressive_run'
+if __name__ == '__main__':
+    print('🚀 Training PPO Agent - AGGRESSIVE Rewards + GPU')
+    print('=' * 60)
+    
+    print('Configuration:')
+    for key, value in CONFIG.items():
+        print(f'  {key}: {value}')
+    print()
+    
+    # Check GPU
+    import torch
+    print('🔥 GPU Check:')
+    print(f'  CUDA available: {torch.cuda.is_available()}')
+    if torch.cuda.is_available():
+        print(f'  GPU: {torch.cuda.get_device_name(0)}')
+        print(f'  GPU Memory: {torch.cuda.get_device_properties(0).total_memory / 1e9:.2f} GB')
+    else:
+        print('  Using CPU (training will be slower)')
+    print()
+    
+    # Load 15-minute data
+    print('Loading 15-minute data...')
+    data_path = os.path.join('..', '..', 'data', 'raw', 'btc_15m_6months.csv')
+    
+    try:
+        # Repaired and split exactly as the evaluation scripts do it
+        df, (train_split, val_split, test_split) = load_dataset(data_path, CONFIG['data_repair'])
+        print(f'✓ Loaded {len(df):,} rows (15-min candles)')
+    except FileNotFoundError:
+        print(f'❌ Error: File not found at {data_path}')
+        print('Please run download_data.py first to download 15-minute data')
+        sys.exit(1)
+    
+    print(f'✓ Train: {len(train_split):,} rows ({len(train_split)//96:.1f} days)')
+    print(f'✓ Validation: {len(val_split):,} rows ({len(val_split)//96:.1f} days)')
+    print(f'✓ Test: {len(test_split):,} rows ({len(test_split)//96:.1f} days)')
+    print()
+    
+    # Features are cached on disk keyed by the data and feature settings, which evaluation
+    # reads back from the *_settings.json saved next to each model
+    print('Loading features...')
+    features = feature_store(os.path.join('..', '..', 'data', 'features'), CONFIG)
+    # Features are computed once for the whole series and each split is a view into them
+    market_data = features.get(df)
+    train_data = train_split.view(market_data)
+    val_data = val_split.view(market_data)
+    print('✓ Features ready')
+    print()
+    
+    # Create environments
+    print('Creating environments...')
+    # Market options shared by the training and evaluation envs, saved with the model for evaluate.py
+    env_kwargs = make_env_kwargs(CONFIG)
+    if 'quote_source' in env_kwargs:
+        print(f'✓ Replaying {len(env_kwargs["quote_source"]):,} recorded snapshots, covering '
+              f'{env_kwargs["quote_source"].coverage(train_data.timestamp) * 100:.1f}% of training bars')
+    if CONFIG['n_envs'] > 1:
+        train_env = make_vec_env(
+            train_data, CONFIG['n_envs'], kind=CONFIG['vec_env'], seed=CONFIG['seed'],
+            episode_length=CONFIG['episode_length'], **env_kwargs
+        )
+    else:
+        train_env = Monitor(KalshiTradingEnv(
+            train_data, episode_length=CONFIG['episode_length'], **env_kwargs
+        ))
+    torch_threads = configure_torch_threads(CONFIG['vec_env'] if CONFIG['n_envs'] > 1 else 'native', CONFIG['n_envs'], CONFIG['torch_threads'])
+    n_steps = rollout_steps_per_env(CONFIG['n_steps'], CONFIG['n_envs'])
+    print(f'✓ Environments created ({CONFIG["n_envs"]} x {n_steps} steps per rollout, {torch_threads} torch threads)')
+    print()
+    
+    # Create directories
+    os.makedirs('../../models/checkpoints_aggressive', exist_ok=True)
+    os.makedirs('../../models/best_aggressive', exist_ok=True)
+    os.makedirs('../../logs/tensorboard_aggressive', exist_ok=True)
+    os.makedirs('../../logs/eval_aggressive', exist_ok=True)
+    # The eval callback saves best_model.zip, its settings go next to it up front
+    save_settings('../../models/best_aggressive/best_model', CONFIG)
+    
+    print('📁 Output directories:')
+    print(f'  Checkpoints: models/checkpoints_aggressive/')
+    print(f'  Best model: models/best_aggressive/')
+    print(f'  TensorBoard: logs/tensorboard_aggressive/')
+    print()
+    
+    # Setup callbacks
+    print('Setting up callbacks...')
+    
+    # Callback frequencies count env.step() calls, each of which advances n_envs episodes
+    # Written on a background thread, keeping the latest, best and every Nth checkpoint
+    checkpoint_callback = AsyncCheckpointCallback(
+        save_freq=max(10000 // CONFIG['n_envs'], 1),
+        save_path='../../models/checkpoints_aggressive/',
+        name_prefix='ppo_aggressive',
+        keep_best=CONFIG['checkpoint_keep_best'],
+        keep_every=CONFIG['checkpoint_keep_every'],
+        verbose=2
     )
     
-    print('\n' + '=' * 60)
-    print('✅ Training complete!')
+    if CONFIG['async_eval']:
+        eval_callback = AsyncEvalCallback(
+            val_data,
+            best_model_save_path='../../models/best_aggressive/',
+            log_path='../../logs/eval_aggressive/',
+            eval_freq=max(5000 // CONFIG['n_envs'], 1),
+            deterministic=True,
+            n_eval_episodes=5,
+            verbose=1,
+            **env_kwargs
+        )
+    else:
+        # Only the synchronous callback steps a validation env in this process
+        val_env = Monitor(KalshiTradingEnv(val_data, **env_kwargs))
+        eval_callback = EvalCallback(
+            val_env,
+            best_model_save_path='../../models/best_aggressive/',
+            log_path='../../logs/eval_aggressive/',
+            eval_freq=max(5000 // CONFIG['n_envs'], 1),
+            deterministic=True,
+            n_eval_episodes=5,
+            verbose=1
+        )
+    
+    metrics_callback = TradingMetricsCallback()
+    
+    # Logs time/steps_per_sec and time/rollout_steps_per_sec to TensorBoard
+    throughput_callback = ThroughputCallback(verbose=1)
+    
+    callbacks = CallbackList([checkpoint_callback, eval_callback, metrics_callback, throughput_callback])
+    print('✓ Callbacks configured')
+    print()
+    
+    # Create PPO model
+    print('Creating PPO model...')
+    model = PPO(
+        'MlpPolicy',
+        train_env,
+        learning_rate=CONFIG['learning_rate'],
+        n_steps=n_steps,
+        batch_size=CONFIG['batch_size'],
+        n_epochs=CONFIG['n_epochs'],
+        gamma=CONFIG['gamma'],
+        gae_lambda=CONFIG['gae_lambda'],
+        clip_range=CONFIG['clip_range'],
+        ent_coef=CONFIG['ent_coef'],
+        vf_coef=CONFIG['vf_coef'],
+        max_grad_norm=CONFIG['max_grad_norm'],
+        seed=CONFIG['seed'],
+        verbose=1,
+        tensorboard_log='../../logs/tensorboard_aggressive/',
+        device='auto'  # Automatically uses GPU if available
+    )
+    
+    print('✓ Model created')
+    print(f'  Policy: {model.policy.__class__.__name__}')
+    print(f'  Device: {model.device}')
+    print(f'  Total parameters: {sum(p.numel() for p in model.policy.parameters()):,}')
+    print()
+    
+    # Display training info
+    print('🏋️ Starting AGGRESSIVE training...')
     print('=' * 60)
+    print(f'Total timesteps: {CONFIG["total_timesteps"]:,}')
+    episode_steps = CONFIG['episode_length'] or len(train_split)
+    if isinstance(episode_steps, tuple):
+        episode_steps = sum(episode_steps) // 2
+    print(f'Expected episodes: ~{CONFIG["total_timesteps"] // episode_steps:,}')
+    print(f'Training data: ~{len(train_split)//96:.1f} days of 15-min candles')
+    print()
+    print('🔥 AGGRESSIVE Reward Improvements:')
+    print('  ✓ +50 reward for winning trades (was +5)')
+    print('  ✓ -2 reward for holding (was -0.1)')
+    print('  ✓ Escalating penalties for consecutive holds')
+    print('  ✓ +1 reward for ANY action (encourages trading)')
+    print('  ✓ Bonus for active trading')
+    print()
     
-    # Save final model
-    final_model_path = '../../models/ppo_aggressive_final'
-    model.save(final_model_path)
-    print(f'✓ Final model saved to: {final_model_path}.zip')
+    if torch.cuda.is_available():
+        print(f'⚡ GPU Training - Expected time: 25-45 minutes')
+    else:
+        print(f'⏰ CPU Training - Expected time: 2-3 hours')
     
-    # Save configuration
-    import json
-    config_path = '../../models/ppo_aggressive_config.json'
-    with open(config_path, 'w') as f:
-        json.dump(CONFIG, f, indent=2)
-    print(f'✓ Config saved to: {config_path}')
+    print('Monitor progress at: http://localhost:6006')
+    print('=' * 60)
+    print()
+    
+    # Train
+    try:
+        model.learn(
+            total_timesteps=CONFIG['total_timesteps'],
+            callback=callbacks,
+            progress_bar=True,
+            tb_log_name='ppo_aggressive_run'
+        )
+        
+        print('\n' + '=' * 60)
+        print('✅ Training complete!')
+        print('=' * 60)
+        
+        # Save final model
+        final_model_path = '../../models/ppo_aggressive_final'
+        model.save(final_model_path)
+        save_settings(final_model_path, CONFIG)
+        print(f'✓ Final model saved to: {final_model_path}.zip')
+        
+        # Save configuration
+        import json
+        config_path = '../../models/ppo_aggressive_config.json'
+        with open(config_path, 'w') as f:
+            json.dump(CONFIG, f, indent=2)
+        print(f'✓ Config saved to: {config_path}')
+    
+    except KeyboardInterrupt:
+        print('\n' + '=' * 60)
+        print('⚠️ Training interrupted by user')
+        print('=' * 60)
+        
+        interrupted_model_path = '../../models/ppo_aggressive_interrupted'
+        model.save(interrupted_model_path)
+        save_settings(interrupted_model_path, CONFIG)
+        print(f'✓ Model saved to: {interrupted_model_path}.zip')
+    
+    except Exception as e:
+        print(f'\n❌ Error during training: {e}')
+        import traceback
+        traceback.print_exc()
+        
+        error_model_path = '../../models/ppo_aggressive_error'
+        model.save(error_model_path)
+        save_settings(error_model_path, CONFIG)
+        print(f'✓ Model saved to: {error_model_path}.zip')
+    
+    train_env.close()  # Stops subproc workers and releases their shared memory
     
-except KeyboardInterrupt:
     print('\n' + '=' * 60)
-    print('⚠️ Training interrupted by user')
+    print('Next steps:')
+    print('  1. Evaluate model: python evaluate.py')
+    print('  2. View TensorBoard: tensorboard --logdir=../../logs/tensorboard_aggressive')
+    print('  3. Check best model in: models/best_aggressive/')
     print('=' * 60)
-    
-    interrupted_model_path = '../../models/ppo_aggressive_interrupted'
-    model.save(interrupted_model_path)
-    print(f'✓ Model saved to: {interrupted_model_path}.zip')
-
-except Exception as e:
-    print(f'\n❌ Error during training: {e}')
-    import traceback
-    traceback.print_exc()
-    
-    error_model_path = '../../models/ppo_aggressive_error'
-    model.save(error_model_path)
-    print(f'✓ Model saved to: {error_model_path}.zip')
-
-print('\n' + '=' * 60)
-print('Next steps:')
-print('  1. Evaluate model: python evaluate.py')
-print('  2. View TensorBoard: tensorboard --logdir=../../logs/tensorboard_aggressive')
-print('  3. Check best model in: models/best_aggressive/')
-print('=' * 60)
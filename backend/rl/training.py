@@ -0,0 +1,466 @@
+﻿import copy
+import json
+import os
+import time
+import zipfile
+import numpy as np
+import stable_baselines3
+import torch
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import get_all_start_methods, get_context
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.save_util import data_to_json
+from stable_baselines3.common.utils import get_system_info, safe_mean
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv, VecMonitor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    from .environment import KalshiTradingEnv
+    from .market_data import MarketArrays
+    from .vec_env import KalshiVectorEnv
+except ImportError:
+    from environment import KalshiTradingEnv
+    from market_data import MarketArrays
+    from vec_env import KalshiVectorEnv
+
+# 'native' steps every episode in one process with array ops, 'subproc' runs one
+# KalshiTradingEnv per worker process and 'dummy' runs them one after another
+VEC_ENV_KINDS = ('native', 'subproc', 'dummy')
+
+def rollout_steps_per_env(rollout_steps: int, n_envs: int) -> int:
+    '''PPO n_steps that keeps a rollout at rollout_steps transitions across n_envs'''
+    return max(rollout_steps // n_envs, 1)
+
+def configure_torch_threads(kind: str, n_envs: int, torch_threads: Optional[int] = None) -> int:
+    '''
+    Set and return the learner's torch thread count
+    
+    By default subproc training leaves one core per env worker and gives
+    the learner the rest; in-process envs share the learner's cores.
+    '''
+    if torch_threads is None:
+        cores = os.cpu_count() or 1
+        torch_threads = max(cores - n_envs, 1) if kind == 'subproc' else cores
+    torch.set_num_threads(torch_threads)
+    return torch_threads
+
+def _default_start_method() -> str:
+    '''forkserver where available, as SubprocVecEnv picks, otherwise spawn - never fork a process running torch'''
+    return 'forkserver' if 'forkserver' in get_all_start_methods() else 'spawn'
+
+def _make_worker_env(spec: Dict[str, Any], rank: int, seed: Optional[int], threads: int,
+                     env_kwargs: Dict[str, Any]) -> KalshiTradingEnv:
+    '''Runs inside a SubprocVecEnv worker'''
+    torch.set_num_threads(threads)
+    env = KalshiTradingEnv.from_shared_memory(spec, **env_kwargs)
+    if seed is not None:
+        env.reset(seed=seed + rank)
+    return env
+
+class SharedMemorySubprocVecEnv(SubprocVecEnv):
+    '''SubprocVecEnv whose workers attach to one shared MarketArrays block, released on close'''
+    
+    def __init__(self, market_data: MarketArrays, n_envs: int, seed: Optional[int] = None,
+                 worker_threads: int = 1, start_method: Optional[str] = None, **env_kwargs):
+        self.shared_market_data = market_data.to_shared_memory()
+        spec = self.shared_market_data.shared_memory_spec
+        try:
+            super().__init__(
+                [partial(_make_worker_env, spec, rank, seed, worker_threads, env_kwargs) for rank in range(n_envs)],
+                start_method=start_method or _default_start_method()
+            )
+        except Exception:
+            self.shared_market_data.unlink()
+            raise
+    
+    def close(self) -> None:
+        if self.closed:
+            return
+        super().close()
+        self.shared_market_data.unlink()
+
+def make_vec_env(market_data: MarketArrays, n_envs: int, kind: str = 'native', seed: Optional[int] = None,
+                 worker_threads: int = 1, start_method: Optional[str] = None, **env_kwargs) -> VecEnv:
+    '''
+    n_envs training episodes behind VecMonitor
+    
+    env_kwargs go to KalshiTradingEnv or KalshiVectorEnv (initial_balance,
+    episode_length, ...). Env i draws from its own Generator seeded with
+    seed + i, whichever kind is used; seeds passed to PPO reach every env
+    through VecEnv.seed the same way. Subproc workers start with
+    forkserver (spawn where unavailable) unless start_method is given, and
+    re-import the main module, so calling scripts need an
+    if __name__ == '__main__' guard.
+    '''
+    if kind == 'native':
+        env = KalshiVectorEnv(market_data, num_envs=n_envs, seed=seed, **env_kwargs)
+    elif kind == 'subproc':
+        env = SharedMemorySubprocVecEnv(market_data, n_envs, seed=seed, worker_threads=worker_threads,
+                                        start_method=start_method, **env_kwargs)
+    elif kind == 'dummy':
+        env = DummyVecEnv([partial(KalshiTradingEnv, market_data, **env_kwargs) for _ in range(n_envs)])
+        if seed is not None:
+            env.seed(seed)
+    else:
+        raise ValueError(f'Unknown vec env kind {kind!r}, expected one of {VEC_ENV_KINDS}')
+    return VecMonitor(env)
+
+class ThroughputCallback(BaseCallback):
+    '''Logs env steps per second, for rollout collection alone and for the whole run'''
+    
+    def __init__(self, verbose: int = 0):
+        super().__init__(verbose)
+        self._start_time = 0.0
+        self._start_steps = 0
+        self._rollout_time = 0.0
+        self._rollout_steps = 0
+    
+    def _on_training_start(self) -> None:
+        self._start_time = time.perf_counter()
+        self._start_steps = self.num_timesteps
+    
+    def _on_rollout_start(self) -> None:
+        self._rollout_time = time.perf_counter()
+        self._rollout_steps = self.num_timesteps
+    
+    def _on_rollout_end(self) -> None:
+        now = time.perf_counter()
+        self.logger.record('time/rollout_steps_per_sec', (self.num_timesteps - self._rollout_steps) / max(now - self._rollout_time, 1e-9))
+        self.logger.record('time/steps_per_sec', (self.num_timesteps - self._start_steps) / max(now - self._start_time, 1e-9))
+    
+    def _on_step(self) -> bool:
+        return True
+    
+    def _on_training_end(self) -> None:
+        if self.verbose:
+            elapsed = time.perf_counter() - self._start_time
+            print(f'⏱️ {self.num_timesteps - self._start_steps:,} steps in {elapsed:.0f}s '
+                  f'({(self.num_timesteps - self._start_steps) / max(elapsed, 1e-9):.0f} steps/sec)')
+
+# Set up once per evaluation worker by _init_eval_worker
+_eval_worker: Dict[str, Any] = {}
+
+def _zero_schedule(_progress: float) -> float:
+    return 0.0
+
+def _init_eval_worker(spec: Dict[str, Any], env_kwargs: Dict[str, Any], policy_class: type,
+                      policy_data: Dict[str, Any], threads: int):
+    torch.set_num_threads(threads)
+    _eval_worker['env'] = KalshiTradingEnv.from_shared_memory(spec, **env_kwargs)
+    _eval_worker['policy'] = policy_class(**policy_data).to('cpu')
+
+def _evaluate_snapshot(state_dict: Dict[str, torch.Tensor], n_eval_episodes: int,
+                       deterministic: bool) -> Dict[str, List[float]]:
+    '''Run n_eval_episodes with the given policy weights (runs in the evaluation worker)'''
+    env, policy = _eval_worker['env'], _eval_worker['policy']
+    policy.load_state_dict(state_dict)
+    policy.set_training_mode(False)
+    
+    rewards, lengths, pnls = [], [], []
+    for _ in range(n_eval_episodes):
+        obs, info = env.reset()
+        total_reward, steps, done = 0.0, 0, False
+        while not done:
+            action, _ = policy.predict(obs, deterministic=deterministic)
+            obs, reward, terminated, truncated, info = env.step(action)
+            total_reward += reward
+            steps += 1
+            done = terminated or truncated
+        rewards.append(total_reward)
+        lengths.append(steps)
+        pnls.append(info['pnl'])
+    return {'rewards': rewards, 'lengths': lengths, 'pnls': pnls}
+
+class AsyncEvalCallback(BaseCallback):
+    '''
+    EvalCallback that evaluates in a background process
+    
+    Every eval_freq calls the policy weights are copied and handed to a
+    worker process holding its own validation env, and training carries on.
+    Finished evaluations are picked up on later steps and recorded with
+    the same eval/ keys, evaluations.npz and best_model.zip as EvalCallback,
+    plus eval/snapshot_timesteps; the model's next regular dump writes them
+    at the current step. The best model is saved from the snapshot, not the
+    weights training has moved on to since. At most
+    max_pending evaluations run or wait at once - when the worker falls
+    behind, evaluations are skipped rather than queued without bound.
+    '''
+    
+    def __init__(self, eval_data: MarketArrays, eval_freq: int = 10000, n_eval_episodes: int = 5,
+                 deterministic: bool = True, best_model_save_path: Optional[str] = None,
+                 log_path: Optional[str] = None, max_pending: int = 2, worker_threads: int = 1,
+                 start_method: Optional[str] = None, verbose: int = 1, **env_kwargs):
+        super().__init__(verbose)
+        self.eval_data = eval_data
+        self.eval_freq = eval_freq
+        self.n_eval_episodes = n_eval_episodes
+        self.deterministic = deterministic
+        self.best_model_save_path = best_model_save_path
+        self.log_path = os.path.join(log_path, 'evaluations') if log_path is not None else None
+        self.max_pending = max_pending
+        self.worker_threads = worker_threads
+        self.start_method = start_method
+        self.env_kwargs = env_kwargs
+        
+        self.best_mean_reward = -np.inf
+        self.last_mean_reward = -np.inf
+        self.evaluations_timesteps = []
+        self.evaluations_results = []
+        self.evaluations_length = []
+        self.skipped = 0
+        self._pending: List[Tuple[int, Dict[str, torch.Tensor], Future]] = []
+        self._executor = None
+        self._shared_eval_data = None
+    
+    def _init_callback(self) -> None:
+        if self.best_model_save_path is not None:
+            os.makedirs(self.best_model_save_path, exist_ok=True)
+        if self.log_path is not None:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+    
+    def _on_training_start(self) -> None:
+        if self._executor is not None:
+            return
+        policy = self.model.policy
+        policy_data = dict(policy._get_constructor_parameters(), lr_schedule=_zero_schedule)
+        self._shared_eval_data = self.eval_data.to_shared_memory()
+        self._executor = ProcessPoolExecutor(
+            max_workers=1, mp_context=get_context(self.start_method or _default_start_method()), initializer=_init_eval_worker,
+            initargs=(self._shared_eval_data.shared_memory_spec, self.env_kwargs, type(policy),
+                      policy_data, self.worker_threads)
+        )
+    
+    def _snapshot(self) -> Dict[str, torch.Tensor]:
+        return {name: tensor.detach().to('cpu', copy=True) for name, tensor in self.model.policy.state_dict().items()}
+    
+    def _on_step(self) -> bool:
+        self._collect()
+        if self.eval_freq > 0 and self.n_calls % self.eval_freq == 0:
+            if len(self._pending) >= self.max_pending:
+                self.skipped += 1
+                if self.verbose >= 1:
+                    print(f'Eval at num_timesteps={self.num_timesteps} skipped, {len(self._pending)} still running')
+            else:
+                snapshot = self._snapshot()
+                future = self._executor.submit(_evaluate_snapshot, snapshot, self.n_eval_episodes, self.deterministic)
+                self._pending.append((self.num_timesteps, snapshot, future))
+        return True
+    
+    def _collect(self, wait: bool = False) -> None:
+        '''Log finished evaluations in snapshot order, blocking for all of them when wait is set'''
+        while self._pending and (wait or self._pending[0][2].done()):
+            timesteps, snapshot, future = self._pending.pop(0)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f'⚠️ Evaluation at num_timesteps={timesteps} failed: {e}')
+                continue
+            self._record(timesteps, snapshot, result)
+    
+    def _record(self, timesteps: int, snapshot: Dict[str, torch.Tensor], result: Dict[str, List[float]]) -> None:
+        rewards, lengths = result['rewards'], result['lengths']
+        if self.log_path is not None:
+            self.evaluations_timesteps.append(timesteps)
+            self.evaluations_results.append(rewards)
+            self.evaluations_length.append(lengths)
+            np.savez(self.log_path, timesteps=self.evaluations_timesteps, results=self.evaluations_results,
+                     ep_lengths=self.evaluations_length)
+        
+        mean_reward, std_reward = np.mean(rewards), np.std(rewards)
+        self.last_mean_reward = float(mean_reward)
+        if self.verbose >= 1:
+            print(f'Eval num_timesteps={timesteps}, episode_reward={mean_reward:.2f} +/- {std_reward:.2f} '
+                  f'(finished {self.num_timesteps - timesteps} steps later)')
+        
+        self.logger.record('eval/mean_reward', float(mean_reward))
+        self.logger.record('eval/mean_ep_length', float(np.mean(lengths)))
+        self.logger.record('eval/mean_pnl', float(np.mean(result['pnls'])))
+        self.logger.record('eval/lag_timesteps', self.num_timesteps - timesteps)
+        # Written by the model's next regular dump at the current step, the snapshot step goes along as a value
+        self.logger.record('eval/snapshot_timesteps', timesteps)
+        
+        if mean_reward > self.best_mean_reward:
+            self.best_mean_reward = float(mean_reward)
+            if self.verbose >= 1:
+                print('New best mean reward!')
+            if self.best_model_save_path is not None:
+                # Save the evaluated weights, then put the current ones back
+                current = self._snapshot()
+                self.model.policy.load_state_dict(snapshot)
+                self.model.save(os.path.join(self.best_model_save_path, 'best_model'))
+                self.model.policy.load_state_dict(current)
+    
+    def _on_training_end(self) -> None:
+        pending = len(self._pending)
+        self._collect(wait=True)
+        if pending:
+            # Training is over, so no regular dump will write the last evaluations
+            self.logger.dump(self.num_timesteps)
+        self.close()
+    
+    def close(self) -> None:
+        '''Stop the worker and release the shared validation data'''
+        if self._executor is None:
+            return
+        for _, _, future in self._pending:
+            future.cancel()
+        self._pending = []
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        self._shared_eval_data.unlink()
+        self._shared_eval_data = None
+
+def _clone_tensors(obj: Any) -> Any:
+    '''Copy of nested dicts/lists of tensors, e.g. a state dict, that training can't change'''
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().clone()
+    if isinstance(obj, dict):
+        return {key: _clone_tensors(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_clone_tensors(value) for value in obj)
+    return obj
+
+class AsyncCheckpointCallback(BaseCallback):
+    '''
+    CheckpointCallback that writes on a background thread, with retention
+    
+    Every save_freq calls the model's attributes are serialized and its
+    state dicts copied in memory, which is all the training thread waits
+    for; compressing and writing the zip (loadable with PPO.load) happens on
+    a writer thread. At most max_pending checkpoints wait to be written -
+    beyond that the training thread waits for the oldest.
+    
+    After each write only these checkpoints stay on disk: the keep_last
+    most recent, every keep_every-th one, and the keep_best with the highest
+    score. score_fn defaults to the mean reward of recent training episodes.
+    checkpoints.json lists the kept files with their scores.
+    '''
+    MANIFEST_FILE = 'checkpoints.json'
+    
+    def __init__(self, save_freq: int, save_path: str, name_prefix: str = 'rl_model', keep_last: int = 2,
+                 keep_best: int = 3, keep_every: int = 0, score_fn: Optional[Callable[[], float]] = None,
+                 max_pending: int = 2, compresslevel: int = 6, verbose: int = 0):
+        super().__init__(verbose)
+        self.save_freq = save_freq
+        self.save_path = save_path
+        self.name_prefix = name_prefix
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.keep_every = keep_every
+        self.score_fn = score_fn
+        self.max_pending = max_pending
+        self.compresslevel = compresslevel
+        
+        self.checkpoints = []  # Records of kept files, only touched by the writer thread
+        self._saved = 0
+        self._pending: List[Future] = []
+        self._writer = None
+    
+    def _init_callback(self) -> None:
+        os.makedirs(self.save_path, exist_ok=True)
+    
+    def _on_training_start(self) -> None:
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint-writer')
+    
+    def _score(self) -> Optional[float]:
+        if self.score_fn is not None:
+            return self.score_fn()
+        if len(self.model.ep_info_buffer) == 0:
+            return None
+        return float(safe_mean([info['r'] for info in self.model.ep_info_buffer]))
+    
+    def _snapshot(self) -> Tuple[Dict[str, Any], Dict[str, Any], Optional[Dict[str, Any]]]:
+        '''The pieces BaseAlgorithm.save writes, detached from the live model'''
+        model = self.model
+        state_dict_names, torch_variable_names = model._get_torch_save_params()
+        exclude = set(model._excluded_save_params())
+        exclude.update(name.split('.')[0] for name in state_dict_names + torch_variable_names)
+        # Training rebinds attributes rather than mutating them, except buffers like
+        # ep_info_buffer, so copying containers one level deep is enough
+        data = {
+            key: copy.copy(value) if isinstance(value, (deque, list, dict)) else value
+            for key, value in model.__dict__.items() if key not in exclude
+        }
+        
+        pytorch_variables = None
+        if torch_variable_names:
+            pytorch_variables = {}
+            for name in torch_variable_names:
+                obj = model
+                for attr in name.split('.'):
+                    obj = getattr(obj, attr)
+                pytorch_variables[name] = _clone_tensors(obj)
+        return data, _clone_tensors(model.get_parameters()), pytorch_variables
+    
+    def _on_step(self) -> bool:
+        if self.n_calls % self.save_freq == 0:
+            self._pending = [future for future in self._pending if not future.done()]
+            while len(self._pending) >= self.max_pending:
+                self._pending.pop(0).result()
+            
+            self._saved += 1
+            path = os.path.join(self.save_path, f'{self.name_prefix}_{self.num_timesteps}_steps.zip')
+            record = {'path': path, 'index': self._saved, 'timesteps': self.num_timesteps, 'score': self._score()}
+            self._pending.append(self._writer.submit(self._write, record, *self._snapshot()))
+        return True
+    
+    def _write(self, record: Dict[str, Any], data: Dict[str, Any], params: Dict[str, Any],
+               pytorch_variables: Optional[Dict[str, Any]]) -> None:
+        '''Write one checkpoint like save_to_zip_file, but compressed (runs on the writer thread)'''
+        try:
+            temporary_path = record['path'] + '.tmp'
+            with zipfile.ZipFile(temporary_path, mode='w', compression=zipfile.ZIP_DEFLATED,
+                                 compresslevel=self.compresslevel) as archive:
+                archive.writestr('data', data_to_json(data))
+                if pytorch_variables is not None:
+                    with archive.open('pytorch_variables.pth', mode='w', force_zip64=True) as file:
+                        torch.save(pytorch_variables, file)
+                for name, state_dict in params.items():
+                    with archive.open(name + '.pth', mode='w', force_zip64=True) as file:
+                        torch.save(state_dict, file)
+                archive.writestr('_stable_baselines3_version', stable_baselines3.__version__)
+                archive.writestr('system_info.txt', get_system_info(print_info=False)[1])
+            os.replace(temporary_path, record['path'])
+        except Exception as e:
+            print(f'⚠️ Checkpoint {record["path"]} failed: {e}')
+            return
+        
+        if self.verbose >= 2:
+            print(f'Saving model checkpoint to {record["path"]}')
+        self.checkpoints.append(record)
+        self._apply_retention()
+    
+    def _apply_retention(self) -> None:
+        keep = set()
+        if self.keep_last > 0:
+            keep.update(id(record) for record in self.checkpoints[-self.keep_last:])
+        if self.keep_every > 0:
+            keep.update(id(record) for record in self.checkpoints if record['index'] % self.keep_every == 0)
+        scored = [record for record in self.checkpoints if record['score'] is not None]
+        scored.sort(key=lambda record: record['score'], reverse=True)
+        keep.update(id(record) for record in scored[:self.keep_best])
+        
+        for record in self.checkpoints:
+            if id(record) not in keep:
+                try:
+                    os.remove(record['path'])
+                except FileNotFoundError:
+                    pass
+        self.checkpoints = [record for record in self.checkpoints if id(record) in keep]
+        
+        with open(os.path.join(self.save_path, self.MANIFEST_FILE), 'w') as f:
+            json.dump(self.checkpoints, f, indent=2)
+    
+    def _on_training_end(self) -> None:
+        self.close()
+    
+    def close(self) -> None:
+        '''Wait for pending writes and stop the writer thread'''
+        if self._writer is None:
+            return
+        self._writer.shutdown(wait=True)
+        self._writer = None
+        self._pending = []
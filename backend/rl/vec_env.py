@@ -0,0 +1,447 @@
+﻿import numpy as np
+import pandas as pd
+from gymnasium import spaces
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+try:
+    from .environment import KalshiTradingEnv
+    from .episodes import EpisodeWindows
+    from .features import FeatureEngineering
+    from .market_data import MarketArrays, bar_hours
+    from .market_simulator import KalshiMarketSimulator, MonteCarloPricer, OrderBook, StrikeLadder
+except ImportError:
+    from environment import KalshiTradingEnv
+    from episodes import EpisodeWindows
+    from features import FeatureEngineering
+    from market_data import MarketArrays, bar_hours
+    from market_simulator import KalshiMarketSimulator, MonteCarloPricer, OrderBook, StrikeLadder
+
+class KalshiVectorEnv(VecEnv):
+    '''
+    N KalshiTradingEnv episodes stepped in lockstep with array operations
+    
+    Balances, open positions, thresholds and portfolio values are held as
+    NumPy arrays with one entry per episode, so a step costs a handful of
+    vectorized operations regardless of num_envs. Rewards, observations and
+    infos follow KalshiTradingEnv exactly; finished episodes are reset
+    automatically as SB3 expects from a VecEnv.
+    '''
+    POSITION_SIZES = np.array([0, 10, 25, 50, 100])
+    START_STEP = 24
+    RECENT_TRADE_WINDOW = KalshiTradingEnv.RECENT_TRADE_WINDOW
+    # State with one entry per episode, addressable by get_attr/set_attr indices
+    PER_ENV_ATTRS = (
+        'current_step', 'end_step', 'balance', 'portfolio_value', 'max_portfolio_value',
+        'steps_without_trade', 'num_trades', 'num_wins', 'fill_size', 'slippage',
+        'position_size', 'position_entry_price', 'position_threshold', 'position_is_yes', 'position_expiry',
+        'trade_counts', 'recent_trades', 'observations', 'rngs'
+    )
+    
+    def __init__(self, price_data: Union[pd.DataFrame, MarketArrays], num_envs: int = 8, initial_balance: float = 10000,
+                 max_position_size: int = 100, trading_hours: Tuple[int, int] = (9, 24),
+                 seed: Optional[int] = None, episode_length: Optional[Union[int, Tuple[int, int]]] = None,
+                 strike_ladder: Union[bool, Dict[str, Any]] = False,
+                 order_book: Union[bool, Dict[str, Any]] = False, quote_source: Optional[Any] = None,
+                 expiry_steps: int = 1, monte_carlo: Union[bool, Dict[str, Any]] = False):
+        self.render_mode = None
+        super().__init__(
+            num_envs,
+            spaces.Box(low=-np.inf, high=np.inf, shape=(50,), dtype=np.float32),
+            spaces.MultiDiscrete([5, 5])
+        )
+        
+        self.initial_balance = initial_balance
+        self.max_position_size = max_position_size
+        self.trading_start_hour = trading_hours[0]
+        self.trading_end_hour = trading_hours[1]
+        
+        self.feature_engineer = FeatureEngineering(lookback_window=24)
+        self.market_sim = KalshiMarketSimulator()
+        # One Generator per episode, seeded like KalshiTradingEnv.reset(seed=seed + i), so
+        # env i draws exactly what a single env seeded that way would
+        self.rngs = self._make_rngs([None if seed is None else seed + i for i in range(num_envs)])
+        
+        if isinstance(price_data, pd.DataFrame):
+            self.market_data = MarketArrays.from_dataframe(price_data, self.feature_engineer)
+        else:
+            self.market_data = price_data
+            if self.market_data.lookback_window != self.feature_engineer.lookback_window:
+                raise ValueError(
+                    f'MarketArrays built with lookback_window={self.market_data.lookback_window}, '
+                    f'env expects {self.feature_engineer.lookback_window}'
+                )
+        
+        self.close_prices = self.market_data.close
+        self.hours = self.market_data.hour
+        self.timestamps = self.market_data.timestamp
+        self.price_features = self.market_data.price_features
+        self.return_volatility = self.market_data.return_volatility
+        self.timeframe_features = self.market_data.timeframe_features
+        self.n_steps = len(self.close_prices)
+        
+        # See KalshiTradingEnv
+        if expiry_steps < 1:
+            raise ValueError(f'expiry_steps must be at least 1, got {expiry_steps}')
+        self.expiry_steps = expiry_steps
+        self.time_to_expiry_hours = expiry_steps * bar_hours(self.timestamps)
+        self.pricer = None
+        if monte_carlo:
+            self.pricer = MonteCarloPricer(
+                self.close_prices, self.return_volatility,
+                **(monte_carlo if isinstance(monte_carlo, dict) else {})
+            )
+        
+        self.strike_ladder = None
+        if strike_ladder:
+            ladder_kwargs = {'time_to_expiry_hours': self.time_to_expiry_hours, 'pricer': self.pricer,
+                             'horizon': expiry_steps}
+            ladder_kwargs.update(strike_ladder if isinstance(strike_ladder, dict) else {})
+            self.strike_ladder = StrikeLadder(self.market_sim, self.close_prices, self.return_volatility, **ladder_kwargs)
+        
+        # See KalshiTradingEnv, looked up with QuoteReplay.quotes for all trades at once
+        self.quote_source = quote_source
+        
+        # One book per episode, see KalshiTradingEnv
+        self.order_book = None
+        if order_book:
+            self.order_book = OrderBook(num_envs, **(order_book if isinstance(order_book, dict) else {}))
+        
+        self.episode_windows = None
+        if episode_length is not None:
+            self.episode_windows = EpisodeWindows(
+                self.market_data.timestamp, episode_length,
+                warmup=self.feature_engineer.lookback_window, valid_mask=self.market_data.valid
+            )
+        
+        # Every contract expires expiry_steps after entry. A position expiring at step e
+        # lives in slot e % n_slots, which is free again once step e has resolved it.
+        self.n_slots = self.expiry_steps + 1
+        
+        n = num_envs
+        self.current_step = np.zeros(n, dtype=np.int64)
+        self.end_step = np.full(n, self.n_steps - 1, dtype=np.int64)
+        self.balance = np.zeros(n)
+        self.portfolio_value = np.zeros(n)
+        self.max_portfolio_value = np.zeros(n)
+        self.steps_without_trade = np.zeros(n, dtype=np.int64)
+        self.num_trades = np.zeros(n, dtype=np.int64)
+        self.num_wins = np.zeros(n, dtype=np.int64)
+        self.fill_size = np.zeros(n, dtype=np.int64)
+        self.slippage = np.zeros(n)
+        
+        self.position_size = np.zeros((n, self.n_slots))
+        self.position_entry_price = np.zeros((n, self.n_slots))
+        self.position_threshold = np.zeros((n, self.n_slots))
+        self.position_is_yes = np.zeros((n, self.n_slots), dtype=bool)
+        self.position_expiry = np.zeros((n, self.n_slots), dtype=np.int64)
+        
+        # Trades resolved at step s are stamped s, the reward at s + 1 counts the
+        # ones stamped after s + 1 - RECENT_TRADE_WINDOW, i.e. the last WINDOW - 1 steps
+        self.trade_counts = np.zeros((n, self.RECENT_TRADE_WINDOW - 1), dtype=np.int64)
+        self.recent_trades = np.zeros(n, dtype=np.int64)
+        
+        self.observations = np.zeros((n, 50), dtype=np.float32)
+        self._actions = None
+        self._env_idx = np.arange(n)
+    
+    @staticmethod
+    def _make_rngs(seeds: List[Optional[int]]) -> List[np.random.Generator]:
+        return [np.random.default_rng(seed) for seed in seeds]
+    
+    def reset(self) -> np.ndarray:
+        if self._seeds[0] is not None:
+            self.rngs = self._make_rngs(self._seeds)
+        self._reset_seeds()
+        options = self._options
+        self._reset_options()
+        
+        self._reset_envs(self._env_idx, options)
+        self.reset_infos = self._get_infos()
+        return self._get_observations().copy()
+    
+    def step_async(self, actions: np.ndarray) -> None:
+        self._actions = np.asarray(actions).reshape(self.num_envs, 2)
+    
+    def step_wait(self):
+        decision = self._actions[:, 0]
+        position_size = self.POSITION_SIZES[self._actions[:, 1]]
+        holding = decision == 0
+        
+        self.steps_without_trade = np.where(holding, self.steps_without_trade + 1, 0)
+        
+        self._execute_trades(decision, position_size)
+        pnl_from_resolved = self._update_positions()
+        
+        self.current_step += 1
+        
+        prev_value = self.portfolio_value
+        portfolio_value = self._calculate_portfolio_value()
+        self.portfolio_value = portfolio_value
+        self.max_portfolio_value = np.maximum(self.max_portfolio_value, portfolio_value)
+        
+        rewards = self._calculate_rewards(prev_value, portfolio_value, pnl_from_resolved, holding)
+        
+        terminated = (
+            (self.current_step >= self.n_steps - 1) |
+            (portfolio_value <= 0.2 * self.initial_balance)
+        )
+        truncated = ~terminated & (self.current_step >= self.end_step)
+        dones = terminated | truncated
+        
+        observations = self._get_observations().copy()
+        infos = self._get_infos()
+        
+        done_idx = np.flatnonzero(dones)
+        if len(done_idx) > 0:
+            for i in done_idx:
+                infos[i]['terminal_observation'] = observations[i].copy()
+                infos[i]['TimeLimit.truncated'] = bool(truncated[i])
+            self._reset_envs(done_idx)
+            observations[done_idx] = self._get_observations()[done_idx]
+        
+        return observations, rewards.astype(np.float32), dones, infos
+    
+    def _reset_envs(self, idx: np.ndarray, options: Optional[List[Optional[Dict]]] = None):
+        '''Start new episodes for idx, options holds KalshiTradingEnv.reset options per entry of idx'''
+        sampled, pinned = idx, []
+        if options is not None:
+            pins = [bool(opts) and 'start_step' in opts for opts in options]
+            pinned = [(i, opts) for i, opts, pin in zip(idx, options, pins) if pin]
+            sampled = np.asarray([i for i, pin in zip(idx, pins) if not pin], dtype=np.int64)
+        
+        if self.episode_windows is not None:
+            for i in sampled:
+                start, length = self.episode_windows.sample(self.rngs[i])
+                self.current_step[i] = start
+                self.end_step[i] = start + length
+        else:
+            self.current_step[sampled] = self.START_STEP
+            self.end_step[sampled] = self.n_steps - 1
+        # A pinned window draws nothing from the env's Generator, as in KalshiTradingEnv.reset
+        for i, opts in pinned:
+            self.current_step[i] = int(opts['start_step'])
+            self.end_step[i] = self.n_steps - 1
+            if opts.get('episode_length') is not None:
+                self.end_step[i] = min(self.current_step[i] + int(opts['episode_length']), self.end_step[i])
+        self.balance[idx] = self.initial_balance
+        self.portfolio_value[idx] = self.initial_balance
+        self.max_portfolio_value[idx] = self.initial_balance
+        self.steps_without_trade[idx] = 0
+        self.num_trades[idx] = 0
+        self.num_wins[idx] = 0
+        self.position_size[idx] = 0
+        self.trade_counts[idx] = 0
+        self.recent_trades[idx] = 0
+        self.fill_size[idx] = 0
+        self.slippage[idx] = 0.0
+        if self.order_book is not None:
+            self.order_book.reset(idx)
+    
+    def _execute_trades(self, decision: np.ndarray, position_size: np.ndarray):
+        self.fill_size[:] = 0
+        self.slippage[:] = 0.0
+        idx = np.flatnonzero((decision != 0) & (position_size != 0))
+        if len(idx) == 0:
+            return
+        
+        steps = self.current_step[idx]
+        if self.strike_ladder is not None:
+            ladder = self.strike_ladder
+            threshold, bid, ask = ladder.trade_strike[steps], ladder.trade_bid[steps], ladder.trade_ask[steps]
+        else:
+            current_price = self.close_prices[steps]
+            
+            offset_pct = np.array([self.rngs[i].uniform(-0.05, 0.05) for i in idx])
+            threshold = np.round(current_price * (1 + offset_pct) / 100) * 100
+            
+            if self.pricer is not None:
+                bid, ask, mid = self.market_sim.quote_probabilities(
+                    self.pricer.probability_above(steps, self.expiry_steps, current_price, threshold)
+                )
+            else:
+                bid, ask, mid = self.market_sim.contract_prices(
+                    current_price, threshold, self.time_to_expiry_hours, self.return_volatility[steps]
+                )
+        
+        if self.quote_source is not None:
+            found, strike, quoted_bid, quoted_ask = self.quote_source.quotes(self.timestamps[steps], threshold)
+            threshold = np.where(found, strike, threshold)
+            bid = np.where(found, quoted_bid, bid)
+            ask = np.where(found, quoted_ask, ask)
+        
+        # BUY_YES / BUY_NO pay the ask, SELL_YES / SELL_NO receive the bid
+        buying = decision[idx] <= 2
+        entry_price = np.where(buying, ask, bid)
+        size = position_size[idx]
+        
+        if self.order_book is not None:
+            side = np.where(buying, OrderBook.ASK, OrderBook.BID)
+            quoted_price = entry_price
+            size, entry_price = self.order_book.match(idx, side, size, quoted_price, steps, self.balance[idx])
+            self.fill_size[idx] = size
+            self.slippage[idx] = np.where(size > 0, np.where(buying, entry_price - quoted_price, quoted_price - entry_price), 0.0)
+        cost = entry_price * size
+        
+        affordable = (cost <= self.balance[idx]) & (size > 0)
+        idx = idx[affordable]
+        if len(idx) == 0:
+            return
+        
+        steps = steps[affordable]
+        self.balance[idx] -= cost[affordable]
+        
+        expiry = steps + self.expiry_steps
+        slot = expiry % self.n_slots
+        self.position_size[idx, slot] = size[affordable]
+        self.position_entry_price[idx, slot] = entry_price[affordable]
+        self.position_threshold[idx, slot] = threshold[affordable]
+        self.position_is_yes[idx, slot] = decision[idx] == 1
+        self.position_expiry[idx, slot] = expiry
+    
+    def _update_positions(self) -> np.ndarray:
+        total_pnl = np.zeros(self.num_envs)
+        
+        due = (self.position_size > 0) & (self.position_expiry <= self.current_step[:, None])
+        env_idx, slot = np.nonzero(due)
+        
+        if len(env_idx) > 0:
+            current_price = self.close_prices[self.current_step[env_idx]]
+            contract_resolved = current_price >= self.position_threshold[env_idx, slot]
+            
+            # YES pays out if the contract resolved, every other side if it did not
+            payout_per_contract = (self.position_is_yes[env_idx, slot] == contract_resolved).astype(np.float64)
+            size = self.position_size[env_idx, slot]
+            entry_price = self.position_entry_price[env_idx, slot]
+            pnl = (payout_per_contract - entry_price) * size
+            
+            np.add.at(self.balance, env_idx, entry_price * size + pnl)
+            np.add.at(total_pnl, env_idx, pnl)
+            np.add.at(self.num_wins, env_idx, pnl > 0)
+            self.position_size[env_idx, slot] = 0
+        
+        resolved = np.bincount(env_idx, minlength=self.num_envs)
+        self.num_trades += resolved
+        
+        ring_slot = self.current_step % self.trade_counts.shape[1]
+        self.recent_trades += resolved - self.trade_counts[self._env_idx, ring_slot]
+        self.trade_counts[self._env_idx, ring_slot] = resolved
+        
+        return total_pnl
+    
+    def _calculate_rewards(self, prev_value, current_value, pnl_from_resolved, holding):
+        '''Array version of KalshiTradingEnv._calculate_reward'''
+        reward = (current_value - prev_value) / 3
+        
+        reward += np.where(pnl_from_resolved > 0, 50.0, np.where(pnl_from_resolved < 0, -5.0, 0.0))
+        
+        reward += np.where(holding, -2.0, 1.0)
+        reward += np.where(holding & (self.steps_without_trade > 10), -5.0, 0.0)
+        reward += np.where(holding & (self.steps_without_trade > 50), -10.0, 0.0)
+        
+        reward += np.where(self._num_positions() > 0, 0.5, 0.0)
+        reward += 0.1 * self.recent_trades
+        
+        drawdown = (self.max_portfolio_value - current_value) / self.max_portfolio_value
+        reward -= np.where(drawdown > 0.3, 20.0 * drawdown, 0.0)
+        
+        return reward
+    
+    def _num_positions(self) -> np.ndarray:
+        return np.count_nonzero(self.position_size > 0, axis=1)
+    
+    def _calculate_unrealized_pnl(self) -> np.ndarray:
+        pending = self.position_expiry > self.current_step[:, None]
+        return (self.position_size * self.position_entry_price * 0.5 * pending).sum(axis=1)
+    
+    def _calculate_portfolio_value(self) -> np.ndarray:
+        return self.balance + self._calculate_unrealized_pnl()
+    
+    def _calculate_win_rate(self) -> np.ndarray:
+        return np.where(self.num_trades > 0, self.num_wins / np.maximum(self.num_trades, 1), 0.5)
+    
+    def _get_observations(self) -> np.ndarray:
+        steps = self.current_step
+        self.feature_engineer.write_state(
+            self.observations,
+            self.price_features[steps],
+            hour_of_day=self.hours[steps],
+            num_positions=self._num_positions(),
+            total_exposure=(self.position_size * self.position_entry_price).sum(axis=1),
+            unrealized_pnl=self._calculate_unrealized_pnl(),
+            portfolio_value=self.portfolio_value,
+            win_rate=self._calculate_win_rate(),
+            timeframe_features=self.timeframe_features[steps]
+        )
+        if self.strike_ladder is not None:
+            self.observations[:, 41:49] = self.strike_ladder.state[steps]
+        return self.observations
+    
+    def _get_infos(self) -> List[Dict]:
+        num_positions = self._num_positions()
+        win_rate = self._calculate_win_rate()
+        infos = [
+            {
+                'portfolio_value': self.portfolio_value[i],
+                'balance': self.balance[i],
+                'num_positions': int(num_positions[i]),
+                'num_trades': int(self.num_trades[i]),
+                'win_rate': win_rate[i],
+                'pnl': self.portfolio_value[i] - self.initial_balance
+            }
+            for i in range(self.num_envs)
+        ]
+        if self.order_book is not None:
+            for i, info in enumerate(infos):
+                info['fill_size'] = int(self.fill_size[i])
+                info['slippage'] = self.slippage[i]
+        return infos
+    
+    def close(self) -> None:
+        pass
+    
+    def get_attr(self, attr_name: str, indices=None) -> List[Any]:
+        '''Per-episode state is split by index, anything else is shared by all episodes'''
+        value = getattr(self, attr_name)
+        indices = self._get_indices(indices)
+        if attr_name in self.PER_ENV_ATTRS:
+            return [value[i] for i in indices]
+        return [value for _ in indices]
+    
+    def set_attr(self, attr_name: str, value: Any, indices=None) -> None:
+        indices = self._get_indices(indices)
+        if attr_name in self.PER_ENV_ATTRS:
+            target = getattr(self, attr_name)
+            for i in indices:
+                target[i] = value
+        elif self._targets_all(indices):
+            setattr(self, attr_name, value)
+        else:
+            raise NotImplementedError(f'{attr_name} is shared by all episodes and cannot be set per index')
+    
+    def env_method(self, method_name: str, *method_args, indices=None, **method_kwargs) -> List[Any]:
+        indices = list(self._get_indices(indices))
+        if method_name == 'reset':
+            return self._reset_indices(indices, *method_args, **method_kwargs)
+        if not self._targets_all(indices):
+            raise NotImplementedError(f'{method_name} acts on every episode and cannot be called per index')
+        # One call covers every episode, its result is shared like a shared attribute
+        result = getattr(self, method_name)(*method_args, **method_kwargs)
+        return [result for _ in indices]
+    
+    def _targets_all(self, indices) -> bool:
+        return sorted(indices) == list(range(self.num_envs))
+    
+    def _reset_indices(self, indices: List[int], seed: Optional[int] = None,
+                       options: Optional[Dict] = None) -> List[Tuple[np.ndarray, Dict]]:
+        '''Reset only the given episodes, returning (obs, info) per episode like KalshiTradingEnv.reset'''
+        if seed is not None:
+            for i in indices:
+                self.rngs[i] = np.random.default_rng(seed)
+        self._reset_envs(np.asarray(indices, dtype=np.int64), [options] * len(indices))
+        observations = self._get_observations()
+        infos = self._get_infos()
+        return [(observations[i].copy(), infos[i]) for i in indices]
+    
+    def env_is_wrapped(self, wrapper_class, indices=None) -> List[bool]:
+        return [False for _ in self._get_indices(indices)]
@@ -0,0 +1,205 @@
+﻿import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from data.splits import Fold, walk_forward
+from rl.environment import KalshiTradingEnv
+from rl.experiment import feature_store, load_dataset, make_env_kwargs, save_settings
+from rl.market_data import MarketArrays
+from utils.metrics import aggregate, episode_metrics
+
+# PPO settings from scripts/train.py plus the walk-forward layout
+CONFIG = {
+    'learning_rate': 3e-4,
+    'n_steps': 2048,
+    'batch_size': 64,
+    'n_epochs': 10,
+    'gamma': 0.99,
+    'gae_lambda': 0.95,
+    'clip_range': 0.2,
+    'ent_coef': 0.05,
+    'vf_coef': 0.5,
+    'max_grad_norm': 0.5,
+    'timesteps_per_fold': 200000,
+    'initial_balance': 10000,
+    'data_repair': 'mask',  # repair_ohlcv policy, as in train.py
+    'higher_timeframes': (),  # Resampled bar features in state slots 8-19, as in train.py
+    'strike_ladder': False,  # Market options as in train.py
+    'order_book': False,
+    'quote_store': None,
+    'expiry_steps': 1,
+    'monte_carlo': False,
+    'n_folds': 6,  # Most recent folds that fit in the data
+    'train_days': 60,
+    'test_days': 14,
+    'gap_days': 0,  # Bars skipped between each train and test window
+    'expanding': False,  # Train on everything before the test window instead of a rolling window
+    'workers': None,  # Defaults to cpu_count // threads_per_worker
+    'threads_per_worker': 1,
+    'seed': 0
+}
+
+BARS_PER_DAY = 96
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+REPORT_METRICS = ('total_return', 'sharpe_ratio', 'max_drawdown', 'num_trades', 'win_rate')
+
+def make_folds(length: int, config: Dict[str, Any]) -> List[Fold]:
+    '''The config's n_folds most recent walk-forward folds'''
+    folds = walk_forward(
+        length,
+        train_size=config['train_days'] * BARS_PER_DAY,
+        test_size=config['test_days'] * BARS_PER_DAY,
+        expanding=config['expanding'],
+        gap=config['gap_days'] * BARS_PER_DAY
+    )
+    return folds[-config['n_folds']:]
+
+def _limit_threads(threads: int):
+    '''Pool initializer: keep each worker's torch on its share of the cores'''
+    import torch
+    torch.set_num_threads(threads)
+
+def run_fold(index: int, train_spec: Dict[str, Any], test_spec: Dict[str, Any], config: Dict[str, Any],
+             model_dir: str) -> Dict[str, Any]:
+    '''Train one fold's model and evaluate it on the fold's test window (runs in a worker)'''
+    from stable_baselines3 import PPO
+    from stable_baselines3.common.monitor import Monitor
+    
+    start = time.perf_counter()
+    env_kwargs = make_env_kwargs(config)
+    train_env = Monitor(KalshiTradingEnv.from_shared_memory(train_spec, **env_kwargs))
+    test_env = KalshiTradingEnv.from_shared_memory(test_spec, **env_kwargs)
+    try:
+        model = PPO(
+            'MlpPolicy',
+            train_env,
+            learning_rate=config['learning_rate'],
+            n_steps=config['n_steps'],
+            batch_size=config['batch_size'],
+            n_epochs=config['n_epochs'],
+            gamma=config['gamma'],
+            gae_lambda=config['gae_lambda'],
+            clip_range=config['clip_range'],
+            ent_coef=config['ent_coef'],
+            vf_coef=config['vf_coef'],
+            max_grad_norm=config['max_grad_norm'],
+            seed=config['seed'] + index,
+            device='cpu',
+            verbose=0
+        )
+        model.learn(total_timesteps=config['timesteps_per_fold'])
+        model_path = os.path.join(model_dir, f'fold_{index}')
+        model.save(model_path)
+        save_settings(model_path, config)
+        
+        # One deterministic pass over the whole test window
+        obs, info = test_env.reset()
+        portfolio_history = [info['portfolio_value']]
+        done = False
+        while not done:
+            action, _ = model.predict(obs, deterministic=True)
+            obs, reward, terminated, truncated, info = test_env.step(action)
+            done = terminated or truncated
+            portfolio_history.append(info['portfolio_value'])
+        
+        metrics = episode_metrics(portfolio_history, config['initial_balance'], info['num_trades'], info['win_rate'])
+        metrics.update(fold=index, model_path=model_path + '.zip', seconds=time.perf_counter() - start)
+        return metrics
+    finally:
+        train_env.close()
+        test_env.close()
+
+def run_walk_forward(market_data: MarketArrays, folds: List[Fold], config: Dict[str, Any],
+                     model_dir: str, workers: Optional[int] = None) -> Dict[str, Any]:
+    '''
+    Train and evaluate every fold in a process pool
+    
+    The data goes into one shared-memory block and each worker attaches to
+    its fold's rows, so no fold copies it. Workers are capped at
+    threads_per_worker BLAS/torch threads, so workers * threads_per_worker
+    should not exceed the core count. A fold that fails is reported with its
+    error instead of stopping the others.
+    '''
+    threads = config['threads_per_worker']
+    workers = workers or config['workers'] or max((os.cpu_count() or 1) // threads, 1)
+    os.makedirs(model_dir, exist_ok=True)
+    
+    # Spawned workers read these when numpy and torch load, before the initializer runs
+    saved_env = {name: os.environ.get(name) for name in THREAD_ENV_VARS}
+    os.environ.update({name: str(threads) for name in THREAD_ENV_VARS})
+    shared = market_data.to_shared_memory()
+    results, errors = [], []
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(folds)), mp_context=get_context('spawn'),
+                                 initializer=_limit_threads, initargs=(threads,)) as executor:
+            futures = {
+                executor.submit(run_fold, fold.index, fold.train.view(shared).shared_memory_spec,
+                                fold.test.view(shared).shared_memory_spec, config, model_dir): fold
+                for fold in folds
+            }
+            for future in as_completed(futures):
+                fold = futures[future]
+                try:
+                    result = future.result()
+                except Exception:
+                    errors.append({'fold': fold.index, 'error': traceback.format_exc()})
+                    print(f'❌ Fold {fold.index} failed')
+                    continue
+                results.append(result)
+                print(f'✓ Fold {fold.index}: return {result["total_return"]*100:.2f}%, '
+                      f'Sharpe {result["sharpe_ratio"]:.2f} ({result["seconds"]:.0f}s)')
+    finally:
+        shared.unlink()
+        for name, value in saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    
+    results.sort(key=lambda result: result['fold'])
+    for result in results:
+        fold = next(f for f in folds if f.index == result['fold'])
+        result.update(train_rows=[fold.train.start, fold.train.stop], test_rows=[fold.test.start, fold.test.stop])
+    return {'config': config, 'folds': results, 'errors': errors, 'summary': aggregate(results, REPORT_METRICS)}
+
+if __name__ == '__main__':
+    print('🔁 Walk-Forward Cross-Validation')
+    print('=' * 60)
+    
+    data_path = os.path.join('..', '..', 'data', 'raw', 'btc_15m_6months.csv')
+    df, _ = load_dataset(data_path, CONFIG['data_repair'])
+    market_data = feature_store(os.path.join('..', '..', 'data', 'features'), CONFIG).get(df)
+    
+    folds = make_folds(len(market_data), CONFIG)
+    if not folds:
+        print(f'❌ {len(market_data):,} rows is too short for {CONFIG["train_days"]}+{CONFIG["test_days"]} day folds')
+        sys.exit(1)
+    
+    print(f'{len(folds)} folds over {len(market_data):,} rows:')
+    for fold in folds:
+        print(f'  {fold}')
+    print()
+    
+    report = run_walk_forward(market_data, folds, CONFIG, os.path.join('..', '..', 'models', 'walk_forward'))
+    
+    print()
+    print(f'{"Metric":<15} | {"Mean":>10} | {"Std":>10} | {"Min":>10} | {"Max":>10}')
+    print('-' * 65)
+    for name, stats in report['summary'].items():
+        print(f'{name:<15} | {stats["mean"]:>10.4f} | {stats["std"]:>10.4f} | {stats["min"]:>10.4f} | {stats["max"]:>10.4f}')
+    
+    os.makedirs(os.path.join('..', '..', 'logs'), exist_ok=True)
+    report_path = os.path.join('..', '..', 'logs', 'walk_forward_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\n✓ Report saved to: {report_path}')
+    if report['errors']:
+        print(f'⚠️ {len(report["errors"])} folds failed, see the report for tracebacks')
@@ -75,6 +75,17 @@ class KalshiClient:
             print(f'Error getting markets: {e}')
             return []
     
+    def get_orderbook(self, ticker: str, depth: Optional[int] = None) -> Dict:
+        try:
+            params = {'depth': depth} if depth else None
+            response = self._request('GET', f'/trade-api/v2/markets/{ticker}/orderbook', params=params)
+            if response.status_code == 200:
+                return response.json().get('orderbook') or {}
+            return {}
+        except Exception as e:
+            print(f'Error getting orderbook for {ticker}: {e}')
+            return {}
+    
     def create_order(self, ticker: str, side: str, action: str, 
                      count: int, price: int) -> Dict:
         try:
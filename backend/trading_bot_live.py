@@ -4,10 +4,10 @@ import os
 import requests
 from datetime import datetime
 from typing import Dict, Any
-import numpy as np
 from stable_baselines3 import PPO
 from trading.kalshi_client import KalshiClient
-from rl.features import FeatureEngineering
+from rl.experiment import check_live_support, load_settings
+from rl.features import StreamingFeatureEngineering
 
 os.makedirs('logs', exist_ok=True)
 
@@ -30,14 +30,16 @@ class RLTradingBot:
         
         self.logger.info(f'Loading RL model from {model_path}')
         self.model = PPO.load(model_path)
+        # States here only carry spot-price features, refuse models that were trained on more
+        check_live_support(load_settings(model_path))
         self.logger.info('Model loaded')
         
         self.kalshi = KalshiClient(api_key, private_key_path)
         self.logger.info('Kalshi client initialized')
         
-        self.feature_engineer = FeatureEngineering(lookback_window=24)
+        # Seed with initial prices
+        self.feature_engineer = StreamingFeatureEngineering(lookback_window=24, initial_prices=[106000.0] * 24)
         
-        self.price_history = [106000.0] * 24  # Seed with initial prices
         self.positions = []
         self.trade_history = []
         self.balance = 10000 if paper_trading else 0
@@ -63,7 +65,7 @@ class RLTradingBot:
                 return price
         except:
             pass
-        return self.price_history[-1] if self.price_history else 106000.0
+        return self.feature_engineer.last_price if len(self.feature_engineer) else 106000.0
     
     def get_available_markets(self) -> list:
         try:
@@ -76,13 +78,7 @@ class RLTradingBot:
     
     def make_decision(self, market: Dict[str, Any]) -> tuple:
         current_price = self.get_current_btc_price()
-        self.price_history.append(current_price)
-        
-        if len(self.price_history) > 1000:
-            self.price_history = self.price_history[-1000:]
-        
-        price_array = np.array(self.price_history)
-        price_features = self.feature_engineer.extract_features(price_array, len(price_array) - 1)
+        price_features = self.feature_engineer.update(current_price)
         
         hour = datetime.now().hour
         time_features = {
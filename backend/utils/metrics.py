@@ -0,0 +1,63 @@
+﻿import numpy as np
+from typing import Dict, Iterable, Mapping, Optional, Sequence
+
+# 15-minute bars, traded around the clock
+PERIODS_PER_YEAR = 365 * 96
+
+def returns_from_values(portfolio_values: Sequence[float]) -> np.ndarray:
+    '''Step returns of a portfolio value series, dropping steps that start at zero'''
+    values = np.asarray(portfolio_values, dtype=np.float64)
+    previous = values[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.diff(values) / previous
+    return returns[np.isfinite(returns)]
+
+def sharpe_ratio(returns: np.ndarray, periods_per_year: int = PERIODS_PER_YEAR) -> float:
+    '''Annualized Sharpe ratio of per-step returns, 0 when they don't vary'''
+    if len(returns) < 2 or np.std(returns) == 0:
+        return 0.0
+    return float(np.mean(returns) / np.std(returns) * np.sqrt(periods_per_year))
+
+def max_drawdown(portfolio_values: Sequence[float]) -> float:
+    '''Largest peak-to-trough fall as a (negative) fraction of the peak'''
+    values = np.asarray(portfolio_values, dtype=np.float64)
+    if len(values) == 0:
+        return 0.0
+    peaks = np.maximum.accumulate(values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = np.where(peaks > 0, (values - peaks) / peaks, 0.0)
+    return float(drawdowns.min())
+
+def episode_metrics(portfolio_values: Sequence[float], initial_balance: float, num_trades: int = 0,
+                    win_rate: float = 0.0, periods_per_year: int = PERIODS_PER_YEAR) -> Dict[str, float]:
+    '''Return, risk and trading statistics of one evaluation episode'''
+    returns = returns_from_values(portfolio_values)
+    final_value = float(portfolio_values[-1]) if len(portfolio_values) else initial_balance
+    return {
+        'final_value': final_value,
+        'pnl': final_value - initial_balance,
+        'total_return': (final_value - initial_balance) / initial_balance,
+        'sharpe_ratio': sharpe_ratio(returns, periods_per_year),
+        'max_drawdown': max_drawdown(portfolio_values),
+        'volatility': float(np.std(returns)) if len(returns) else 0.0,
+        'num_trades': int(num_trades),
+        'win_rate': float(win_rate),
+        'steps': max(len(portfolio_values) - 1, 0)
+    }
+
+def aggregate(results: Iterable[Mapping[str, float]], keys: Optional[Sequence[str]] = None) -> Dict[str, Dict[str, float]]:
+    '''Mean, std, min and max of each metric across runs, e.g. walk-forward folds'''
+    results = list(results)
+    if not results:
+        return {}
+    keys = keys or [key for key, value in results[0].items() if isinstance(value, (int, float))]
+    summary = {}
+    for key in keys:
+        values = np.array([result[key] for result in results], dtype=np.float64)
+        summary[key] = {
+            'mean': float(values.mean()),
+            'std': float(values.std()),
+            'min': float(values.min()),
+            'max': float(values.max())
+        }
+    return summary
@@ -0,0 +1,52 @@
+﻿import os
+import sys
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from data.fetcher import convert_csv, load_ohlcv
+
+def best_of(fn, repeats=5):
+    '''Fastest of several runs, in milliseconds'''
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times)
+
+def load_csv(path):
+    df = pd.read_csv(path)
+    df['datetime'] = pd.to_datetime(df['datetime'])
+    return df
+
+if __name__ == '__main__':
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else '../data/raw/btc_15m_6months.csv'
+    
+    print('⏱️ Candle Loading Benchmark')
+    print('=' * 60)
+    print(f'Source: {csv_path} ({os.path.getsize(csv_path) / (1024*1024):.2f} MB)')
+    
+    start = time.perf_counter()
+    dataset = convert_csv(csv_path)
+    print(f'One-time conversion: {(time.perf_counter() - start) * 1000:.1f} ms -> {dataset}')
+    
+    df = load_csv(csv_path)
+    cutoff = df['datetime'].iloc[int(len(df) * 0.9)]
+    print(f'Rows: {len(df):,}')
+    print()
+    
+    results = [
+        ('CSV + to_datetime', best_of(lambda: load_csv(csv_path))),
+        ('Columnar, all columns', best_of(lambda: load_ohlcv(csv_path))),
+        ('Columnar, datetime + close', best_of(lambda: load_ohlcv(csv_path, columns=['datetime', 'close']))),
+        ('Columnar, last 10% by date', best_of(lambda: load_ohlcv(csv_path, start=cutoff))),
+        ('Columnar, close as memmap', best_of(lambda: load_ohlcv(csv_path, columns=['close'], as_frame=False)))
+    ]
+    
+    baseline = results[0][1]
+    print(f'{"Method":<30} | {"Time (ms)":>10} | {"Speedup":>8}')
+    print('-' * 60)
+    for name, ms in results:
+        print(f'{name:<30} | {ms:>10.2f} | {baseline / ms:>7.1f}x')
@@ -3,10 +3,14 @@ import pandas as pd
 from datetime import datetime, timedelta
 import os
 import sys
-import time
 
-def download_btc_data(months=6, timeframe='15m'):
-    '''Download historical BTC/USD data from Coinbase'''
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from data.fetcher import OHLCVDownloader, DownloadError, load_ohlcv
+from data.preprocessor import validate_ohlcv
+
+def download_btc_data(months=6, timeframe='15m', incremental=True):
+    '''Download historical BTC/USD data from Coinbase, only fetching new candles if the file exists'''
     print(f'📊 Downloading {months} months of BTC data from Coinbase...')
     print('=' * 60)
     
@@ -23,60 +27,39 @@ def download_btc_data(months=6, timeframe='15m'):
     print(f'Date range: {start_date.date()} to {end_date.date()}')
     print(f'Timeframe: {timeframe}')
     
-    since = int(start_date.timestamp() * 1000)
-    all_ohlcv = []
-    symbol = 'BTC/USD'
+    os.makedirs('../data/raw', exist_ok=True)
+    output_file = f'../data/raw/btc_{timeframe}_{months}months.csv'
+    
+    if incremental and os.path.exists(output_file):
+        print(f'Appending candles newer than the last one in {output_file}')
     
+    symbol = 'BTC/USD'
     print(f'\nFetching {timeframe} candles for {symbol}...')
     
-    batch_count = 0
-    while True:
-        try:
-            ohlcv = exchange.fetch_ohlcv(symbol, timeframe, since=since, limit=300)
-            
-            if not ohlcv or len(ohlcv) == 0:
-                print('\nNo more data available')
-                break
-            
-            all_ohlcv.extend(ohlcv)
-            since = ohlcv[-1][0] + 1
-            batch_count += 1
-            
-            current_date = datetime.fromtimestamp(ohlcv[-1][0] / 1000)
-            print(f'  Batch {batch_count}: Fetched up to {current_date.date()} ({len(all_ohlcv):,} candles)', end='\r')
-            
-            if since > int(end_date.timestamp() * 1000):
-                break
-            
-            time.sleep(0.1)
-                
-        except Exception as e:
-            print(f'\n⚠️ Error: {e}')
-            if len(all_ohlcv) > 0:
-                print(f'Continuing with {len(all_ohlcv):,} candles fetched so far...')
-                break
-            else:
-                print('❌ No data fetched')
-                sys.exit(1)
-    
-    print(f'\n\n✓ Total candles fetched: {len(all_ohlcv):,}')
-    
-    if len(all_ohlcv) == 0:
+    downloader = OHLCVDownloader(exchange, symbol, timeframe, batch_limit=300)
+    try:
+        new_rows = downloader.download(
+            output_file, int(start_date.timestamp() * 1000), int(end_date.timestamp() * 1000),
+            incremental=incremental
+        )
+        print(f'✓ Fetched {len(new_rows):,} new candles')
+    except DownloadError as e:
+        # Everything before the failed chunk was saved - rerunning resumes from there
+        print(f'\n⚠️ Error: {e}')
+        print(f'Kept {len(e.partial):,} candles fetched before the failure, rerun to resume')
+    
+    df = load_ohlcv(output_file)
+    
+    if len(df) == 0:
         print('❌ No data fetched.')
         sys.exit(1)
     
-    df = pd.DataFrame(
-        all_ohlcv,
-        columns=['timestamp', 'open', 'high', 'low', 'close', 'volume']
-    )
-    
-    df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
-    df = df[['datetime', 'timestamp', 'open', 'high', 'low', 'close', 'volume']]
-    
-    os.makedirs('../data/raw', exist_ok=True)
-    
-    output_file = f'../data/raw/btc_{timeframe}_{months}months.csv'
-    df.to_csv(output_file, index=False)
+    report = validate_ohlcv(df, downloader.timeframe_ms)
+    print(f'\n🔎 Data quality:\n{report.summary()}')
+    if report.gaps:
+        print(f'⚠️ Largest gap {max(b - a for a, b in report.gaps) / 60000:.0f} minutes')
+    if report.ok:
+        print('✓ No problems found')
     
     print(f'\n✓ Data saved to: {output_file}')
     print(f'  Rows: {len(df):,}')
@@ -0,0 +1,46 @@
+﻿import os
+import sys
+import numpy as np
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from data.recorder import MarketRecorder, load_quotes
+from trading.kalshi_client import KalshiClient
+
+# Poll the BTC markets every minute, writing a part file every 15 polls
+CONFIG = {
+    'series': ('KXBTC', 'KXBTCD'),
+    'interval': 60,
+    'orderbook_depth': 5,  # Levels per side, 0 to skip order books
+    'flush_every': 15,
+    'duration_hours': None  # None records until Ctrl-C
+}
+
+if __name__ == '__main__':
+    print('📼 Kalshi Market Recorder')
+    print('=' * 60)
+    
+    load_dotenv()
+    key_id = os.getenv('KALSHI_API_KEY_ID')
+    private_key_path = os.getenv('KALSHI_PRIVATE_KEY_PATH')
+    if not key_id or not private_key_path:
+        print('❌ Set KALSHI_API_KEY_ID and KALSHI_PRIVATE_KEY_PATH')
+        sys.exit(1)
+    
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.join('..', 'data', 'quotes')
+    recorder = MarketRecorder(
+        KalshiClient(key_id, private_key_path), root,
+        series=CONFIG['series'],
+        interval=CONFIG['interval'],
+        orderbook_depth=CONFIG['orderbook_depth'],
+        flush_every=CONFIG['flush_every']
+    )
+    print(f'Recording {", ".join(CONFIG["series"])} every {CONFIG["interval"]}s to {root} (Ctrl-C to stop)')
+    print()
+    
+    duration = CONFIG['duration_hours'] * 3600 if CONFIG['duration_hours'] else None
+    recorder.record(duration=duration)
+    
+    quotes = load_quotes(root, columns=['ticker'])
+    print(f'\n✓ Store holds {len(quotes["ticker"]):,} market quotes over {len(np.unique(quotes["timestamp"])):,} snapshots')
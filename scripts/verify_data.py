@@ -1,9 +1,16 @@
-﻿import pandas as pd
+﻿import os
+import sys
+import pandas as pd
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from data.fetcher import load_ohlcv
+from data.preprocessor import validate_ohlcv
+
 # Load data
-df = pd.read_csv('data/raw/btc_1h_6months.csv')
-df['datetime'] = pd.to_datetime(df['datetime'])
+data_path = sys.argv[1] if len(sys.argv) > 1 else 'data/raw/btc_1h_6months.csv'
+df = load_ohlcv(data_path)
 
 print('📊 Data Verification')
 print('=' * 60)
@@ -13,12 +20,13 @@ print(f'Missing values: {df.isnull().sum().sum()}')
 print(f'\nColumns: {list(df.columns)}')
 print(f'\nData types:\n{df.dtypes}')
 
-# Check for any gaps in data
-df['time_diff'] = df['datetime'].diff()
-gaps = df[df['time_diff'] > pd.Timedelta(hours=1)]
-if len(gaps) > 0:
-    print(f'\n⚠️ Found {len(gaps)} time gaps:')
-    print(gaps[['datetime', 'time_diff']].head())
+# Gaps, duplicates, broken bars and spikes, with the bar interval inferred from the data
+report = validate_ohlcv(df)
+print(f'\n🔎 Data quality:\n{report.summary()}')
+if report.gaps:
+    print(f'\n⚠️ Found {len(report.gaps)} time gaps:')
+    for before, after in report.gaps[:5]:
+        print(f'  {pd.to_datetime(before, unit="ms")} -> {pd.to_datetime(after, unit="ms")}')
 else:
     print('\n✓ No time gaps found')
 
@@ -26,4 +34,4 @@ else:
 print('\n📈 Price Statistics:')
 print(df[['open', 'high', 'low', 'close', 'volume']].describe())
 
-print('\n✅ Data looks good!')
+print('\n✅ Data looks good!' if report.ok else '\n⚠️ Run repair_ohlcv before training')